@@ -46,11 +46,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'flashcards.middleware.MetricsMiddleware',
+    'flashcards.middleware.NPlusOneMiddleware',
+    'flashcards.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'flashcards.middleware.ShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -125,4 +129,134 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 
 # Redirect URLs
 LOGIN_REDIRECT_URL = 'dashboard'
-LOGOUT_REDIRECT_URL = 'home'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = 'home'
+
+# Review history
+# Raw review events older than this are removed by `manage.py prune_review_events`;
+# the daily rollups used by the progress charts are kept.
+REVIEW_EVENT_RETENTION_DAYS = int(os.environ.get('REVIEW_EVENT_RETENTION_DAYS', 365))
+
+
+# Background jobs
+# When enabled, imports, topic exports, accepting shared decks/topics and deleting
+# topics are queued and run by `manage.py runjobs` instead of inside the request.
+BACKGROUND_JOBS = os.environ.get('BACKGROUND_JOBS', 'False') == 'True'
+# Uploads waiting to be imported and finished export files live here.
+JOB_RESULTS_DIR = Path(os.environ.get('JOB_RESULTS_DIR', BASE_DIR / 'job_results'))
+
+# Accepting a shared deck or topic links to the owner's cards instead of copying
+# them; recipients get their own progress and a private copy once they edit.
+SHARE_COPY_ON_WRITE = os.environ.get('SHARE_COPY_ON_WRITE', 'False') == 'True'
+
+# Request metrics
+# Per-view latency, query and response size metrics, served at /metrics/ to staff
+# users or to scrapers sending "Authorization: Bearer <METRICS_TOKEN>".
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'False') == 'True'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# With several worker processes, point this at a directory they share (cleared on
+# deploy); each process writes its totals there every METRICS_FLUSH_INTERVAL seconds.
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 10))
+
+# N+1 query detection
+# 'log' warns about query shapes repeated NPLUSONE_THRESHOLD or more times within
+# one request, naming the template line and code that ran them; 'raise' fails the
+# request instead; empty disables the check. Logs by default when DEBUG is on.
+NPLUSONE_DETECTION = os.environ.get('NPLUSONE_DETECTION', 'log' if DEBUG else '')
+NPLUSONE_THRESHOLD = int(os.environ.get('NPLUSONE_THRESHOLD', 5))
+
+# Offline learning
+# Deleted cards are reported to syncing clients for this many days; removed by
+# `manage.py prune_sync_tombstones`. Clients last synced earlier do a full sync.
+SYNC_TOMBSTONE_DAYS = int(os.environ.get('SYNC_TOMBSTONE_DAYS', 30))
+
+# SQLite profile
+# 'production' tunes the SQLite database for several concurrent workers: WAL lets
+# readers run while a transaction writes, every transaction takes the write lock
+# when it begins (BEGIN IMMEDIATE), so two writers cannot deadlock upgrading their
+# read locks, and a blocked writer waits up to SQLITE_BUSY_TIMEOUT milliseconds
+# instead of failing with "database is locked". 'default' keeps Django's stock setup.
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', 'production')
+SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+# Seconds a connection is kept open between requests. Under ASGI, set it to 0:
+# async views run their queries in short-lived threads, whose connections would
+# never be reused.
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+
+if SQLITE_PROFILE == 'production' and DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': DB_CONN_MAX_AGE > 0,
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': ';'.join([
+                'PRAGMA journal_mode=WAL',
+                # With WAL, NORMAL only syncs at checkpoints; a power loss may undo the
+                # last transactions but cannot corrupt the database.
+                'PRAGMA synchronous=NORMAL',
+                f'PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}',
+                f'PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}',
+                f'PRAGMA mmap_size={SQLITE_MMAP_SIZE}',
+                'PRAGMA temp_store=MEMORY',
+            ]),
+        },
+    })
+
+# Read replica
+# With DB_REPLICA_NAME set, the reads of GET and HEAD requests go to a second
+# database, the 'replica' alias (see flashcards.routers); writes stay on 'default'.
+# After a user writes, their reads stay on 'default' for REPLICA_STICKY_SECONDS,
+# so keep the replica's lag below that. With SQLite, the replica is a copy of the
+# database file kept fresh by `manage.py refresh_replica --interval <seconds>`.
+DB_REPLICA_NAME = os.environ.get('DB_REPLICA_NAME', '')
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+REPLICA_STICKY_COOKIE = 'read_primary'
+
+if DB_REPLICA_NAME:
+    DATABASES['replica'] = {**DATABASES['default'], 'NAME': DB_REPLICA_NAME, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_ROUTERS = ['flashcards.routers.ReplicaRouter']
+
+# Sharding
+# With DB_SHARDS above 1, each user's topics, decks, cards and review history live
+# in one of DB_SHARDS databases (see flashcards.sharding): shard 0 is the default
+# database, shard N the file db_shard<N>.sqlite3 beside it. Users, sessions and jobs
+# stay in the default database. Migrate every shard (`manage.py migrate --database
+# shard<N>`) after changing DB_SHARDS. Replaces the read replica routing.
+DB_SHARDS = int(os.environ.get('DB_SHARDS', 1))
+
+if DB_SHARDS > 1:
+    _default_db = Path(DATABASES['default']['NAME'])
+    for _index in range(1, DB_SHARDS):
+        DATABASES[f'shard{_index}'] = {
+            **DATABASES['default'],
+            'NAME': _default_db.with_name(f'{_default_db.stem}_shard{_index}{_default_db.suffix}'),
+        }
+    DATABASE_ROUTERS = ['flashcards.routers.ShardRouter']
+
+# Caching
+# The topic lists, the decks of a topic and the shared-with-me lists are cached per
+# user (see flashcards.caching). CACHE_BACKEND is 'locmem' (per process; fine for a
+# single worker), 'file' (shared by the workers of one machine, in the directory
+# CACHE_LOCATION) or 'redis' (CACHE_LOCATION is its URL; needs the redis package).
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'locmem')
+CACHE_LOCATION = os.environ.get('CACHE_LOCATION', '')
+CACHES = {
+    'default': {
+        'BACKEND': {
+            'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+            'file': 'django.core.cache.backends.filebased.FileBasedCache',
+            'redis': 'django.core.cache.backends.redis.RedisCache',
+        }[CACHE_BACKEND],
+        'LOCATION': CACHE_LOCATION or {
+            'locmem': 'flashcards',
+            'file': str(BASE_DIR / 'cache'),
+            'redis': 'redis://127.0.0.1:6379/0',
+        }[CACHE_BACKEND],
+    },
+}
+# Seconds a cached fragment is served as is, and then for how long a stale copy is
+# served while one request rebuilds it. A timeout of 0 turns the caching off.
+FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('FRAGMENT_CACHE_TIMEOUT', 300))
+FRAGMENT_CACHE_STALE = int(os.environ.get('FRAGMENT_CACHE_STALE', 30))
@@ -0,0 +1,109 @@
+"""
+Who may see a deck, answered in one query.
+
+A user reaches a deck as its owner, because the deck or its topic is
+shared with them, or through a deck of their own linked to it (see
+flashcards.linked). deck_role() resolves one deck with EXISTS lookups on
+the share tables' (user, deck/topic) indexes, so the cost does not grow
+with the number of recipients, and remembers the answer for the rest of
+the request. viewable_decks() is the same rule as a queryset filter.
+Async views use the a-prefixed variants.
+"""
+from django.db.models import Case, CharField, Exists, OuterRef, Q, Value, When
+from django.http import Http404
+
+from .models import Deck, Topic
+
+OWNER = 'owner'
+SHARED_DECK = 'shared-deck'
+SHARED_TOPIC = 'shared-topic'
+LINKED = 'linked'
+
+# Roles that may view a deck's cards and learn with them.
+VIEW_ROLES = (OWNER, SHARED_DECK, SHARED_TOPIC, LINKED)
+
+
+def _role(user):
+    """An expression for the user's role on the outer deck, or NULL without access."""
+    deck_shares = Deck.shared_with.through.objects.filter(deck_id=OuterRef('pk'), user_id=user.pk)
+    topic_shares = Topic.shared_with.through.objects.filter(topic_id=OuterRef('topic_id'), user_id=user.pk)
+    linked_decks = Deck.objects.filter(topic__user_id=user.pk, source_deck_id=OuterRef('pk'))
+    return Case(
+        When(topic__user_id=user.pk, then=Value(OWNER)),
+        When(Exists(deck_shares), then=Value(SHARED_DECK)),
+        When(Exists(topic_shares), then=Value(SHARED_TOPIC)),
+        When(Exists(linked_decks), then=Value(LINKED)),
+        default=None,
+        output_field=CharField(),
+    )
+
+
+def _cache(request):
+    try:
+        return request._deck_roles
+    except AttributeError:
+        request._deck_roles = {}
+        return request._deck_roles
+
+
+def deck_role(request, deck_id):
+    """The request user's role on a deck (OWNER, SHARED_DECK, ...), or None."""
+    cache = _cache(request)
+    if deck_id not in cache:
+        cache[deck_id] = (
+            Deck.objects.filter(pk=deck_id).annotate(role=_role(request.user)).values_list('role', flat=True).first()
+        )
+    return cache[deck_id]
+
+
+def get_deck_or_404(request, pk, queryset=None):
+    """
+    Fetches a deck together with the request user's role on it (as
+    `deck.role`, None without access). Raises Http404 if it does not exist.
+    """
+    queryset = Deck.objects.select_related('topic') if queryset is None else queryset
+    deck = queryset.annotate(role=_role(request.user)).filter(pk=pk).first()
+    if deck is None:
+        raise Http404("No deck found matching the query")
+    _cache(request)[deck.pk] = deck.role
+    return deck
+
+
+async def aget_deck_or_404(request, pk, queryset=None):
+    """get_deck_or_404() for async views."""
+    queryset = Deck.objects.select_related('topic') if queryset is None else queryset
+    deck = await queryset.annotate(role=_role(await request.auser())).filter(pk=pk).afirst()
+    if deck is None:
+        raise Http404("No deck found matching the query")
+    _cache(request)[deck.pk] = deck.role
+    return deck
+
+
+def get_viewable_deck_or_404(request, pk, queryset=None):
+    """Like get_deck_or_404(), but also raises Http404 when the user may not view the deck."""
+    deck = get_deck_or_404(request, pk, queryset)
+    if deck.role not in VIEW_ROLES:
+        raise Http404("No deck found matching the query")
+    return deck
+
+
+def viewable_decks_q(user, prefix=''):
+    """
+    A filter for decks the user may view; `prefix` applies it through a
+    relation, e.g. prefix='deck__' on cards. Linked-deck access is left out:
+    lists show the user's own linked deck instead of its source.
+    """
+    # Every branch tests a deck column against an indexed subquery, which lets
+    # SQLite answer the OR with one index lookup per branch.
+    own_topics = Topic.objects.filter(user_id=user.pk).values('pk')
+    deck_shares = Deck.shared_with.through.objects.filter(user_id=user.pk).values('deck_id')
+    topic_shares = Topic.shared_with.through.objects.filter(user_id=user.pk).values('topic_id')
+    return (
+        Q(**{f'{prefix}topic_id__in': own_topics})
+        | Q(**{f'{prefix}pk__in': deck_shares})
+        | Q(**{f'{prefix}topic_id__in': topic_shares})
+    )
+
+
+def viewable_decks(user):
+    return Deck.objects.filter(viewable_decks_q(user))
@@ -0,0 +1,106 @@
+"""
+Review history: the append-only ReviewEvent log and its DailyActivity rollup.
+
+Progress charts read the rollup (one row per user and day) instead of scanning
+cards or events. Raw events older than REVIEW_EVENT_RETENTION_DAYS can be
+pruned with the prune_review_events command; the rollup is kept.
+"""
+from collections import Counter
+from datetime import date, timedelta
+
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from . import sharding
+from .models import DailyActivity, ReviewEvent
+
+# Chart ranges offered on the dashboard, in days.
+PROGRESS_RANGES = (7, 30, 90, 365)
+
+
+def record_reviews(user, reviews):
+    """
+    Logs applied reviews and folds them into the daily rollup.
+    `reviews` is an iterable of (card_id, correct, reviewed_at).
+    """
+    events = [
+        ReviewEvent(user=user, card_id=card_id, correct=correct, reviewed_at=reviewed_at)
+        for card_id, correct, reviewed_at in reviews
+    ]
+    if not events:
+        return
+    ReviewEvent.objects.bulk_create(events, batch_size=500)
+
+    totals, correct = Counter(), Counter()
+    for event in events:
+        day = timezone.localdate(event.reviewed_at)
+        totals[day] += 1
+        correct[day] += event.correct
+    # A batch normally spans a single day, so this is usually one UPDATE.
+    for day, count in totals.items():
+        _add_to_rollup(user, day, count, correct[day])
+
+
+def _add_to_rollup(user, day, reviews, correct):
+    updated = DailyActivity.objects.filter(user=user, day=day).update(
+        reviews=F('reviews') + reviews, correct=F('correct') + correct
+    )
+    if updated:
+        return
+    try:
+        with sharding.atomic():
+            DailyActivity.objects.create(user=user, day=day, reviews=reviews, correct=correct)
+    except IntegrityError:
+        # Another request created today's row first.
+        DailyActivity.objects.filter(user=user, day=day).update(
+            reviews=F('reviews') + reviews, correct=F('correct') + correct
+        )
+
+
+def progress_series(user, days):
+    """
+    Returns (labels, reviews, correct) for a chart over the last `days` days.
+    The 7-day view is the current calendar week, the yearly view is grouped
+    by month, everything else is one bar per day.
+    """
+    today = timezone.localdate()
+    if days == 7:
+        start = today - timedelta(days=today.weekday())
+        buckets = [start + timedelta(days=i) for i in range(7)]
+        bucket_of, label = (lambda day: day), (lambda day: day.strftime("%a"))
+    elif days >= 365:
+        # The current month and the eleven before it.
+        year, month_index = divmod(today.year * 12 + today.month - 1 - 11, 12)
+        start = date(year, month_index + 1, 1)
+        buckets = []
+        month = start
+        while month <= today:
+            buckets.append(month)
+            month = date(month.year + (month.month == 12), month.month % 12 + 1, 1)
+        bucket_of, label = (lambda day: day.replace(day=1)), (lambda day: day.strftime("%b %Y"))
+    else:
+        start = today - timedelta(days=days - 1)
+        buckets = [start + timedelta(days=i) for i in range(days)]
+        bucket_of, label = (lambda day: day), (lambda day: day.strftime("%b %d"))
+
+    reviews, correct = Counter(), Counter()
+    rows = DailyActivity.objects.filter(user=user, day__gte=start, day__lte=today).values_list('day', 'reviews', 'correct')
+    for day, day_reviews, day_correct in rows:
+        reviews[bucket_of(day)] += day_reviews
+        correct[bucket_of(day)] += day_correct
+    return (
+        [label(bucket) for bucket in buckets],
+        [reviews[bucket] for bucket in buckets],
+        [correct[bucket] for bucket in buckets],
+    )
+
+
+def prune_review_events(before, batch_size=10000):
+    """Deletes raw events older than `before` in batches; returns the number deleted."""
+    deleted = 0
+    while True:
+        ids = list(ReviewEvent.objects.filter(reviewed_at__lt=before).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += ReviewEvent.objects.filter(pk__in=ids).delete()[0]
@@ -1,6 +1,33 @@
 from django.contrib import admin
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from . import search, sharding
 from .models import Topic, Deck, Card
 
+class ShardListFilter(admin.SimpleListFilter):
+    """Lists the objects of one shard (see flashcards.sharding); by default the admin user's own."""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(str(index), name) for index, name in enumerate(sharding.aliases())]
+
+    def queryset(self, request, queryset):
+        if self.value() not in {str(index) for index in range(len(sharding.aliases()))}:
+            return queryset
+        return queryset.using(sharding.alias(int(self.value())))
+
+class ShardedModelAdmin(admin.ModelAdmin):
+    """Change pages open on the shard the object's id names (see ShardMiddleware)."""
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        return (ShardListFilter, *list_filter) if sharding.enabled() else list_filter
+
+    def save_related(self, request, form, formsets, change):
+        with sharding.using_shard(form.instance._state.db):
+            super().save_related(request, form, formsets, change)
+
 class CardInline(admin.TabularInline):
     model = Card
     extra = 1 # How many extra forms to show
@@ -11,14 +38,21 @@ class DeckInline(admin.TabularInline):
     show_change_link = True
 
 @admin.register(Topic)
-class TopicAdmin(admin.ModelAdmin):
+class TopicAdmin(ShardedModelAdmin):
     list_display = ('name', 'user')
     search_fields = ('name', 'user__username')
     list_filter = ('user',)
     inlines = [DeckInline]
 
+    def save_model(self, request, obj, form, change):
+        if change or not sharding.enabled():
+            return super().save_model(request, obj, form, change)
+        # A topic added here goes to its owner's shard, like one they create themselves.
+        with sharding.using_shard(sharding.home_shard(obj.user_id)) as shard:
+            obj.save(using=shard)
+
 @admin.register(Deck)
-class DeckAdmin(admin.ModelAdmin):
+class DeckAdmin(ShardedModelAdmin):
     list_display = ('name', 'topic', 'get_topic_user')
     search_fields = ('name', 'topic__name')
     list_filter = ('topic__user', 'topic')
@@ -29,8 +63,17 @@ class DeckAdmin(admin.ModelAdmin):
         return obj.topic.user
 
 @admin.register(Card)
-class CardAdmin(admin.ModelAdmin):
+class CardAdmin(ShardedModelAdmin):
     list_display = ('front', 'deck', 'last_learned', 'learning_level')
     search_fields = ('front', 'back', 'deck__name')
     list_filter = ('deck__topic', 'deck', 'learning_level')
     ordering = ('-last_learned',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Card text is matched through the full-text index instead of LIKE scans.
+        expression = search.match_expression(search_term)
+        if not expression or not search.is_available():
+            return super().get_search_results(request, queryset, search_term)
+        sql, params = search.search_card_ids_sql(search_term)
+        matches = Q(pk__in=RawSQL(sql, params)) | Q(deck__name__icontains=search_term)
+        return queryset.filter(matches), False
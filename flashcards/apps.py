@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class FlashcardsConfig(AppConfig):
     name = 'flashcards'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .middleware import install_query_dispatch
+        from .sharding import shard_migrated
+
+        install_query_dispatch()
+        post_migrate.connect(shard_migrated, sender=self)
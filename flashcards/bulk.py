@@ -0,0 +1,146 @@
+"""
+Low-level bulk writes for paths where ORM per-object overhead dominates.
+
+bulk_create() compiles every object through the ORM (~45 µs per card on
+SQLite), which makes it the bottleneck of large imports. insert_cards() sends
+plain parameter tuples through executemany() instead, filling every column the
+caller does not supply from the model field's default, so new Card fields are
+picked up automatically. update_cards() likewise rewrites card text with one
+executemany() per batch, where bulk_update() builds a CASE expression per card.
+
+copy_cards() duplicates cards between decks with a single INSERT ... SELECT,
+so card contents never leave the database. It also materializes linked decks
+(see flashcards.linked), merging in the recipient's progress on the way.
+"""
+from itertools import islice
+
+from django.db import connections, router
+
+from .models import Card, CardProgress
+from .scheduling import SCHEDULE_FIELDS
+
+INSERT_BATCH_SIZE = 1000
+
+# Columns the caller supplies, in row order.
+CARD_CONTENT_FIELDS = ('deck', 'front', 'back')
+
+
+def _card_insert(connection):
+    fields = [field for field in Card._meta.concrete_fields if not field.primary_key]
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    sql = f'INSERT INTO {connection.ops.quote_name(Card._meta.db_table)} ({columns}) VALUES ({placeholders})'
+    # One template row holding the prepared defaults; content columns are overwritten per row.
+    template = [
+        None if field.name in CARD_CONTENT_FIELDS else field.get_db_prep_save(field.get_default(), connection)
+        for field in fields
+    ]
+    positions = [next(i for i, field in enumerate(fields) if field.name == name) for name in CARD_CONTENT_FIELDS]
+    return sql, template, positions
+
+
+def insert_cards(rows, using=None, batch_size=INSERT_BATCH_SIZE):
+    """
+    Inserts cards from an iterable of (deck_id, front, back) tuples and returns
+    the number inserted. Like bulk_create(), this sends no model signals.
+    """
+    using = using or router.db_for_write(Card)
+    connection = connections[using]
+    sql, template, positions = _card_insert(connection)
+    inserted = 0
+    batch = []
+    with connection.cursor() as cursor:
+        for row in rows:
+            values = list(template)
+            for position, value in zip(positions, row):
+                values[position] = value
+            batch.append(values)
+            if len(batch) >= batch_size:
+                cursor.executemany(sql, batch)
+                inserted += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            inserted += len(batch)
+    return inserted
+
+
+def update_cards(rows, using=None, batch_size=INSERT_BATCH_SIZE):
+    """
+    Sets the front and back of cards from an iterable of (card_id, front, back)
+    tuples and returns the number of rows given. Sends no model signals.
+    """
+    using = using or router.db_for_write(Card)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    front, back = (quote(Card._meta.get_field(name).column) for name in ('front', 'back'))
+    sql = (
+        f'UPDATE {quote(Card._meta.db_table)} SET {front} = %s, {back} = %s '
+        f'WHERE {quote(Card._meta.pk.column)} = %s'
+    )
+    updated = 0
+    rows = iter(rows)
+    with connection.cursor() as cursor:
+        while batch := [(front_text, back_text, card_id) for card_id, front_text, back_text in islice(rows, batch_size)]:
+            cursor.executemany(sql, batch)
+            updated += len(batch)
+    return updated
+
+
+# Upper bound on (old, new) deck pairs per statement, well below SQLite's variable limit.
+COPY_DECK_BATCH_SIZE = 5000
+
+
+def copy_cards(deck_pairs, using=None, batch_size=COPY_DECK_BATCH_SIZE, progress_user_id=None):
+    """
+    Copies the content of every card in the source decks of `deck_pairs`
+    ((source deck id, target deck id) pairs) into the target deck, keeping the
+    card order. Scheduling columns get their defaults, as for a new card, or,
+    with `progress_user_id`, that user's CardProgress where one exists.
+    Returns the number of cards copied; sends no model signals.
+    """
+    using = using or router.db_for_write(Card)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    fields = [field for field in Card._meta.concrete_fields if not field.primary_key]
+    columns = ', '.join(quote(field.column) for field in fields)
+    selected, defaults = [], []
+    for field in fields:
+        if field.name == 'deck':
+            selected.append('m.column2')
+        elif field.name in CARD_CONTENT_FIELDS:
+            selected.append(f'c.{quote(field.column)}')
+        elif progress_user_id is not None and field.name in SCHEDULE_FIELDS:
+            selected.append(f'COALESCE(p.{quote(field.column)}, %s)')
+            defaults.append(field.get_db_prep_save(field.get_default(), connection))
+        else:
+            selected.append('%s')
+            defaults.append(field.get_db_prep_save(field.get_default(), connection))
+    table = quote(Card._meta.db_table)
+    deck_column = quote(Card._meta.get_field('deck').column)
+    progress_join = ''
+    if progress_user_id is not None:
+        progress = CardProgress._meta
+        progress_join = (
+            f' LEFT OUTER JOIN {quote(progress.db_table)} p ON p.{quote(progress.get_field("card").column)} = c.'
+            f'{quote(Card._meta.pk.column)} AND p.{quote(progress.get_field("user").column)} = %s'
+        )
+    pairs = list(deck_pairs)
+    copied = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            mapping = ', '.join(['(%s, %s)'] * len(batch))
+            sql = (
+                f'INSERT INTO {table} ({columns}) '
+                f'SELECT {", ".join(selected)} FROM {table} c '
+                f'INNER JOIN (VALUES {mapping}) m ON c.{deck_column} = m.column1'
+                f'{progress_join} '
+                f'ORDER BY c.{quote(Card._meta.pk.column)}'
+            )
+            params = defaults + [value for pair in batch for value in pair]
+            if progress_user_id is not None:
+                params.append(progress_user_id)
+            cursor.execute(sql, params)
+            copied += cursor.rowcount
+    return copied
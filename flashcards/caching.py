@@ -0,0 +1,99 @@
+"""
+Per-user caching of rarely changing page fragments and querysets.
+
+Everything is cached per user under a key that includes the user's
+generation, a counter kept in the cache itself and bumped by
+bump_users(): the receivers in flashcards.signals bump the owners of
+topics and decks that are created, renamed or deleted and the users a
+deck or topic is (or stops being) shared with, and the bulk paths that
+skip model signals bump their users themselves. Content of one topic also
+varies on Topic.revision (see flashcards.revisions), so card edits do not
+touch the user's other fragments. Bumping changes the keys instead of
+deleting entries; the old entries age out of the cache.
+
+Entries stay fresh for FRAGMENT_CACHE_TIMEOUT seconds, which bounds how
+long a change no receiver sees (such as a renamed owner in the
+shared-with-me lists) can show. For FRAGMENT_CACHE_STALE seconds after
+that, the first request rebuilds the entry while concurrent ones are
+served the stale copy. Hits, misses and stale reads are counted per
+fragment in flashcards.metrics.
+
+The generations live in the cache, so with several worker processes the
+cache must be shared by them (CACHE_BACKEND 'file' or 'redis'): with the
+per-process 'locmem' backend a process does not see the other processes'
+bumps until its entries expire.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import metrics
+
+PREFIX = 'flashcards'
+
+
+def _user_key(user_id):
+    return f'{PREFIX}:user:{user_id}'
+
+
+def user_version(user_id):
+    """The user's generation; a new one starts from the clock so it never repeats an evicted one."""
+    key = _user_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        version = time.time_ns()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def _bump(user_ids):
+    for user_id in user_ids:
+        try:
+            cache.incr(_user_key(user_id))
+        except ValueError:
+            pass  # No generation yet, so nothing is cached for the user.
+
+
+def bump_users(user_ids):
+    """
+    Makes the users' cached entries unreachable, now and again when the
+    current transaction commits (a page rebuilt from the data as it was
+    before the commit must not be kept).
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    _bump(user_ids)
+    transaction.on_commit(lambda: _bump(user_ids))
+
+
+def fetch(name, user_id, parts, build):
+    """
+    Returns the cached value of fragment `name` for the user and `parts`
+    (values it varies on), calling build() to make it when needed.
+    """
+    if settings.FRAGMENT_CACHE_TIMEOUT <= 0:
+        return build()
+    key = ':'.join([PREFIX, name, str(user_id), str(user_version(user_id)), *map(str, parts)])
+    entry = cache.get(key)
+    now = time.time()
+    if entry is not None:
+        fresh_until, value = entry
+        if now < fresh_until:
+            metrics.record_cache(name, 'hit')
+            return value
+        # Stale: one request rebuilds it, the others keep using the old copy meanwhile.
+        if not cache.add(f'{key}:rebuild', True, timeout=max(settings.FRAGMENT_CACHE_STALE, 1)):
+            metrics.record_cache(name, 'stale')
+            return value
+    metrics.record_cache(name, 'miss')
+    value = build()
+    cache.set(
+        key, (now + settings.FRAGMENT_CACHE_TIMEOUT, value),
+        timeout=settings.FRAGMENT_CACHE_TIMEOUT + settings.FRAGMENT_CACHE_STALE,
+    )
+    cache.delete(f'{key}:rebuild')
+    return value
@@ -0,0 +1,127 @@
+"""
+Copying shared decks and topics into another user's collection.
+
+Copies are set-based: one INSERT ... SELECT per table level (decks, then
+cards), all inside one transaction, so card contents never pass through
+Python and a failed copy leaves nothing behind. With
+settings.SHARE_COPY_ON_WRITE, accepting a share links the decks instead
+(see flashcards.linked) and no cards are copied at all.
+
+Shares accepted from a user on another shard (see flashcards.sharding) are
+always copied, deck by deck, with the cards read from one database and
+written to the other.
+
+All functions return a mapping of old to new ids, e.g.
+{'topic': {3: 41}, 'decks': {7: 90, 8: 91}}.
+"""
+from django.conf import settings
+from django.db import connections, router
+
+from . import bulk, linked, sharding, stats
+from .models import Card, Deck, Topic
+from .signals import cards_changed
+
+
+def copy_deck(original_deck, target_topic):
+    """Copies `original_deck` and its cards into `target_topic`."""
+    with sharding.atomic():
+        new_deck = Deck.objects.create(name=original_deck.name, topic=target_topic)
+        bulk.copy_cards([(linked.content_deck_id(original_deck), new_deck.pk)])
+        cards_changed.send(sender=Card, deck_ids=[new_deck.pk])
+    return {'decks': {original_deck.pk: new_deck.pk}}
+
+
+def link_deck(original_deck, target_topic):
+    """Adds a deck to `target_topic` that shows the cards of `original_deck`."""
+    with sharding.atomic():
+        new_deck = Deck.objects.create(
+            name=original_deck.name, topic=target_topic, source_deck_id=linked.content_deck_id(original_deck)
+        )
+        cards_changed.send(sender=Card, deck_ids=[new_deck.pk])
+    return {'decks': {original_deck.pk: new_deck.pk}}
+
+
+def _copy_decks(original_topic, new_topic, link=False):
+    """
+    Inserts copies of the topic's decks in id order. Returns {old id: new id}
+    and {old id: id of the deck holding its cards}.
+    """
+    connection = connections[router.db_for_write(Deck)]
+    quote = connection.ops.quote_name
+    table = quote(Deck._meta.db_table)
+    id_, name, topic, source, revision = (
+        quote(Deck._meta.get_field(field).column) for field in ('id', 'name', 'topic', 'source_deck', 'revision')
+    )
+    # A link to a linked deck points at its source; a copy links to nothing.
+    source_value = f'COALESCE({source}, {id_})' if link else 'NULL'
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({name}, {topic}, {source}, {revision}) '
+            f'SELECT {name}, %s, {source_value}, 0 FROM {table} WHERE {topic} = %s ORDER BY {id_}',
+            [new_topic.pk, original_topic.pk],
+        )
+    # The rows were inserted in the original id order, so their new ids ascend in the same order.
+    originals = list(Deck.objects.filter(topic=original_topic).order_by('pk').values_list('pk', 'source_deck_id'))
+    new_ids = Deck.objects.filter(topic=new_topic).order_by('pk').values_list('pk', flat=True)
+    deck_ids = dict(zip((deck_id for deck_id, _ in originals), new_ids, strict=True))
+    content_ids = {deck_id: source_id or deck_id for deck_id, source_id in originals}
+    return deck_ids, content_ids
+
+
+def copy_topic(original_topic, user, link=False):
+    """Copies `original_topic` with all its decks (and, unless linking, cards) to `user`."""
+    with sharding.atomic():
+        new_topic = Topic.objects.create(name=original_topic.name, user=user)
+        deck_ids, content_ids = _copy_decks(original_topic, new_topic, link=link)
+        if not link:
+            bulk.copy_cards((content_ids[old_id], new_id) for old_id, new_id in deck_ids.items())
+        # The deck rows bypassed post_save, so their snapshot rows and counts are derived here.
+        cards_changed.send(sender=Card, deck_ids=list(deck_ids.values()))
+        stats.refresh_user_deck_counts([user.pk])
+    return {'topic': {original_topic.pk: new_topic.pk}, 'decks': deck_ids}
+
+
+def _copy_deck_across_shards(original_deck, target_topic):
+    """copy_deck() into a topic on another shard."""
+    cards = linked.deck_cards(original_deck).using(original_deck._state.db).order_by('pk')
+    with sharding.using_shard(target_topic._state.db), sharding.atomic():
+        new_deck = Deck.objects.create(name=original_deck.name, topic=target_topic)
+        bulk.insert_cards((new_deck.pk, front, back) for front, back in cards.values_list('front', 'back').iterator())
+        cards_changed.send(sender=Card, deck_ids=[new_deck.pk])
+    return {'decks': {original_deck.pk: new_deck.pk}}
+
+
+def _copy_topic_across_shards(original_topic, user, shard):
+    """copy_topic() of a topic on another shard than the user's `shard`."""
+    deck_ids = {}
+    with sharding.using_shard(shard), sharding.atomic():
+        new_topic = Topic.objects.create(name=original_topic.name, user=user)
+        for deck in original_topic.decks.select_related('topic').order_by('pk'):
+            deck_ids.update(_copy_deck_across_shards(deck, new_topic)['decks'])
+    return {'topic': {original_topic.pk: new_topic.pk}, 'decks': deck_ids}
+
+
+def accept_deck(original_deck, target_topic, user):
+    """Adds a deck shared with `user` to their `target_topic` and ends the share."""
+    if original_deck._state.db != target_topic._state.db:
+        ids = _copy_deck_across_shards(original_deck, target_topic)
+        original_deck.shared_with.remove(user)
+        return ids
+    add = link_deck if settings.SHARE_COPY_ON_WRITE else copy_deck
+    with sharding.atomic():
+        ids = add(original_deck, target_topic)
+        original_deck.shared_with.remove(user)
+    return ids
+
+
+def accept_topic(original_topic, user):
+    """Adds a topic shared with `user` to their collection and ends the share."""
+    shard = sharding.home_shard(user.pk)
+    if original_topic._state.db != shard:
+        ids = _copy_topic_across_shards(original_topic, user, shard)
+        original_topic.shared_with.remove(user)
+        return ids
+    with sharding.atomic():
+        ids = copy_topic(original_topic, user, link=settings.SHARE_COPY_ON_WRITE)
+        original_topic.shared_with.remove(user)
+    return ids
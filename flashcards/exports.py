@@ -0,0 +1,132 @@
+"""
+Streaming JSON export of topics and decks.
+
+The output is byte-for-byte what the previous JsonResponse-based export
+produced (json.dumps defaults: ASCII-escaped, ", " and ": " separators), so
+files stay importable by ImportView. Each export is driven by one ordered
+query read with .iterator(), and output is flushed in fixed-size chunks.
+"""
+import json
+import zlib
+
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+from . import linked
+from .models import Card, Deck
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_QUERY_CHUNK_SIZE = 2000
+
+_dumps = json.dumps
+
+
+def _card_json(front, back):
+    return '{"front": ' + _dumps(front) + ', "back": ' + _dumps(back) + '}'
+
+
+def iter_topic_json(topic):
+    yield '{"type": "topic", "name": ' + _dumps(topic.name) + ', "decks": ['
+    # LEFT JOINs, so decks without cards still appear (with a NULL card id). A
+    # linked deck has no cards of its own, so at most one of the joins matches.
+    rows = (
+        Deck.objects.filter(topic=topic)
+        .order_by('id', 'cards__id', 'source_deck__cards__id')
+        .values_list(
+            'id', 'name', 'cards__id', 'cards__front', 'cards__back',
+            'source_deck__cards__id', 'source_deck__cards__front', 'source_deck__cards__back',
+        )
+        .iterator(chunk_size=EXPORT_QUERY_CHUNK_SIZE)
+    )
+    current_deck = None
+    first_card = True
+    for deck_id, deck_name, card_id, front, back, linked_card_id, linked_front, linked_back in rows:
+        if card_id is None:
+            card_id, front, back = linked_card_id, linked_front, linked_back
+        if deck_id != current_deck:
+            prefix = '' if current_deck is None else ']}, '
+            yield prefix + '{"name": ' + _dumps(deck_name) + ', "cards": ['
+            current_deck, first_card = deck_id, True
+        if card_id is not None:
+            yield ('' if first_card else ', ') + _card_json(front, back)
+            first_card = False
+    if current_deck is not None:
+        yield ']}'
+    yield ']}'
+
+
+def iter_deck_json(deck):
+    yield '{"type": "deck", "name": ' + _dumps(deck.name) + ', "cards": ['
+    rows = (
+        Card.objects.filter(deck_id=linked.content_deck_id(deck))
+        .order_by('id')
+        .values_list('front', 'back')
+        .iterator(chunk_size=EXPORT_QUERY_CHUNK_SIZE)
+    )
+    separator = ''
+    for front, back in rows:
+        yield separator + _card_json(front, back)
+        separator = ', '
+    yield ']}'
+
+
+def iter_chunks(parts, size=EXPORT_CHUNK_SIZE):
+    buffer, length = [], 0
+    for part in parts:
+        buffer.append(part)
+        length += len(part)
+        if length >= size:
+            yield ''.join(buffer).encode()
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+def _gzipped(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _accepts_gzip(request):
+    """
+    Whether Accept-Encoding allows gzip, directly or through "*". A
+    q-value of 0 refuses the coding (RFC 9110, section 12.5.3).
+    """
+    qualities = {}
+    for entry in request.headers.get('Accept-Encoding', '').split(','):
+        coding, *params = (part.strip() for part in entry.split(';'))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    quality = qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0)))
+    return quality > 0
+
+
+def response_encoding(request):
+    """The Content-Encoding export_response() will use; strong ETags differ per encoding."""
+    return 'gzip' if _accepts_gzip(request) else 'identity'
+
+
+def export_response(request, parts, filename):
+    """Streams `parts` as a JSON attachment, gzip-encoded if the client accepts it."""
+    chunks = iter_chunks(parts)
+    gzip = _accepts_gzip(request)
+    if gzip:
+        chunks = _gzipped(chunks)
+    response = StreamingHttpResponse(chunks, content_type='application/json')
+    if gzip:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
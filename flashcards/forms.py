@@ -1,7 +1,8 @@
 from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.models import User
-from .models import Topic
+from . import sharding
+from .models import Card, Topic
 
 class RegistrationForm(UserCreationForm):
     class Meta(UserCreationForm.Meta):
@@ -18,7 +19,8 @@ class AcceptDeckForm(forms.Form):
         user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
         if user:
-            self.fields['topic'].queryset = Topic.objects.filter(user=user)
+            # The request may be routed to the shared deck's shard; the user's topics are on theirs.
+            self.fields['topic'].queryset = Topic.objects.using(sharding.home_shard(user.pk)).filter(user=user)
 
 class ShareTopicForm(forms.Form):
     email = forms.EmailField(label="Email to share with")
@@ -26,3 +28,9 @@ class ShareTopicForm(forms.Form):
 class ImportForm(forms.Form):
     file = forms.FileField(label="Select JSON File")
 
+class CardForm(forms.ModelForm):
+    """Validates one row of a bulk card edit (see views.bulk_edit_cards)."""
+    class Meta:
+        model = Card
+        fields = ['front', 'back']
+
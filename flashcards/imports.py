@@ -0,0 +1,269 @@
+"""
+Streaming import of exported topics and decks.
+
+The upload is parsed incrementally: the reader only ever holds the current
+chunk plus the card being decoded, so memory does not grow with file size.
+Cards are written in fixed-size batches (see flashcards.bulk), and the whole
+import runs in one transaction so a bad file never leaves a partial topic.
+"""
+import codecs
+import json
+import time
+
+from . import bulk, sharding
+from .models import Card, Deck, Topic
+from .signals import cards_changed
+
+IMPORT_BATCH_SIZE = 1000
+# Largest single JSON value (one card, one name) the reader will buffer.
+MAX_VALUE_LENGTH = 16 * 1024 * 1024
+# Rejected cards listed individually in the report; the rest are only counted.
+MAX_REPORTED_REJECTIONS = 50
+
+NAME_MAX_LENGTH = Topic._meta.get_field('name').max_length
+IMPORTED_SUFFIX = " (imported)"
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+class _JsonReader:
+    """Pull-style reader over a stream of byte chunks."""
+
+    _decoder = json.JSONDecoder()
+    _whitespace = ' \t\n\r'
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        if self._eof:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            text = self._text_decoder.decode(b'', final=True)
+        else:
+            text = self._text_decoder.decode(chunk)
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in self._whitespace:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ImportFormatError(f"Invalid file format: expected '{char}'.")
+        self._pos += 1
+
+    def accept(self, char):
+        if self.peek() == char:
+            self._pos += 1
+            return True
+        return False
+
+    def value(self):
+        """Decodes one complete JSON value (object, string, number, ...)."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                if len(self._buffer) - self._pos > MAX_VALUE_LENGTH or not self._fill():
+                    raise
+                continue
+            # A number or literal ending exactly at the buffer edge may continue in the next chunk.
+            if end == len(self._buffer) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+    def items(self):
+        """Iterates the keys of the object at the cursor; the caller consumes each value."""
+        self.expect('{')
+        if self.accept('}'):
+            return
+        while True:
+            key = self.value()
+            if not isinstance(key, str):
+                raise ImportFormatError("Object keys must be strings.")
+            self.expect(':')
+            yield key
+            if self.accept('}'):
+                return
+            self.expect(',')
+
+    def elements(self):
+        """Iterates the array at the cursor; the caller consumes each element."""
+        self.expect('[')
+        if self.accept(']'):
+            return
+        while True:
+            yield
+            if self.accept(']'):
+                return
+            self.expect(',')
+
+    def end(self):
+        if self.peek() != '':
+            raise ImportFormatError("Unexpected data after the end of the document.")
+
+
+def _imported_name(name, default):
+    if not isinstance(name, str) or not name:
+        name = default
+    return name[:NAME_MAX_LENGTH - len(IMPORTED_SUFFIX)] + IMPORTED_SUFFIX
+
+
+class ImportReport:
+    def __init__(self):
+        self.kind = None
+        self.topic = None
+        self.deck_count = 0
+        self.card_count = 0
+        self.rejected_count = 0
+        self.rejected = []  # (deck name, card index, reason), capped
+        self.elapsed = 0.0
+
+    def reject(self, deck_name, index, reason):
+        self.rejected_count += 1
+        if len(self.rejected) < MAX_REPORTED_REJECTIONS:
+            self.rejected.append((deck_name, index, reason))
+
+
+class _Importer:
+    def __init__(self, user, reader):
+        self.user = user
+        self.reader = reader
+        self.report = ImportReport()
+        self.pending_cards = []
+        self.deck_ids = []
+        self.document_name = None  # top-level "name": the topic's, or the deck's in a deck file
+
+    def _set_kind(self, kind):
+        if kind not in ('topic', 'deck'):
+            raise ImportFormatError(f'Invalid file format: unknown type "{kind}".')
+        if self.report.kind and self.report.kind != kind:
+            raise ImportFormatError('Invalid file format: "type" does not match the file contents.')
+        self.report.kind = kind
+
+    def _topic(self):
+        if self.report.topic is None:
+            if self.report.kind == 'topic':
+                # Renamed at the end if the topic's name only follows its decks.
+                name = _imported_name(self.document_name, 'Imported Topic')
+                self.report.topic = Topic.objects.create(name=name, user=self.user)
+            else:
+                self.report.topic, _ = Topic.objects.get_or_create(name="[Imported Decks]", user=self.user)
+        return self.report.topic
+
+    def _flush(self):
+        if self.pending_cards:
+            bulk.insert_cards(self.pending_cards, batch_size=IMPORT_BATCH_SIZE)
+            self.pending_cards = []
+
+    def _read_cards(self, deck, deck_name):
+        for index, _ in enumerate(self.reader.elements()):
+            card = self.reader.value()
+            if not isinstance(card, dict):
+                self.report.reject(deck_name, index, "not an object")
+            elif not isinstance(card.get('front'), str) or not isinstance(card.get('back'), str):
+                self.report.reject(deck_name, index, 'missing or non-text "front"/"back"')
+            else:
+                self.pending_cards.append((deck.pk, card['front'], card['back']))
+                self.report.card_count += 1
+                if len(self.pending_cards) >= IMPORT_BATCH_SIZE:
+                    self._flush()
+
+    def _read_deck(self, keys, default_name, suffix=False, name=None):
+        """Reads a deck object whose keys are yielded by `keys`. The deck row is
+        created lazily so a name that precedes the cards is used directly."""
+        deck = None
+        for key in keys:
+            if key == 'name':
+                name = self.reader.value()
+                if deck is not None:
+                    deck.name = self._deck_name(name, default_name, suffix)
+                    deck.save(update_fields=['name'])
+            elif key == 'cards':
+                if deck is None:
+                    deck = self._create_deck(name, default_name, suffix)
+                self._read_cards(deck, deck.name)
+            elif key == 'type' and suffix:
+                self._set_kind(self.reader.value())
+            else:
+                self.reader.value()  # unknown key, skipped
+        if deck is None:
+            deck = self._create_deck(name, default_name, suffix)
+        return deck
+
+    def _deck_name(self, name, default_name, suffix):
+        if suffix:
+            return _imported_name(name, default_name)
+        return (name if isinstance(name, str) and name else default_name)[:NAME_MAX_LENGTH]
+
+    def _create_deck(self, name, default_name, suffix):
+        deck = Deck.objects.create(name=self._deck_name(name, default_name, suffix), topic=self._topic())
+        self.deck_ids.append(deck.pk)
+        self.report.deck_count += 1
+        return deck
+
+    def run(self):
+        keys = self.reader.items()
+        for key in keys:
+            if key == 'type':
+                self._set_kind(self.reader.value())
+            elif key == 'name':
+                self.document_name = self.reader.value()
+            elif key == 'decks':
+                self._set_kind('topic')
+                for _ in self.reader.elements():
+                    self._read_deck(self.reader.items(), 'Imported Deck')
+            elif key == 'cards':
+                self._set_kind('deck')
+                # A deck file is itself the deck object; hand over the remaining keys.
+                def remaining(first='cards'):
+                    yield first
+                    yield from keys
+                self._read_deck(remaining(), 'Imported Deck', suffix=True, name=self.document_name)
+                break
+            else:
+                self.reader.value()
+        self.reader.end()
+
+        if self.report.kind is None:
+            raise ImportFormatError('Invalid file format: missing "type" key.')
+        if self.report.kind == 'topic':
+            topic = self._topic()
+            name = _imported_name(self.document_name, 'Imported Topic')
+            if topic.name != name:
+                topic.name = name
+                topic.save(update_fields=['name'])
+        self._flush()
+        cards_changed.send(sender=Card, deck_ids=self.deck_ids)
+        return self.report
+
+
+def import_file(user, uploaded_file):
+    """
+    Imports an exported topic or deck for `user` and returns an ImportReport.
+    Raises ImportFormatError (or json.JSONDecodeError) and rolls everything
+    back if the file is not a valid export.
+    """
+    started = time.monotonic()
+    with sharding.atomic():
+        report = _Importer(user, _JsonReader(uploaded_file.chunks())).run()
+    report.elapsed = time.monotonic() - started
+    return report
@@ -0,0 +1,262 @@
+"""
+Database-backed background jobs.
+
+Views enqueue a Job row; `manage.py runjobs` claims pending jobs with a
+conditional UPDATE (so several worker processes never run the same job),
+calls the registered handler and stores its result. Failed jobs are retried
+with exponential backoff up to `max_attempts`, except for errors retrying
+cannot fix (PERMANENT_ERRORS), which fail the job at once. Files (queued
+uploads, finished exports) are kept under settings.JOB_RESULTS_DIR; a
+failed attempt discards its partial result and a failed job its upload.
+
+Handlers usually run inside one transaction, so progress is written to a
+small side file rather than to the Job row, where it would stay invisible
+until the transaction commits.
+"""
+import logging
+import os
+import traceback
+import uuid
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.files import File
+from django.db.models import F
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from . import copying, exports, imports, sharding
+from .models import Deck, Job, Topic
+
+logger = logging.getLogger(__name__)
+
+RETRY_DELAY = timedelta(seconds=30)
+# A running job whose worker has not finished it by then is assumed dead and requeued.
+STALE_AFTER = timedelta(hours=1)
+# Failures that would recur on every attempt: a malformed upload (ImportFormatError,
+# JSONDecodeError and UnicodeDecodeError are ValueErrors) or objects that are gone.
+PERMANENT_ERRORS = (ValueError, ObjectDoesNotExist)
+
+HANDLERS = {}
+
+
+def handler(kind):
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(user, kind, **payload):
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    return Job.objects.create(user=user, kind=kind, payload=payload)
+
+
+def enqueue_import(user, uploaded_file):
+    """Saves the upload to disk, since the request's temporary file does not outlive it."""
+    relative = Path('uploads') / f"{uuid.uuid4().hex}.json"
+    path = Path(settings.JOB_RESULTS_DIR) / relative
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('wb') as destination:
+        for chunk in uploaded_file.chunks():
+            destination.write(chunk)
+    return enqueue(user, 'import', path=str(relative))
+
+
+# --- Files and progress ---
+
+def _job_dir(job):
+    path = Path(settings.JOB_RESULTS_DIR) / 'jobs' / str(job.pk)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def result_path(job):
+    if not job.result_file:
+        return None
+    return Path(settings.JOB_RESULTS_DIR) / job.result_file
+
+
+def upload_path(job):
+    """The file a job was queued with (see enqueue_import), or None."""
+    if 'path' not in job.payload:
+        return None
+    return Path(settings.JOB_RESULTS_DIR) / job.payload['path']
+
+
+def _progress_path(job):
+    return Path(settings.JOB_RESULTS_DIR) / 'progress' / str(job.pk)
+
+
+def report_progress(job, fraction):
+    path = _progress_path(job)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(f"{min(max(fraction, 0.0), 1.0):.3f}")
+    os.replace(temporary, path)
+
+
+def read_progress(job):
+    if job.status == Job.SUCCEEDED:
+        return 1.0
+    if job.status != Job.RUNNING:
+        return 0.0
+    try:
+        return float(_progress_path(job).read_text())
+    except (OSError, ValueError):
+        return 0.0
+
+
+def status(job):
+    data = {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': read_progress(job),
+        'attempts': job.attempts,
+        'result': job.result,
+        'download_url': reverse('job-download', kwargs={'pk': job.pk}) if job.result_file else None,
+    }
+    if job.status == Job.FAILED:
+        # Only the last line; the full traceback stays in the database.
+        data['error'] = job.error.strip().splitlines()[-1] if job.error.strip() else 'Unknown error'
+    return data
+
+
+# --- Worker side ---
+
+def claim(worker):
+    """Atomically takes the oldest runnable job; returns it or None."""
+    while True:
+        now = timezone.now()
+        job_id = (
+            Job.objects.filter(status=Job.PENDING, run_after__lte=now)
+            .order_by('run_after', 'id')
+            .values_list('pk', flat=True)
+            .first()
+        )
+        if job_id is None:
+            return None
+        claimed = Job.objects.filter(pk=job_id, status=Job.PENDING).update(
+            status=Job.RUNNING, worker=worker, started_at=now, attempts=F('attempts') + 1
+        )
+        if claimed:
+            return Job.objects.select_related('user').get(pk=job_id)
+        # Another worker won the race for this job; try the next one.
+
+
+def run(job):
+    try:
+        with sharding.using_shard(sharding.home_shard(job.user_id)):
+            result = HANDLERS[job.kind](job)
+    except Exception as e:
+        logger.exception("Job %s failed (attempt %s of %s)", job.pk, job.attempts, job.max_attempts)
+        job.error = traceback.format_exc()
+        # The next attempt starts over; a half-written result must not be offered.
+        path = result_path(job)
+        if path is not None:
+            path.unlink(missing_ok=True)
+            job.result_file = ''
+        if job.attempts < job.max_attempts and not isinstance(e, PERMANENT_ERRORS):
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1)
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+            path = upload_path(job)
+            if path is not None:
+                path.unlink(missing_ok=True)
+        job.save(update_fields=['status', 'run_after', 'result_file', 'error', 'finished_at'])
+    else:
+        job.status = Job.SUCCEEDED
+        job.result = result
+        job.error = ''
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'result', 'result_file', 'error', 'finished_at'])
+    finally:
+        _progress_path(job).unlink(missing_ok=True)
+
+
+def requeue_stale():
+    """Returns jobs orphaned by a crashed worker to the queue."""
+    return Job.objects.filter(status=Job.RUNNING, started_at__lt=timezone.now() - STALE_AFTER).update(
+        status=Job.PENDING, worker=''
+    )
+
+
+# --- Handlers ---
+
+class _ProgressFile(File):
+    """Reports how much of the file has been read while it is being chunked."""
+
+    def __init__(self, file, job):
+        super().__init__(file)
+        self.job = job
+
+    def chunks(self, chunk_size=None):
+        total = self.size or 1
+        read = 0
+        for index, chunk in enumerate(super().chunks(chunk_size)):
+            read += len(chunk)
+            if index % 16 == 0:
+                report_progress(self.job, read / total)
+            yield chunk
+
+
+@handler('import')
+def run_import(job):
+    path = upload_path(job)
+    with path.open('rb') as upload:
+        report = imports.import_file(job.user, _ProgressFile(upload, job))
+    path.unlink(missing_ok=True)
+    return {
+        'url': reverse('topic-detail', kwargs={'pk': report.topic.pk}),
+        'label': f"Open {report.topic.name}",
+        'summary': f"Imported {report.deck_count} deck(s) and {report.card_count} card(s); "
+                   f"{report.rejected_count} card(s) rejected.",
+    }
+
+
+@handler('export_topic')
+def run_export_topic(job):
+    topic = Topic.objects.get(pk=job.payload['topic'], user=job.user)
+    # The name is the user's: it only goes into the download's filename, never into the path.
+    path = _job_dir(job) / f"topic_{topic.id}.json"
+    job.result_file = str(path.relative_to(settings.JOB_RESULTS_DIR))
+    with path.open('wb') as destination:
+        for chunk in exports.iter_chunks(exports.iter_topic_json(topic)):
+            destination.write(chunk)
+    return {'summary': f"Exported {topic.name}.", 'filename': get_valid_filename(f"topic_{topic.id}_{topic.name}.json")}
+
+
+@handler('accept_topic')
+def run_accept_topic(job):
+    # Shared by another user, possibly on another shard; the share may have ended since the job was queued.
+    original_topic = Topic.objects.using(sharding.shard_of_id(job.payload['topic'])).get(
+        pk=job.payload['topic'], shared_with=job.user
+    )
+    new_topic_id = copying.accept_topic(original_topic, job.user)['topic'][original_topic.pk]
+    return {'url': reverse('topic-detail', kwargs={'pk': new_topic_id}), 'label': f"Open {original_topic.name}"}
+
+
+@handler('accept_deck')
+def run_accept_deck(job):
+    original_deck = Deck.objects.using(sharding.shard_of_id(job.payload['deck'])).get(
+        pk=job.payload['deck'], shared_with=job.user
+    )
+    target_topic = Topic.objects.get(pk=job.payload['topic'], user=job.user)
+    new_deck_id = copying.accept_deck(original_deck, target_topic, job.user)['decks'][original_deck.pk]
+    return {
+        'url': reverse('deck-detail', kwargs={'topic_pk': target_topic.pk, 'pk': new_deck_id}),
+        'label': f"Open {original_deck.name}",
+    }
+
+
+@handler('delete_topic')
+def run_delete_topic(job):
+    Topic.objects.filter(pk=job.payload['topic'], user=job.user).delete()
+    return {'url': reverse('topic-list'), 'label': "Back to topics"}
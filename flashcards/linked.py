@@ -0,0 +1,124 @@
+"""
+Copy-on-write linked decks.
+
+With settings.SHARE_COPY_ON_WRITE, accepting a share creates a deck whose
+`source_deck` points at the owner's deck instead of copying its cards. The
+recipient sees the owner's current card content, while their scheduling
+state lives in CardProgress rows keyed by (user, card); a card without a row
+is new to them and due immediately. Users learning a deck shared with them
+keep their progress the same way, so only the owner's reviews touch the
+schedule stored on the cards. The readers below overlay that progress in
+the same query that fetches the cards.
+
+The first time a recipient changes a linked deck's content (adding, editing
+or deleting a card), the deck is materialized: the cards are copied into it
+with the recipient's progress and the link is dropped. The same happens to
+every linked deck when the owner deletes the source deck.
+"""
+from datetime import datetime, timezone as dt_timezone
+
+from django.db.models import Exists, F, FilteredRelation, OuterRef, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from . import access, bulk, scheduling, sharding, stats
+from .models import Card, CardProgress, Deck, DeckStats
+
+# Sort key of cards a recipient has never reviewed: before every scheduled card.
+NEW_CARD_DUE = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def content_deck_id(deck):
+    """The id of the deck whose Card rows `deck` shows."""
+    return deck.source_deck_id or deck.pk
+
+
+def deck_cards(deck, user_id=None):
+    """
+    The cards shown in `deck`, annotated with `due_at`: the card's next review
+    for the learner (`user_id`, by default the deck's owner), read from
+    CardProgress unless the learner owns the cards.
+    """
+    user_id = deck.topic.user_id if user_id is None else user_id
+    if deck.source_deck_id is None and user_id == deck.topic.user_id:
+        return deck.cards.annotate(due_at=F('next_review_date'))
+    return Card.objects.filter(deck_id=content_deck_id(deck)).annotate(
+        user_progress=FilteredRelation('progress', condition=Q(progress__user_id=user_id)),
+        due_at=Coalesce('user_progress__next_review_date', Value(NEW_CARD_DUE)),
+    )
+
+
+def learnable_cards(user, card_ids):
+    """
+    Returns {card id: Card} for the cards `user` may review, in one query. Each
+    card has `owned` set when its deck is the user's; the user's progress on
+    any other card (of a linked or shared deck) belongs in CardProgress.
+    """
+    linked_deck = Deck.objects.filter(topic__user=user, source_deck=OuterRef('deck'))
+    return (
+        Card.objects.annotate(linked=Exists(linked_deck), owned=Q(deck__topic__user=user))
+        .filter(
+            access.viewable_decks_q(user, prefix='deck__') | Q(linked=True),
+            pk__in=card_ids,
+        )
+        .in_bulk()
+    )
+
+
+def load_progress(user, cards):
+    """Returns {card id: CardProgress} for `cards`, with unsaved rows for cards never reviewed."""
+    progress = {row.card_id: row for row in CardProgress.objects.filter(user=user, card__in=cards)}
+    for card in cards:
+        if card.pk in progress:
+            progress[card.pk].card = card
+        else:
+            progress[card.pk] = CardProgress(user=user, card=card, next_review_date=NEW_CARD_DUE)
+    return progress
+
+
+def save_progress(user, rows):
+    """Saves reviewed CardProgress rows and marks the due counts of the user's affected linked decks stale."""
+    rows = list(rows)
+    if not rows:
+        return
+    CardProgress.objects.bulk_update([row for row in rows if row.pk], scheduling.SCHEDULE_FIELDS)
+    # A concurrent first review of the same card is folded into this one.
+    CardProgress.objects.bulk_create(
+        [row for row in rows if not row.pk],
+        update_conflicts=True,
+        unique_fields=['user', 'card'],
+        update_fields=scheduling.SCHEDULE_FIELDS,
+    )
+    DeckStats.objects.filter(
+        user=user, deck__source_deck_id__in={row.card.deck_id for row in rows}
+    ).update(due_valid_until=timezone.now(), schedule_version=F('schedule_version') + 1)
+
+
+def materialize(deck):
+    """
+    Gives a linked deck its own copy of the cards, carrying over the owner's
+    progress, and drops the link. Returns {source card id: new card id}.
+    """
+    if deck.source_deck_id is None:
+        return {}
+    source_deck_id, user_id = deck.source_deck_id, deck.topic.user_id
+    with sharding.atomic():
+        bulk.copy_cards([(source_deck_id, deck.pk)], progress_user_id=user_id)
+        # The cards keep their text but get new ids, which the deck's ETags must reflect.
+        Deck.objects.filter(pk=deck.pk).update(source_deck=None, revision=F('revision') + 1)
+        deck.source_deck = None
+        # Copies were inserted in source order, so their ids ascend in the same order.
+        old_ids = Card.objects.filter(deck_id=source_deck_id).order_by('pk').values_list('pk', flat=True)
+        new_ids = Card.objects.filter(deck_id=deck.pk).order_by('pk').values_list('pk', flat=True)
+        card_ids = dict(zip(old_ids, new_ids, strict=True))
+        if not Deck.objects.filter(topic__user_id=user_id, source_deck_id=source_deck_id).exists():
+            CardProgress.objects.filter(user_id=user_id, card__deck_id=source_deck_id).delete()
+        stats.refresh_deck_stats([deck.pk], user_id=user_id)
+    return card_ids
+
+
+def forget_progress(deck):
+    """Drops the progress of a linked deck that is being deleted, unless another link still uses it."""
+    user_id = deck.topic.user_id
+    if not Deck.objects.filter(topic__user_id=user_id, source_deck_id=deck.source_deck_id).exclude(pk=deck.pk).exists():
+        CardProgress.objects.filter(user_id=user_id, card__deck_id=deck.source_deck_id).delete()
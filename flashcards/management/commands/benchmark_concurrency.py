@@ -0,0 +1,270 @@
+import asyncio
+import json
+import logging
+import platform
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from flashcards.models import Deck, User
+
+from .benchmark_views import _percentile
+
+
+class _Level:
+    """Results of one server model at one number of concurrent learners."""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.peak_threads = threading.active_count()
+
+    def add(self, seconds, status):
+        self.latencies.append(seconds * 1000)
+        self.statuses[status] += 1
+        self.peak_threads = max(self.peak_threads, threading.active_count())
+
+
+def _db_delay(seconds):
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(seconds)
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the learning flow served by the WSGI handler on a fixed pool of worker threads "
+        "with the ASGI handler on one event loop, at several numbers of concurrent learners. "
+        "Requests go straight to the handlers, without an HTTP server. Each learner repeatedly fetches "
+        "a page of cards and uploads a review, so run it against a copy of the database "
+        "(or pass --no-reviews)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--connections', type=int, nargs='+', default=[50, 200, 1000],
+            help="Concurrent learners per run (default: %(default)s).",
+        )
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per run (default: %(default)s).")
+        parser.add_argument(
+            '--threads', type=int, default=8,
+            help="WSGI worker threads, as in one gthread worker process (default: %(default)s).",
+        )
+        parser.add_argument(
+            '--db-latency', type=float, default=0.0,
+            help="Milliseconds added to every query, to model a database across the network (default: none).",
+        )
+        parser.add_argument('--user', help="User to learn as (default: the user with the most cards).")
+        parser.add_argument('--no-reviews', action='store_true', help="Only fetch cards; leaves the data unchanged.")
+        parser.add_argument('--output', default='benchmark_concurrency.json', help="Report file (default: %(default)s).")
+
+    def handle(self, *args, **options):
+        if min(options['connections']) < 1 or options['duration'] <= 0 or options['threads'] < 1:
+            raise CommandError("--connections, --duration and --threads must be positive.")
+        deck = self._deck(options['user'])
+        learner = self._learner_requests(deck, options['no_reviews'])
+        report = {
+            'meta': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'deck': deck.pk,
+                'duration_s': options['duration'],
+                'wsgi_threads': options['threads'],
+                'db_latency_ms': options['db_latency'],
+                'reviews': not options['no_reviews'],
+            },
+            'runs': [],
+        }
+
+        delay = _db_delay(options['db_latency'] / 1000) if options['db_latency'] else None
+
+        def add_delay(connection, **kwargs):
+            # Signalled on every reconnect of a thread's connection.
+            if delay not in connection.execute_wrappers:
+                connection.execute_wrappers.append(delay)
+
+        if delay:
+            connection_created.connect(add_delay)
+            for conn in connections.all(initialized_only=True):
+                add_delay(conn)
+        # Lock timeouts under load are counted as errors, not logged once per request.
+        logging.disable(logging.ERROR)
+        hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        try:
+            with override_settings(ALLOWED_HOSTS=hosts, DEBUG=False):
+                self.stdout.write(f"{'server':<6} {'learners':>8} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7} {'threads':>8}")
+                for count in options['connections']:
+                    for server in ('wsgi', 'asgi'):
+                        run = asyncio.run(self._run(server, count, learner, options['duration'], options['threads']))
+                        report['runs'].append(run)
+                        self.stdout.write(
+                            f"{server:<6} {count:>8} {run['requests_per_s']:>9.1f} {run['p50_ms']:>9.2f} "
+                            f"{run['p99_ms']:>9.2f} {run['errors']:>7} {run['peak_threads']:>8}"
+                        )
+        finally:
+            logging.disable(logging.NOTSET)
+            if delay:
+                connection_created.disconnect(add_delay)
+                for conn in connections.all(initialized_only=True):
+                    if delay in conn.execute_wrappers:
+                        conn.execute_wrappers.remove(delay)
+        Path(options['output']).write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(report['runs'])} run(s) to {options['output']}."))
+
+    def _deck(self, username):
+        users = User.objects.all() if not username else User.objects.filter(username=username)
+        deck = (
+            Deck.objects.filter(topic__user__in=users, cards__isnull=False)
+            .order_by('-topic__user__stats__card_count', 'pk')
+            .select_related('topic__user')
+            .first()
+        )
+        if deck is None:
+            raise CommandError("No deck with cards found; run seed_dataset first.")
+        return deck
+
+    def _learner_requests(self, deck, no_reviews):
+        """Returns a function giving (method, path, query, body, headers) for a learner's n-th request."""
+        client = Client()
+        client.force_login(deck.topic.user)
+        csrf_secret = get_random_string(32)
+        cookie = (
+            f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}; "
+            f"{settings.CSRF_COOKIE_NAME}={csrf_secret}"
+        )
+        headers = [(b'cookie', cookie.encode()), (b'x-csrftoken', csrf_secret.encode())]
+        learn_path = reverse('get-deck-for-learning', args=[deck.topic_id, deck.pk])
+        track_path = reverse('track-learning-batch')
+        card_ids = list(deck.cards.order_by('pk').values_list('pk', flat=True)[:100])
+
+        def request(n):
+            if no_reviews or n % 2 == 0:
+                return 'GET', learn_path, b'mode=all', b'', headers
+            event = {'card': card_ids[n % len(card_ids)], 'correct': n % 3 != 0, 'ts': int(time.time() * 1000)}
+            body = json.dumps({'events': [event]}).encode()
+            return 'POST', track_path, b'', body, [*headers, (b'content-type', b'application/json')]
+        return request
+
+    async def _run(self, server, count, learner, duration, threads):
+        if server == 'wsgi':
+            handler = WSGIHandler()
+            pool = ThreadPoolExecutor(max_workers=threads)
+            loop = asyncio.get_running_loop()
+
+            async def call(*request):
+                return await loop.run_in_executor(pool, self._call_wsgi, handler, *request)
+        else:
+            handler = ASGIHandler()
+
+            async def call(*request):
+                return await self._call_asgi(handler, *request)
+
+        await call(*learner(0))  # loads the middleware and warms up connections
+        level = _Level()
+        deadline = time.perf_counter() + duration
+
+        async def learn(offset):
+            n = offset
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                status = await call(*learner(n))
+                level.add(time.perf_counter() - started, status)
+                n += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(learn(i) for i in range(count)))
+        elapsed = time.perf_counter() - started
+        if server == 'wsgi':
+            pool.shutdown()
+        return {
+            'server': server,
+            'learners': count,
+            'requests': len(level.latencies),
+            'requests_per_s': round(len(level.latencies) / elapsed, 1),
+            'p50_ms': round(_percentile(level.latencies, 50), 3),
+            'p95_ms': round(_percentile(level.latencies, 95), 3),
+            'p99_ms': round(_percentile(level.latencies, 99), 3),
+            'errors': sum(number for status, number in level.statuses.items() if status >= 400),
+            'statuses': dict(sorted(level.statuses.items())),
+            'peak_threads': level.peak_threads,
+        }
+
+    @staticmethod
+    def _call_wsgi(handler, method, path, query, body, headers):
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query.decode(),
+            'SERVER_NAME': 'testserver',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.url_scheme': 'http',
+            'wsgi.version': (1, 0),
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in headers:
+            name = name.decode().upper().replace('-', '_')
+            environ[name if name == 'CONTENT_TYPE' else f'HTTP_{name}'] = value.decode()
+        status = []
+        response = handler(environ, lambda line, response_headers, exc_info=None: status.append(int(line[:3])))
+        try:
+            for _ in response:
+                pass
+        finally:
+            response.close()
+        return status[0]
+
+    @staticmethod
+    async def _call_asgi(handler, method, path, query, body, headers):
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': query,
+            'headers': [(b'host', b'testserver'), *headers],
+            'client': ('127.0.0.1', 0),
+            'server': ('testserver', 80),
+        }
+        received = False
+        status = []
+
+        async def receive():
+            nonlocal received
+            if not received:
+                received = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            await asyncio.Event().wait()  # the learner never disconnects early
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await handler(scope, receive, send)
+        return status[0]
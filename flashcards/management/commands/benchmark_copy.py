@@ -0,0 +1,76 @@
+import resource
+import time
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from flashcards import bulk, copying
+from flashcards.models import Card, Deck, Topic
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _copy_topic_per_object(original_topic, user):
+    """The previous implementation, kept for comparison: every card passes through Python."""
+    with transaction.atomic():
+        new_topic = Topic.objects.create(name=original_topic.name, user=user)
+        for original_deck in original_topic.decks.all():
+            new_deck = Deck.objects.create(name=original_deck.name, topic=new_topic)
+            Card.objects.bulk_create(
+                [Card(deck=new_deck, front=card.front, back=card.back) for card in original_deck.cards.all()]
+            )
+    return new_topic
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the time and Python memory needed to copy a generated topic. "
+        "Everything runs in a transaction that is rolled back, so the database is left unchanged."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cards', type=int, default=100_000, help="Cards in the topic (default: %(default)s).")
+        parser.add_argument('--decks', type=int, default=20, help="Decks the cards are spread over (default: %(default)s).")
+        parser.add_argument('--card-size', type=int, default=200, help="Characters per card side (default: %(default)s).")
+        parser.add_argument('--compare', action='store_true', help="Also time the previous per-object copy.")
+
+    def handle(self, *args, cards, decks, card_size, compare, **options):
+        if cards < 0 or decks < 1:
+            raise CommandError("--cards must be non-negative and --decks at least 1.")
+        try:
+            with transaction.atomic():
+                self._run(cards, decks, card_size, compare)
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, cards, decks, card_size, compare):
+        owner = User.objects.create_user('benchmark-copy-owner')
+        recipient = User.objects.create_user('benchmark-copy-recipient')
+        topic = Topic.objects.create(name="Benchmark", user=owner)
+        deck_ids = [Deck.objects.create(name=f"Deck {i}", topic=topic).pk for i in range(decks)]
+        text = 'x' * card_size
+        bulk.insert_cards((deck_ids[i % decks], text, text) for i in range(cards))
+        self.stdout.write(f"Copying a topic with {decks} deck(s) and {cards} card(s) of {card_size} characters per side.")
+
+        self._measure("set-based copy", lambda: copying.copy_topic(topic, recipient))
+        if compare:
+            self._measure("per-object copy", lambda: _copy_topic_per_object(topic, recipient))
+
+    def _measure(self, label, copy):
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start()
+        started = time.perf_counter()
+        copy()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        self.stdout.write(
+            f"{label:>16}: {elapsed:8.3f} s, Python peak {peak / 1024 / 1024:8.2f} MiB, "
+            f"max RSS growth {rss_growth / 1024:8.2f} MiB"
+        )
@@ -0,0 +1,290 @@
+import json
+import math
+import platform
+import shutil
+import time
+import tracemalloc
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from flashcards import jobs, urls
+from flashcards.models import Card, Deck, Job, Topic, User
+
+# Relative increase of p95 latency or SQL time reported as a regression by --compare.
+DEFAULT_THRESHOLD = 0.10
+# Latency changes below this many milliseconds are noise, whatever their ratio.
+MIN_LATENCY_DELTA_MS = 1.0
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+class _Rollback(Exception):
+    pass
+
+
+class _QueryTimer:
+    """execute_wrapper that counts and times the queries of a request."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            # Savepoint bookkeeping is the benchmark's, not the view's.
+            if not sql.startswith(('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')):
+                self.count += 1
+                self.seconds += time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests every route in flashcards/urls.py through the test client as one user and writes "
+        "p50/p95/p99 latency, SQL query count, SQL time and peak Python memory per route to a JSON file. "
+        "Each request is rolled back, so the dataset is not modified. "
+        "With --compare BASE NEW, diffs two reports instead and fails if NEW regressed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="User to benchmark as (default: the user with the most cards).")
+        parser.add_argument('--iterations', type=int, default=20, help="Timed requests per route (default: %(default)s).")
+        parser.add_argument('--warmup', type=int, default=2, help="Untimed requests per route (default: %(default)s).")
+        parser.add_argument('--output', default='benchmark.json', help="Report file (default: %(default)s).")
+        parser.add_argument('--route', action='append', dest='routes', metavar='NAME', help="Only this route (repeatable).")
+        parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'), help="Diff two reports.")
+        parser.add_argument(
+            '--threshold', type=float, default=DEFAULT_THRESHOLD,
+            help="Relative p95/SQL time increase counted as a regression (default: %(default)s).",
+        )
+
+    def handle(self, *args, **options):
+        if options['compare']:
+            return self._compare(*options['compare'], options['threshold'])
+        if options['iterations'] < 1 or options['warmup'] < 0:
+            raise CommandError("--iterations must be at least 1 and --warmup non-negative.")
+        user = self._user(options['user'])
+        report = {
+            'meta': {
+                'created': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'user': user.username,
+                'iterations': options['iterations'],
+                'dataset': {
+                    'users': User.objects.count(),
+                    'topics': Topic.objects.count(),
+                    'decks': Deck.objects.count(),
+                    'cards': Card.objects.count(),
+                },
+            },
+            'routes': {},
+        }
+        hosts = [*settings.ALLOWED_HOSTS, 'testserver']
+        results_dir = Path(settings.JOB_RESULTS_DIR) / 'benchmark'
+        try:
+            with override_settings(ALLOWED_HOSTS=hosts, JOB_RESULTS_DIR=results_dir), transaction.atomic():
+                requests = self._requests(user, options['routes'])
+                for key, (method, url, kwargs) in requests.items():
+                    result = self._measure(user, method, url, kwargs, options['iterations'], options['warmup'])
+                    report['routes'][key] = result
+                    self.stdout.write(
+                        f"{key:<45} {result['status']:>3}  p50 {result['p50_ms']:8.2f} ms  "
+                        f"p95 {result['p95_ms']:8.2f} ms  {result['queries']:>4} queries  "
+                        f"SQL {result['sql_ms']:8.2f} ms  peak {result['peak_memory_kb']:9.1f} KiB"
+                    )
+                raise _Rollback
+        except _Rollback:
+            pass
+        finally:
+            shutil.rmtree(results_dir, ignore_errors=True)
+        Path(options['output']).write_text(json.dumps(report, indent=2))
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(report['routes'])} route(s) to {options['output']}."))
+
+    def _user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f"User '{username}' does not exist.")
+        user = User.objects.filter(topics__decks__cards__isnull=False).order_by('-stats__card_count', 'pk').first()
+        if user is None:
+            raise CommandError("No user owns any cards; run seed_dataset first.")
+        return user
+
+    def _fixtures(self, user):
+        """Objects the route parameters are filled from."""
+        topic = Topic.objects.filter(user=user, decks__cards__isnull=False).order_by('pk').first()
+        deck = Deck.objects.filter(topic=topic, cards__isnull=False).order_by('pk').first()
+        card = deck.cards.order_by('pk').first()
+        shared_deck = user.shared_decks.order_by('pk').first()
+        shared_topic = user.shared_topics.order_by('pk').first()
+        if shared_deck is None:
+            shared_deck = Deck.objects.exclude(topic__user=user).filter(cards__isnull=False).order_by('pk').first()
+            shared_deck.shared_with.add(user)
+        if shared_topic is None:
+            shared_topic = Topic.objects.exclude(user=user).order_by('pk').first()
+            shared_topic.shared_with.add(user)
+        # A finished export, so job pages and the download have something to serve.
+        job = jobs.enqueue(user, 'export_topic', topic=topic.pk)
+        Job.objects.filter(pk=job.pk).update(status=Job.RUNNING, attempts=1)
+        job.refresh_from_db()
+        jobs.run(job)
+        return {'topic': topic, 'deck': deck, 'card': card, 'shared_deck': shared_deck,
+                'shared_topic': shared_topic, 'job': job}
+
+    def _requests(self, user, only):
+        """Returns {'METHOD name': (method, url, client kwargs)} for every route."""
+        f = self._fixtures(user)
+        owned = {'topic_pk': f['topic'].pk, 'deck_pk': f['deck'].pk}
+        args = {
+            'topic-detail': {'pk': f['topic'].pk}, 'topic-update': {'pk': f['topic'].pk},
+            'topic-delete': {'pk': f['topic'].pk}, 'share-topic': {'pk': f['topic'].pk},
+            'export-topic': {'pk': f['topic'].pk},
+            'deck-create': {'topic_pk': f['topic'].pk},
+            'deck-detail': {'topic_pk': f['topic'].pk, 'pk': f['deck'].pk},
+            'deck-cards': {'topic_pk': f['topic'].pk, 'pk': f['deck'].pk},
+            'deck-update': {'topic_pk': f['topic'].pk, 'pk': f['deck'].pk},
+            'deck-delete': {'topic_pk': f['topic'].pk, 'pk': f['deck'].pk},
+            'share-deck': {'topic_pk': f['topic'].pk, 'pk': f['deck'].pk},
+            'export-deck': {'topic_pk': f['topic'].pk, 'pk': f['deck'].pk},
+            'decline-shared-deck': {'pk': f['shared_deck'].pk}, 'accept-shared-deck': {'pk': f['shared_deck'].pk},
+            'accept-shared-topic': {'pk': f['shared_topic'].pk}, 'decline-shared-topic': {'pk': f['shared_topic'].pk},
+            'card-create': owned, 'card-bulk-edit': owned,
+            'card-update': {**owned, 'pk': f['card'].pk}, 'card-delete': {**owned, 'pk': f['card'].pk},
+            'track-learning': {'card_pk': f['card'].pk},
+            'learn-cards': owned, 'get-deck-for-learning': owned, 'get-card': owned, 'sync-deck-for-learning': owned,
+            'update-progress': {**owned, 'card_pk': f['card'].pk},
+            'job-detail': {'pk': f['job'].pk}, 'job-status': {'pk': f['job'].pk}, 'job-download': {'pk': f['job'].pk},
+        }
+        now_ms = int(time.time() * 1000)
+        posts = {
+            'topic-create': {'data': {'name': "Benchmark topic"}},
+            'topic-delete': {},
+            'deck-create': {'data': {'name': "Benchmark deck"}},
+            'deck-delete': {},
+            'card-create': {'data': {'front': "Front", 'back': "Back"}},
+            'card-update': {'data': {'front': "Front", 'back': "Back"}},
+            'card-delete': {},
+            'accept-shared-deck': {'data': {'topic': f['topic'].pk}},
+            'decline-shared-deck': {}, 'accept-shared-topic': {}, 'decline-shared-topic': {},
+            'card-bulk-edit': {
+                'data': json.dumps({
+                    'create': [{'front': "Front", 'back': "Back"}],
+                    'update': [{'id': f['card'].pk, 'front': "Front", 'back': "Back"}],
+                }),
+                'content_type': 'application/json',
+            },
+            'track-learning': {},
+            'track-learning-batch': {
+                'data': json.dumps({'events': [{'card': f['card'].pk, 'correct': True, 'ts': now_ms}]}),
+                'content_type': 'application/json',
+            },
+        }
+        post_only = {'decline-shared-deck', 'accept-shared-topic', 'decline-shared-topic', 'card-bulk-edit',
+                     'track-learning', 'track-learning-batch'}
+        requests = {}
+        for pattern in urls.urlpatterns:
+            if not isinstance(pattern, URLPattern) or not pattern.name:
+                continue
+            name = pattern.name
+            if only and name not in only:
+                continue
+            url = reverse(name, kwargs=args.get(name))
+            if name not in post_only:
+                requests[f"GET {name}"] = ('get', url, {})
+            if name in posts:
+                requests[f"POST {name}"] = ('post', url, posts[name])
+        return requests
+
+    def _request(self, client, method, url, kwargs):
+        """One request in a savepoint that is rolled back, so every iteration sees the same data."""
+        with transaction.atomic():
+            response = getattr(client, method)(url, **kwargs)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            transaction.set_rollback(True)
+        return response
+
+    def _measure(self, user, method, url, kwargs, iterations, warmup):
+        client = Client()
+        client.force_login(user)
+        for _ in range(warmup):
+            self._request(client, method, url, kwargs)
+
+        latencies, query_counts, sql_times = [], [], []
+        for _ in range(iterations):
+            timer = _QueryTimer()
+            with connection.execute_wrapper(timer):
+                started = time.perf_counter()
+                response = self._request(client, method, url, kwargs)
+                latencies.append((time.perf_counter() - started) * 1000)
+            query_counts.append(timer.count)
+            sql_times.append(timer.seconds * 1000)
+
+        # Measured separately: tracemalloc slows allocation-heavy code down considerably.
+        tracemalloc.start()
+        self._request(client, method, url, kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            'method': method.upper(),
+            'url': url,
+            'status': response.status_code,
+            'p50_ms': round(_percentile(latencies, 50), 3),
+            'p95_ms': round(_percentile(latencies, 95), 3),
+            'p99_ms': round(_percentile(latencies, 99), 3),
+            'queries': max(query_counts),
+            'sql_ms': round(_percentile(sql_times, 50), 3),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def _compare(self, base_path, new_path, threshold):
+        try:
+            base, new = (json.loads(Path(path).read_text())['routes'] for path in (base_path, new_path))
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Could not read reports: {e}")
+
+        regressions = []
+        self.stdout.write(f"{'route':<45} {'p95 ms':>21} {'queries':>11} {'SQL ms':>21} {'peak KiB':>23}")
+        for key in sorted(base.keys() & new.keys()):
+            old, cur = base[key], new[key]
+            problems = []
+            if cur['status'] != old['status']:
+                problems.append(f"status {old['status']} -> {cur['status']}")
+            if cur['queries'] > old['queries']:
+                problems.append(f"{cur['queries'] - old['queries']} more queries")
+            for field, label in (('p95_ms', 'p95'), ('sql_ms', 'SQL time')):
+                if cur[field] - old[field] > MIN_LATENCY_DELTA_MS and cur[field] > old[field] * (1 + threshold):
+                    problems.append(f"{label} +{(cur[field] / old[field] - 1) * 100 if old[field] else math.inf:.0f}%")
+            self.stdout.write(
+                f"{key:<45} {old['p95_ms']:>9.2f} -> {cur['p95_ms']:>8.2f} {old['queries']:>4} -> {cur['queries']:<4} "
+                f"{old['sql_ms']:>9.2f} -> {cur['sql_ms']:>8.2f} {old['peak_memory_kb']:>10.1f} -> {cur['peak_memory_kb']:<10.1f}"
+                + (f"  REGRESSED: {', '.join(problems)}" if problems else '')
+            )
+            if problems:
+                regressions.append(key)
+        for key in sorted(base.keys() - new.keys()):
+            self.stdout.write(f"{key:<45} only in {base_path}")
+        for key in sorted(new.keys() - base.keys()):
+            self.stdout.write(f"{key:<45} only in {new_path}")
+
+        if regressions:
+            raise CommandError(f"{len(regressions)} route(s) regressed: {', '.join(regressions)}")
+        self.stdout.write(self.style.SUCCESS("No regressions."))
@@ -0,0 +1,207 @@
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from flashcards import sharding
+from flashcards.models import Card, User
+
+from .benchmark_views import _percentile
+
+PROFILES = ('default', 'production')
+# Journal mode each profile leaves the database file in; it persists across connections.
+JOURNAL_MODES = {'default': 'DELETE', 'production': 'WAL'}
+# Seconds the worker processes get to load Django before the timed run starts together.
+STARTUP_DELAY = 3.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures concurrent review writes: several processes post reviews to track-learning-batch "
+        "for the cards of one user (or, with --users, of several users in turn), once per "
+        "SQLITE_PROFILE, and report reviews per second and 'database is locked' errors. With "
+        "DB_SHARDS, users on different shards write to different database files. The reviews are "
+        "saved, so run it against a copy of the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4, help="Writer processes (default: %(default)s).")
+        parser.add_argument('--duration', type=float, default=10.0, help="Seconds per profile (default: %(default)s).")
+        parser.add_argument('--batch', type=int, default=1, help="Reviews per request (default: %(default)s).")
+        parser.add_argument(
+            '--profile', action='append', dest='profiles', choices=PROFILES,
+            help="Profile to measure (repeatable; default: all, in order).",
+        )
+        parser.add_argument('--user', help="User to review as (default: the user with the most cards).")
+        parser.add_argument(
+            '--users', type=int, default=1,
+            help="Without --user, the processes review as the N users with the most cards, in turn (default: %(default)s).",
+        )
+        parser.add_argument('--output', default='benchmark_writes.json', help="Report file (default: %(default)s).")
+        # Internal: run as one writer process.
+        parser.add_argument('--worker', action='store_true', help='==SUPPRESS==')
+        parser.add_argument('--session', help='==SUPPRESS==')
+        parser.add_argument('--cards', help='==SUPPRESS==')
+        parser.add_argument('--start-at', type=float, help='==SUPPRESS==')
+
+    def handle(self, *args, **options):
+        if options['worker']:
+            return self._work(options)
+        if min(options['processes'], options['duration'], options['batch'], options['users']) <= 0:
+            raise CommandError("--processes, --duration, --batch and --users must be positive.")
+        if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+            raise CommandError("This benchmark needs a file-based SQLite database.")
+
+        processes = options['processes']
+        users = self._users(options['user'], min(options['users'], processes))
+        # One (session, card ids) pair per process, the processes shared out among the users.
+        writers = []
+        for index, user in enumerate(users):
+            user_processes = len(range(index, processes, len(users)))
+            with sharding.using_shard(sharding.home_shard(user.pk)):
+                card_ids = list(
+                    Card.objects.filter(deck__topic__user=user).order_by('pk')
+                    .values_list('pk', flat=True)[:50 * options['batch'] * user_processes]
+                )
+            if len(card_ids) < user_processes:
+                raise CommandError(f"{user.username} has too few cards.")
+            client = Client()
+            client.force_login(user)
+            session = client.cookies[settings.SESSION_COOKIE_NAME].value
+            writers += [(session, card_ids[i::user_processes]) for i in range(user_processes)]
+
+        report = {
+            'meta': {
+                'processes': processes,
+                'duration_s': options['duration'],
+                'batch': options['batch'],
+                'users': [user.username for user in users],
+                'shards': settings.DB_SHARDS,
+            },
+            'runs': [],
+        }
+        self.stdout.write(f"{'profile':<11} {'reviews/s':>10} {'requests':>9} {'lock errors':>12} {'other errors':>13} {'p50 ms':>8} {'p99 ms':>9}")
+        for profile in options['profiles'] or PROFILES:
+            run = self._run(profile, options, writers)
+            report['runs'].append(run)
+            self.stdout.write(
+                f"{profile:<11} {run['reviews_per_s']:>10.1f} {run['requests']:>9} {run['lock_errors']:>12} "
+                f"{run['other_errors']:>13} {run['p50_ms']:>8.2f} {run['p99_ms']:>9.2f}"
+            )
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {len(report['runs'])} run(s) to {options['output']}."))
+
+    def _users(self, username, count):
+        if username:
+            try:
+                return [User.objects.get(username=username)]
+            except User.DoesNotExist:
+                raise CommandError(f"User '{username}' does not exist.")
+        # Every shard holds a copy of each user, so each shard can count its owners' cards.
+        top = sorted(
+            (-cards, pk)
+            for name in sharding.aliases()
+            for pk, cards in User.objects.using(name).annotate(cards=Count('topics__decks__cards'))
+            .filter(cards__gt=0).order_by('-cards', 'pk').values_list('pk', 'cards')[:count]
+        )[:count]
+        if not top:
+            raise CommandError("No user owns any cards; run seed_dataset first.")
+        # The copies lack the passwords that sessions are tied to; log in as the users themselves.
+        users = User.objects.in_bulk([pk for _, pk in top])
+        return [users[pk] for _, pk in top]
+
+    def _run(self, profile, options, writers):
+        connections.close_all()
+        for name in sharding.aliases():
+            with sqlite3.connect(settings.DATABASES[name]['NAME']) as db:
+                db.execute(f"PRAGMA journal_mode={JOURNAL_MODES[profile]}")
+
+        start_at = time.time() + STARTUP_DELAY
+        workers = [
+            subprocess.Popen(
+                [
+                    sys.executable, '-m', 'django', 'benchmark_writes', '--worker',
+                    '--session', session,
+                    '--cards', ','.join(map(str, card_ids)),
+                    '--start-at', str(start_at),
+                    '--duration', str(options['duration']),
+                    '--batch', str(options['batch']),
+                ],
+                cwd=settings.BASE_DIR,
+                env={**os.environ, 'SQLITE_PROFILE': profile},
+                stdout=subprocess.PIPE,
+            )
+            for session, card_ids in writers
+        ]
+        results = []
+        for worker in workers:
+            output, _ = worker.communicate()
+            if worker.returncode:
+                raise CommandError(f"A writer process failed with exit status {worker.returncode}.")
+            results.append(json.loads(output.decode().splitlines()[-1]))
+
+        latencies = [latency for result in results for latency in result['latencies']]
+        reviews = sum(result['reviews'] for result in results)
+        return {
+            'profile': profile,
+            'reviews': reviews,
+            'reviews_per_s': round(reviews / options['duration'], 1),
+            'requests': len(latencies),
+            'lock_errors': sum(result['lock_errors'] for result in results),
+            'other_errors': sum(result['other_errors'] for result in results),
+            'p50_ms': round(_percentile(latencies, 50), 3) if latencies else None,
+            'p99_ms': round(_percentile(latencies, 99), 3) if latencies else None,
+        }
+
+    def _work(self, options):
+        # Lock timeouts are counted, not logged once per request.
+        logging.disable(logging.ERROR)
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'], DEBUG=False):
+            result = self._write_reviews(options)
+        self.stdout.write(json.dumps(result))
+
+    def _write_reviews(self, options):
+        client = Client()
+        client.cookies[settings.SESSION_COOKIE_NAME] = options['session']
+        url = reverse('track-learning-batch')
+        card_ids = [int(card_id) for card_id in options['cards'].split(',')]
+        batch = options['batch']
+        reviews = lock_errors = other_errors = 0
+        latencies = []
+
+        time.sleep(max(options['start_at'] - time.time(), 0))
+        deadline = options['start_at'] + options['duration']
+        n = 0
+        while time.time() < deadline:
+            now_ms = int(time.time() * 1000)
+            events = [
+                {'card': card_ids[(n + i) % len(card_ids)], 'correct': (n + i) % 3 != 0, 'ts': now_ms}
+                for i in range(batch)
+            ]
+            n += batch
+            started = time.perf_counter()
+            try:
+                response = client.post(url, json.dumps({'events': events}), content_type='application/json')
+            except OperationalError as e:
+                if 'locked' not in str(e):
+                    raise
+                lock_errors += 1
+            else:
+                if response.status_code == 200:
+                    reviews += response.json()['applied']
+                else:
+                    other_errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        return {'reviews': reviews, 'lock_errors': lock_errors, 'other_errors': other_errors, 'latencies': latencies}
@@ -0,0 +1,112 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Q
+
+from flashcards import linked, sharding, stats
+from flashcards.models import Card, CardProgress, DailyActivity, Deck, ReviewEvent, Topic, User, UserShard, UserStats
+from flashcards.signals import cards_changed
+
+BATCH_SIZE = 1000
+CARD_FIELDS = [field.attname for field in Card._meta.concrete_fields if not field.primary_key and field.name != 'deck']
+
+
+def _batches(iterable):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, BATCH_SIZE)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves a user's topics, decks, cards, statistics and review history to another shard. "
+        "The moved objects get new ids (ids name their shard), so old links to them stop working and "
+        "offline learners download their decks afresh. Decks linked to or from the user's are "
+        "materialized first, since a link cannot span shards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('shard', type=int, help="Index of the target shard; 0 is the default database.")
+
+    def handle(self, *args, username, shard, **options):
+        if not sharding.enabled():
+            raise CommandError("Sharding is off; set DB_SHARDS.")
+        if not 0 <= shard < settings.DB_SHARDS:
+            raise CommandError(f"The shard must be between 0 and {settings.DB_SHARDS - 1}.")
+        try:
+            user = User.objects.get(username=username)
+        except User.DoesNotExist:
+            raise CommandError(f"User '{username}' does not exist.")
+        source, target = sharding.home_shard(user.pk), sharding.alias(shard)
+        if source == target:
+            self.stdout.write(f"{username} is already on {target}.")
+            return
+
+        with transaction.atomic(using=DEFAULT_DB_ALIAS), transaction.atomic(using=source), transaction.atomic(using=target):
+            with sharding.using_shard(source):
+                self._unlink(user)
+            with sharding.using_shard(target):
+                topics, decks, cards, events = self._copy(user, source)
+            with sharding.using_shard(source):
+                self._delete(user)
+            UserShard.objects.update_or_create(user=user, defaults={'shard': shard})
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {username} from {source} to {target}: {topics} topic(s), {decks} deck(s), {cards} card(s) "
+            f"and {events} review event(s)."
+        ))
+
+    def _unlink(self, user):
+        decks = Deck.objects.filter(
+            Q(topic__user=user, source_deck__isnull=False) | Q(source_deck__topic__user=user)
+        ).select_related('topic')
+        for deck in decks:
+            linked.materialize(deck)
+
+    def _copy(self, user, source):
+        """Copies the user's data from `source` to the selected shard; returns the numbers copied."""
+        card_ids = {}
+        deck_ids = []
+        topics = 0
+        for topic in Topic.objects.using(source).filter(user=user).order_by('pk'):
+            new_topic = Topic.objects.create(name=topic.name, user=user)
+            new_topic.shared_with.set(topic.shared_with.values_list('pk', flat=True))
+            topics += 1
+            for deck in topic.decks.order_by('pk'):
+                new_deck = Deck.objects.create(name=deck.name, topic=new_topic)
+                new_deck.shared_with.set(deck.shared_with.values_list('pk', flat=True))
+                deck_ids.append(new_deck.pk)
+                cards = deck.cards.order_by('pk').iterator(chunk_size=BATCH_SIZE)
+                for batch in _batches(cards):
+                    copies = Card.objects.bulk_create([
+                        Card(deck=new_deck, **{field: getattr(card, field) for field in CARD_FIELDS}) for card in batch
+                    ])
+                    card_ids.update(zip((card.pk for card in batch), (copy.pk for copy in copies)))
+        # The cards bypassed post_save; this derives their decks' statistics.
+        cards_changed.send(sender=Card, deck_ids=deck_ids)
+
+        # Reviews of other users' cards keep their card ids, which are on other shards.
+        events = ReviewEvent.objects.using(source).filter(user=user).order_by('pk').iterator(chunk_size=BATCH_SIZE)
+        event_count = 0
+        for batch in _batches(events):
+            ReviewEvent.objects.bulk_create([
+                ReviewEvent(
+                    user=user, card_id=card_ids.get(event.card_id, event.card_id),
+                    correct=event.correct, reviewed_at=event.reviewed_at,
+                )
+                for event in batch
+            ])
+            event_count += len(batch)
+        DailyActivity.objects.bulk_create([
+            DailyActivity(user=user, day=row.day, reviews=row.reviews, correct=row.correct)
+            for row in DailyActivity.objects.using(source).filter(user=user)
+        ])
+        stats.rebuild_user_stats(user.pk)
+        return topics, len(deck_ids), len(card_ids), event_count
+
+    def _delete(self, user):
+        Topic.objects.filter(user=user).delete()
+        for model in (ReviewEvent, DailyActivity, CardProgress, UserStats):
+            model.objects.filter(user=user).delete()
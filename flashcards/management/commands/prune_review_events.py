@@ -0,0 +1,25 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from flashcards import activity, sharding
+
+
+class Command(BaseCommand):
+    help = "Deletes raw review events older than the retention window. Daily rollups are kept."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.REVIEW_EVENT_RETENTION_DAYS,
+            help="Retention window in days (default: REVIEW_EVENT_RETENTION_DAYS, currently %(default)s).",
+        )
+        parser.add_argument('--batch-size', type=int, default=10000, help="Rows deleted per statement.")
+
+    def handle(self, *args, days, batch_size, **options):
+        if days < 1:
+            raise CommandError("--days must be at least 1.")
+        cutoff = timezone.now() - timedelta(days=days)
+        deleted = sum(activity.prune_review_events(cutoff, batch_size=batch_size) for _ in sharding.each_shard())
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} review event(s) older than {days} days."))
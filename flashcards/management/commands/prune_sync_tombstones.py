@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from flashcards import sharding, sync
+
+
+class Command(BaseCommand):
+    help = "Deletes the sync tombstones of cards deleted more than SYNC_TOMBSTONE_DAYS ago."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help="Rows deleted per statement.")
+
+    def handle(self, *args, batch_size, **options):
+        # A day beyond the token lifetime covers transactions that committed after their trigger ran.
+        days = settings.SYNC_TOMBSTONE_DAYS + 1
+        before = timezone.now() - timedelta(days=days)
+        deleted = sum(sync.prune_tombstones(before, batch_size=batch_size) for _ in sharding.each_shard())
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} tombstone(s) older than {days} days."))
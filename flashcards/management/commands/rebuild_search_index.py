@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from flashcards import search, sharding
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text card search index, or verifies it against the card table with --check."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help="Verify the index without changing it; exits non-zero if it is out of sync.")
+
+    def handle(self, *args, check=False, **options):
+        if not search.is_available():
+            raise CommandError("Full-text search needs SQLite; other databases search without an index.")
+        for shard in sharding.each_shard():
+            if check:
+                try:
+                    search.check()
+                except DatabaseError as e:
+                    raise CommandError(
+                        f"Search index of {shard} is out of sync with the card table ({e}); run rebuild_search_index."
+                    )
+            else:
+                search.rebuild()
+        if check:
+            self.stdout.write(self.style.SUCCESS("Search index is up to date."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from flashcards import sharding, stats
+from flashcards.models import User
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the dashboard statistics snapshot, or checks it for drift with --check."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help="Report drift without changing anything; exits non-zero if any is found.")
+        parser.add_argument('--user', action='append', dest='usernames', metavar='USERNAME', help="Limit to this user (repeatable).")
+
+    def handle(self, *args, check=False, usernames=None, **options):
+        users = User.objects.order_by('pk')
+        if usernames:
+            users = users.filter(username__in=usernames)
+
+        drifted = 0
+        for user_id, username in users.values_list('pk', 'username').iterator():
+            with sharding.using_shard(sharding.home_shard(user_id)):
+                drifted += self._process(user_id, username, check, options['verbosity'])
+
+        if check:
+            if drifted:
+                raise CommandError(f"Statistics snapshot drifted for {drifted} user(s).")
+            self.stdout.write(self.style.SUCCESS("Statistics snapshot is up to date."))
+        else:
+            self.stdout.write(self.style.SUCCESS("Statistics snapshot rebuilt."))
+
+    def _process(self, user_id, username, check, verbosity):
+        """Checks or rebuilds one user's statistics; returns 1 if they drifted."""
+        if check:
+            problems = stats.find_drift(user_id)
+            for problem in problems:
+                self.stdout.write(f"{username}: {problem}")
+            return 1 if problems else 0
+        stats.rebuild_user_stats(user_id)
+        if verbosity > 1:
+            self.stdout.write(f"Rebuilt statistics for {username}")
+        return 0
@@ -0,0 +1,35 @@
+import sqlite3
+import time
+from contextlib import closing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from flashcards.routers import REPLICA
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies the SQLite database to the 'replica' database file, once or every --interval seconds. "
+        "A stand-in for replication in development and tests: each copy is a consistent snapshot, "
+        "and readers of the replica keep their old snapshot until it completes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help="Seconds between copies (default: copy once).")
+
+    def handle(self, *args, interval, **options):
+        if REPLICA not in settings.DATABASES:
+            raise CommandError("No replica database is configured; set DB_REPLICA_NAME.")
+        source, target = settings.DATABASES['default'], settings.DATABASES[REPLICA]
+        if not all(db['ENGINE'] == 'django.db.backends.sqlite3' for db in (source, target)):
+            raise CommandError("Only SQLite databases can be copied; use the database's own replication.")
+        while True:
+            started = time.monotonic()
+            with closing(sqlite3.connect(source['NAME'])) as primary, closing(sqlite3.connect(target['NAME'])) as replica:
+                primary.backup(replica)
+            elapsed = time.monotonic() - started
+            self.stdout.write(self.style.SUCCESS(f"Copied the database to the replica in {elapsed:.2f}s."))
+            if not interval:
+                return
+            time.sleep(max(interval - elapsed, 0))
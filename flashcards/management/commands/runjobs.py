@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+import signal
+import socket
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+def _worker_main(index, poll_interval, once, stop):
+    # Spawned processes start from a clean interpreter and need their own setup.
+    import django
+    django.setup()
+
+    from flashcards import jobs
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent decides when to stop
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    while not stop.is_set():
+        job = jobs.claim(worker)
+        if job is not None:
+            jobs.run(job)
+            continue
+        if once:
+            break
+        stop.wait(poll_interval)
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Runs queued background jobs in a pool of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help="Number of worker processes (default: number of CPUs, %(default)s).",
+        )
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds between polls when idle.")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty.")
+
+    def handle(self, *args, processes, poll_interval, once, **options):
+        if processes < 1:
+            raise CommandError("--processes must be at least 1.")
+        from flashcards import jobs
+
+        requeued = jobs.requeue_stale()
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} stale job(s).")
+        # Connections must not be inherited by the workers.
+        connections.close_all()
+
+        context = multiprocessing.get_context('spawn')
+        stop = context.Event()
+        workers = [
+            context.Process(target=_worker_main, args=(index, poll_interval, once, stop), daemon=True)
+            for index in range(processes)
+        ]
+        for process in workers:
+            process.start()
+        self.stdout.write(f"Started {processes} worker(s).")
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        try:
+            for process in workers:
+                while process.is_alive():
+                    process.join(timeout=1)
+        except KeyboardInterrupt:
+            stop.set()
+            for process in workers:
+                process.join()
+        self.stdout.write(self.style.SUCCESS("Workers stopped."))
@@ -0,0 +1,170 @@
+import random
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+
+from flashcards import bulk, caching, sharding, stats
+from flashcards.models import Card, DailyActivity, Deck, ReviewEvent, Topic, User
+
+WORDS = (
+    "alpha bravo charlie delta echo foxtrot golf hotel india juliett kilo lima mike november oscar papa "
+    "quebec romeo sierra tango uniform victor whiskey xray yankee zulu"
+).split()
+
+EVENT_BATCH_SIZE = 5000
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a deterministic synthetic dataset for benchmarking. Users are named <prefix>00000, "
+        "<prefix>00001, ... and share the password 'password'."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10, help="Number of users (default: %(default)s).")
+        parser.add_argument('--topics', type=int, default=5, help="Topics per user (default: %(default)s).")
+        parser.add_argument('--decks', type=int, default=5, help="Decks per topic (default: %(default)s).")
+        parser.add_argument('--cards', type=int, default=100, help="Cards per deck (default: %(default)s).")
+        parser.add_argument(
+            '--share-fanout', type=int, default=2,
+            help="Users each user's first topic and first deck are shared with (default: %(default)s).",
+        )
+        parser.add_argument('--reviews', type=int, default=500, help="Review events per user (default: %(default)s).")
+        parser.add_argument('--history-days', type=int, default=90, help="Days the review history spans (default: %(default)s).")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed (default: %(default)s).")
+        parser.add_argument('--prefix', default='bench', help="Username prefix (default: %(default)s).")
+        parser.add_argument('--clear', action='store_true', help="Delete existing users with the prefix first.")
+
+    def handle(self, *args, **options):
+        for name in ('users', 'topics', 'decks', 'cards', 'share_fanout', 'reviews', 'history_days'):
+            if options[name] < 0:
+                raise CommandError(f"--{name.replace('_', '-')} must not be negative.")
+        if options['share_fanout'] >= max(options['users'], 1):
+            raise CommandError("--share-fanout must be smaller than --users.")
+        prefix = options['prefix']
+        existing = User.objects.filter(username__startswith=prefix)
+        if existing.exists():
+            if not options['clear']:
+                raise CommandError(f"Users starting with '{prefix}' already exist; pass --clear to replace them.")
+            deleted, _ = existing.delete()
+            self.stdout.write(f"Deleted {deleted} existing row(s).")
+
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            users = self._create_users(prefix, options['users'])
+            deck_ids = self._create_content(rng, users, options['topics'], options['decks'], options['cards'])
+            self._schedule(rng, deck_ids)
+            self._share(users, options['share_fanout'])
+            self._review(rng, users, options['reviews'], options['history_days'])
+            for user in users:
+                stats.rebuild_user_stats(user.pk)
+            # The bulk inserts sent no signals to invalidate cached pages with.
+            caching.bump_users(user.pk for user in users)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {len(users)} user(s), {len(users) * options['topics']} topic(s), {len(deck_ids)} deck(s) and "
+            f"{len(deck_ids) * options['cards']} card(s)."
+        ))
+
+    def _create_users(self, prefix, count):
+        password = make_password('password')  # hashed once; hashing per user would dominate
+        User.objects.bulk_create([
+            User(username=f"{prefix}{i:05d}", email=f"{prefix}{i:05d}@example.com", password=password)
+            for i in range(count)
+        ])
+        users = list(User.objects.filter(username__startswith=prefix).order_by('username'))
+        # bulk_create skips post_save: the users stay on shard 0, and the other shards need their copies.
+        sharding.mirror_users(users)
+        return users
+
+    def _text(self, rng, words):
+        return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+    def _create_content(self, rng, users, topics, decks, cards):
+        Topic.objects.bulk_create([
+            Topic(name=f"{self._text(rng, 2).title()} {t}", user=user) for user in users for t in range(topics)
+        ])
+        topic_ids = Topic.objects.filter(user__in=users).order_by('pk').values_list('pk', flat=True)
+        Deck.objects.bulk_create([
+            Deck(name=f"{self._text(rng, 2).title()} {d}", topic_id=topic_id) for topic_id in topic_ids for d in range(decks)
+        ])
+        deck_ids = list(Deck.objects.filter(topic__user__in=users).order_by('pk').values_list('pk', flat=True))
+        bulk.insert_cards(
+            (deck_id, self._text(rng, rng.randint(1, 6)), self._text(rng, rng.randint(3, 20)))
+            for deck_id in deck_ids
+            for _ in range(cards)
+        )
+        return deck_ids
+
+    def _schedule(self, rng, deck_ids):
+        """Gives a random leading share of every deck some review history, so due counts vary."""
+        now = timezone.now()
+        first_card_ids = dict(
+            Card.objects.filter(deck_id__in=deck_ids).values('deck_id').annotate(first=Min('pk')).values_list('deck_id', 'first')
+        )
+        for deck_id in deck_ids:
+            reviewed = rng.randint(0, 100)
+            if not reviewed or deck_id not in first_card_ids:
+                continue
+            level = rng.randint(1, 6)
+            Card.objects.filter(deck_id=deck_id, pk__lt=first_card_ids[deck_id] + reviewed).update(
+                last_learned=now - timedelta(days=rng.randint(1, 30)),
+                learned_count=level + rng.randint(0, 5),
+                learning_level=level,
+                next_review_date=now + timedelta(days=rng.randint(-10, 60)),
+            )
+
+    def _share(self, users, fanout):
+        if not fanout:
+            return
+        first_topics = {}
+        for topic in Topic.objects.filter(user__in=users).order_by('pk'):
+            first_topics.setdefault(topic.user_id, topic)
+        first_decks = {}
+        for deck in Deck.objects.filter(topic__user__in=users).select_related('topic').order_by('pk'):
+            first_decks.setdefault(deck.topic.user_id, deck)
+        topic_shares, deck_shares = [], []
+        for index, user in enumerate(users):
+            recipients = [users[(index + offset) % len(users)] for offset in range(1, fanout + 1)]
+            if user.pk in first_topics:
+                topic_shares += [
+                    Topic.shared_with.through(topic_id=first_topics[user.pk].pk, user_id=recipient.pk)
+                    for recipient in recipients
+                ]
+            if user.pk in first_decks:
+                deck_shares += [
+                    Deck.shared_with.through(deck_id=first_decks[user.pk].pk, user_id=recipient.pk)
+                    for recipient in recipients
+                ]
+        Topic.shared_with.through.objects.bulk_create(topic_shares)
+        Deck.shared_with.through.objects.bulk_create(deck_shares)
+
+    def _review(self, rng, users, reviews, history_days):
+        if not reviews:
+            return
+        now = timezone.now()
+        span = timedelta(days=history_days or 1).total_seconds()
+        for user in users:
+            card_ids = list(Card.objects.filter(deck__topic__user=user).values_list('pk', flat=True))
+            if not card_ids:
+                continue
+            events = []
+            days = Counter()
+            correct_days = Counter()
+            for _ in range(reviews):
+                reviewed_at = now - timedelta(seconds=rng.uniform(0, span))
+                correct = rng.random() < 0.8
+                events.append(ReviewEvent(user=user, card_id=rng.choice(card_ids), correct=correct, reviewed_at=reviewed_at))
+                day = timezone.localdate(reviewed_at)
+                days[day] += 1
+                correct_days[day] += correct
+            ReviewEvent.objects.bulk_create(events, batch_size=EVENT_BATCH_SIZE)
+            DailyActivity.objects.bulk_create([
+                DailyActivity(user=user, day=day, reviews=count, correct=correct_days[day])
+                for day, count in days.items()
+            ])
@@ -0,0 +1,185 @@
+"""
+Per-view request metrics, exposed in the Prometheus text format.
+
+MetricsMiddleware records, for every resolved view name: a latency
+histogram, the number and total time of database queries (counted with a
+connection execute_wrapper), response bytes and 5xx responses.
+flashcards.caching records the hits, misses and stale reads of each cached
+fragment. Each thread writes only to its own aggregates, so recording
+takes no locks; readers merge all threads' aggregates.
+
+With several worker processes, set METRICS_DIR to a directory shared by
+them: each process periodically writes its totals there and /metrics/
+merges every file. Counters are cumulative per process, so clear the
+directory when the application is (re)deployed.
+"""
+import bisect
+import json
+import os
+import resource
+import socket
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+# Histogram bucket upper bounds, in seconds.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Positions in a view's aggregate list; the histogram buckets follow.
+COUNT, LATENCY, QUERIES, DB_TIME, RESPONSE_BYTES, ERRORS, BUCKETS = range(7)
+
+UNMATCHED_VIEW = '<unmatched>'
+
+# Results of a cached fragment read, in the order of its counter list.
+CACHE_RESULTS = ('hit', 'miss', 'stale')
+
+_local = threading.local()
+_registry = []  # the aggregates of every thread that has recorded a request
+_cache_registry = []  # the cache counters of every thread that has read a fragment
+_process_id = f"{socket.gethostname()}-{os.getpid()}-{int(time.time())}"
+_last_flush = 0.0
+
+
+def _aggregates():
+    try:
+        return _local.views
+    except AttributeError:
+        _local.views = {}
+        _registry.append(_local.views)  # list.append is atomic
+        return _local.views
+
+
+def record(view, latency, queries, db_time, response_bytes, error):
+    views = _aggregates()
+    stats = views.get(view)
+    if stats is None:
+        stats = views[view] = [0, 0.0, 0, 0.0, 0, 0] + [0] * (len(LATENCY_BUCKETS) + 1)
+    stats[COUNT] += 1
+    stats[LATENCY] += latency
+    stats[QUERIES] += queries
+    stats[DB_TIME] += db_time
+    stats[RESPONSE_BYTES] += response_bytes
+    stats[ERRORS] += error
+    stats[BUCKETS + bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+
+def _cache_counters():
+    try:
+        return _local.cache
+    except AttributeError:
+        _local.cache = {}
+        _cache_registry.append(_local.cache)
+        return _local.cache
+
+
+def record_cache(fragment, result):
+    counters = _cache_counters()
+    counts = counters.get(fragment)
+    if counts is None:
+        counts = counters[fragment] = [0] * len(CACHE_RESULTS)
+    counts[CACHE_RESULTS.index(result)] += 1
+
+
+def _merge(into, views):
+    for view, stats in views.items():
+        total = into.get(view)
+        if total is None:
+            into[view] = list(stats)
+        else:
+            for i, value in enumerate(stats):
+                total[i] += value
+    return into
+
+
+def snapshot():
+    """This process's totals: {'views': {view: aggregate list}, 'cache': {fragment: counts}, 'max_rss_bytes': int}."""
+    views, cache = {}, {}
+    for thread_views in list(_registry):
+        _merge(views, thread_views.copy())  # dict.copy() is atomic under the GIL
+    for thread_counters in list(_cache_registry):
+        _merge(cache, thread_counters.copy())
+    # ru_maxrss is in kilobytes on Linux.
+    return {'views': views, 'cache': cache, 'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+
+def flush(force=False):
+    """Writes this process's totals to METRICS_DIR, at most every METRICS_FLUSH_INTERVAL seconds."""
+    global _last_flush
+    directory = settings.METRICS_DIR
+    now = time.monotonic()
+    if not directory or (not force and now - _last_flush < settings.METRICS_FLUSH_INTERVAL):
+        return
+    _last_flush = now
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{_process_id}.json"
+    temporary = path.with_suffix('.tmp')
+    temporary.write_text(json.dumps(snapshot()))
+    os.replace(temporary, path)
+
+
+def collect():
+    """Totals of all processes (or just this one without METRICS_DIR): views, per-process RSS, cache counters."""
+    if not settings.METRICS_DIR:
+        current = snapshot()
+        return current['views'], {_process_id: current['max_rss_bytes']}, current['cache']
+    flush(force=True)
+    views, rss, cache = {}, {}, {}
+    for path in Path(settings.METRICS_DIR).glob('*.json'):
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue  # being replaced or removed right now
+        _merge(views, data['views'])
+        _merge(cache, data.get('cache', {}))
+        rss[path.stem] = data['max_rss_bytes']
+    return views, rss, cache
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render():
+    views, rss, cache = collect()
+    lines = [
+        '# HELP flashcards_request_duration_seconds Time from the first middleware to the response, by view.',
+        '# TYPE flashcards_request_duration_seconds histogram',
+    ]
+    for view, stats in sorted(views.items()):
+        label = f'view="{_label(view)}"'
+        cumulative = 0
+        for bound, count in zip((*LATENCY_BUCKETS, '+Inf'), stats[BUCKETS:]):
+            cumulative += count
+            lines.append(f'flashcards_request_duration_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+        lines.append(f'flashcards_request_duration_seconds_sum{{{label}}} {stats[LATENCY]:.6f}')
+        lines.append(f'flashcards_request_duration_seconds_count{{{label}}} {stats[COUNT]}')
+
+    counters = (
+        ('flashcards_db_queries_total', 'Database queries run while handling requests, by view.', QUERIES, '{}'),
+        ('flashcards_db_duration_seconds_total', 'Time spent in database queries, by view.', DB_TIME, '{:.6f}'),
+        ('flashcards_response_bytes_total', 'Bytes of non-streaming response bodies, by view.', RESPONSE_BYTES, '{}'),
+        ('flashcards_request_errors_total', 'Responses with a 5xx status, by view.', ERRORS, '{}'),
+    )
+    for name, help_text, index, value_format in counters:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for view, stats in sorted(views.items()):
+            lines.append(f'{name}{{view="{_label(view)}"}} {value_format.format(stats[index])}')
+
+    lines += [
+        '# HELP flashcards_process_max_rss_bytes Peak resident memory of each worker process.',
+        '# TYPE flashcards_process_max_rss_bytes gauge',
+    ]
+    for process, value in sorted(rss.items()):
+        lines.append(f'flashcards_process_max_rss_bytes{{process="{_label(process)}"}} {value}')
+
+    lines += [
+        '# HELP flashcards_fragment_cache_reads_total Reads of cached fragments, by fragment and result.',
+        '# TYPE flashcards_fragment_cache_reads_total counter',
+    ]
+    for fragment, counts in sorted(cache.items()):
+        for result, count in zip(CACHE_RESULTS, counts):
+            lines.append(f'flashcards_fragment_cache_reads_total{{fragment="{_label(fragment)}",result="{result}"}} {count}')
+    return '\n'.join(lines) + '\n'
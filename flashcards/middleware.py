@@ -0,0 +1,340 @@
+import contextvars
+import functools
+import logging
+import re
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.template.base import Node
+from django.urls import Resolver404, resolve
+
+from . import metrics, routers, sharding
+
+logger = logging.getLogger(__name__)
+
+
+# Query observers (execute_wrapper callables) of the current request. Connections
+# are per thread, and async views run their queries in worker threads, so the
+# observers travel in a context variable, which those threads inherit, and one
+# dispatching wrapper is installed on every connection (see install_query_dispatch).
+_observers = contextvars.ContextVar('query_observers', default=())
+
+
+def _dispatch(execute, sql, params, many, context):
+    for observer in _observers.get():
+        execute = functools.partial(observer, execute)
+    return execute(sql, params, many, context)
+
+
+def _install_dispatch(connection, **kwargs):
+    if _dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_dispatch)
+
+
+def install_query_dispatch():
+    """Called from AppConfig.ready(), before any connection is opened."""
+    connection_created.connect(_install_dispatch, dispatch_uid='flashcards.middleware.dispatch')
+
+
+@contextmanager
+def _observing(observer):
+    token = _observers.set((*_observers.get(), observer))
+    try:
+        yield
+    finally:
+        _observers.reset(token)
+
+
+class _QueryTimer:
+    """Counts the queries run through a connection and the time they take."""
+
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """
+    Records per-view latency, database and response size metrics (see
+    flashcards.metrics). Only active with settings.METRICS_ENABLED; keep it
+    first in MIDDLEWARE so the latency covers the whole stack.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = _QueryTimer()
+        start = time.perf_counter()
+        with _observing(timer):
+            response = self.get_response(request)
+        self._record(request, response, time.perf_counter() - start, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = _QueryTimer()
+        start = time.perf_counter()
+        with _observing(timer):
+            response = await self.get_response(request)
+        self._record(request, response, time.perf_counter() - start, timer)
+        return response
+
+    def _record(self, request, response, latency, timer):
+        match = request.resolver_match
+        view = match.view_name if match else metrics.UNMATCHED_VIEW
+        size = 0 if response.streaming else len(response.content)
+        metrics.record(view, latency, timer.count, timer.seconds, size, response.status_code >= 500)
+        metrics.flush()
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+# Collapses the placeholder lists of IN (...) and VALUES so batches of any size share a shape.
+_PLACEHOLDERS = re.compile(r'%s(?:, %s)+')
+
+
+def _caller():
+    """
+    Returns the innermost template node running the current query and the
+    innermost project code line below it (or the whole stack without a template).
+    """
+    code = None
+    project_dir = str(settings.BASE_DIR)
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if frame.f_code.co_name == 'render_annotated':
+            node = frame.f_locals.get('self')
+            if isinstance(node, Node) and getattr(node, 'token', None) and getattr(node, 'origin', None):
+                return f"{node.origin.template_name}:{node.token.lineno}", code
+        elif code is None and filename.startswith(project_dir) and 'site-packages' not in filename:
+            code = f"{filename[len(project_dir) + 1:]}:{frame.f_lineno}"
+        frame = frame.f_back
+    return None, code
+
+
+class _QueryShapes:
+    """
+    Counts queries by shape and remembers where a shape first started
+    repeating. Shapes are counted per database, so one query run on each
+    shard (see sharding.gather) is not taken for a query per row.
+    """
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.counts = Counter()
+        self.callers = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip()[:6].upper() == 'SELECT':
+            shape = (context['connection'].alias, _PLACEHOLDERS.sub('%s', sql))
+            self.counts[shape] += 1
+            if self.counts[shape] == self.threshold:
+                self.callers[shape] = _caller()
+        return execute(sql, params, many, context)
+
+    def repeated(self):
+        return [(shape[1], self.counts[shape], *caller) for shape, caller in self.callers.items()]
+
+
+class NPlusOneMiddleware:
+    """
+    Development aid: reports queries of the same shape that run at least
+    settings.NPLUSONE_THRESHOLD times in one request, typically a template
+    walking a relation per row. settings.NPLUSONE_DETECTION is 'log' to
+    log a warning, 'raise' to fail the request (used by the tests) or empty
+    to disable the middleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if settings.NPLUSONE_DETECTION not in ('log', 'raise'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        shapes = _QueryShapes(settings.NPLUSONE_THRESHOLD)
+        with _observing(shapes):
+            response = self.get_response(request)
+        self._report(request, shapes)
+        return response
+
+    async def __acall__(self, request):
+        shapes = _QueryShapes(settings.NPLUSONE_THRESHOLD)
+        with _observing(shapes):
+            response = await self.get_response(request)
+        self._report(request, shapes)
+        return response
+
+    def _report(self, request, shapes):
+        repeated = shapes.repeated()
+        if repeated:
+            report = '\n'.join(
+                f"  {count} x {shape}\n    template: {template or '-'}, code: {code or '-'}"
+                for shape, count, template, code in repeated
+            )
+            message = f"N+1 queries in {request.method} {request.path}:\n{report}"
+            if settings.NPLUSONE_DETECTION == 'raise':
+                raise NPlusOneError(message)
+            logger.warning(message)
+
+
+class ReplicaMiddleware:
+    """
+    Sends the reads of GET and HEAD requests to the read replica (see
+    flashcards.routers). Once a user writes, a cookie keeps their reads on
+    the primary for settings.REPLICA_STICKY_SECONDS, so they see their own
+    changes while the replica catches up. Only active when a 'replica'
+    database is configured.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if routers.REPLICA not in settings.DATABASES:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with routers.routing(self._use_replica(request)) as state:
+            response = self.get_response(request)
+        self._stick(request, response, state)
+        return response
+
+    async def __acall__(self, request):
+        with routers.routing(self._use_replica(request)) as state:
+            response = await self.get_response(request)
+        self._stick(request, response, state)
+        return response
+
+    def _use_replica(self, request):
+        return request.method in ('GET', 'HEAD') and settings.REPLICA_STICKY_COOKIE not in request.COOKIES
+
+    def _stick(self, request, response, state):
+        # Unsafe requests count as writes even when they wrote through a raw cursor.
+        if state.wrote or request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            response.set_cookie(
+                settings.REPLICA_STICKY_COOKIE, '1',
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite='Lax',
+            )
+
+
+# A streamed body is read from the database after the middleware returned. The
+# shard is selected around each step, since ASGI may run the steps of a
+# synchronous iterator in different threads (and contexts).
+def _stream_in_shard(content, shard):
+    iterator = iter(content)
+    while True:
+        with sharding.using_shard(shard):
+            try:
+                part = next(iterator)
+            except StopIteration:
+                return
+        yield part
+
+
+async def _astream_in_shard(content, shard):
+    iterator = aiter(content)
+    while True:
+        with sharding.using_shard(shard):
+            try:
+                part = await anext(iterator)
+            except StopAsyncIteration:
+                return
+        yield part
+
+
+class ShardMiddleware:
+    """
+    Selects the shard a request reads and writes (see flashcards.sharding):
+    the shard of the topic, deck or card whose id the URL names, else the
+    user's home shard. Only active with settings.DB_SHARDS above 1; keep it
+    after AuthenticationMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+    # URL arguments holding the id of a sharded object (or, for jobs and the
+    # users' admin pages, of an object in the default database, shard 0).
+    ID_ARGUMENTS = ('topic_pk', 'deck_pk', 'card_pk', 'pk', 'object_id')
+
+    def __init__(self, get_response):
+        if not sharding.enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        shard = self._url_shard(request) or sharding.home_shard(request.user.pk)
+        with sharding.using_shard(shard):
+            response = self.get_response(request)
+        if response.streaming and not response.is_async:
+            response.streaming_content = _stream_in_shard(response.streaming_content, shard)
+        return response
+
+    async def __acall__(self, request):
+        shard = self._url_shard(request) or await sharding.ahome_shard((await request.auser()).pk)
+        with sharding.using_shard(shard):
+            response = await self.get_response(request)
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = _astream_in_shard(response.streaming_content, shard)
+            else:
+                response.streaming_content = _stream_in_shard(response.streaming_content, shard)
+        return response
+
+    def _url_shard(self, request):
+        try:
+            match = resolve(request.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return None
+        for name in self.ID_ARGUMENTS:
+            try:
+                return sharding.shard_of_id(match.kwargs[name])
+            except (KeyError, ValueError):
+                continue
+        return None
@@ -0,0 +1,22 @@
+# Generated by Django 6.0 on 2026-10-18 17:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0005_topic_shared_with'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='ease_factor',
+            field=models.FloatField(default=2.5),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['deck', 'next_review_date'], name='card_deck_next_review_idx'),
+        ),
+    ]
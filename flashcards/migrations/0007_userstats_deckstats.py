@@ -0,0 +1,39 @@
+# Generated by Django 6.0 on 2026-10-18 17:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('flashcards', '0006_card_ease_factor_card_card_deck_next_review_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('topic_count', models.IntegerField(default=0)),
+                ('deck_count', models.IntegerField(default=0)),
+                ('card_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DeckStats',
+            fields=[
+                ('deck', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='flashcards.deck')),
+                ('card_count', models.IntegerField(default=0)),
+                ('due_count', models.IntegerField(default=0)),
+                ('due_valid_until', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deck_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'due_valid_until'], name='deckstats_user_due_valid_idx'), models.Index(fields=['user', '-due_count'], name='deckstats_user_due_count_idx')],
+            },
+        ),
+    ]
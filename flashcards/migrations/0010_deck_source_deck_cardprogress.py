@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-18 18:04
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0009_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deck',
+            name='source_deck',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='linked_decks', to='flashcards.deck'),
+        ),
+        migrations.CreateModel(
+            name='CardProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_learned', models.DateTimeField(blank=True, null=True)),
+                ('learned_count', models.IntegerField(default=0)),
+                ('learning_level', models.IntegerField(default=0)),
+                ('ease_factor', models.FloatField(default=2.5)),
+                ('next_review_date', models.DateTimeField(default=django.utils.timezone.now)),
+                ('card', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='progress', to='flashcards.card')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='card_progress', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'card'), name='card_progress_user_card_unique')],
+            },
+        ),
+    ]
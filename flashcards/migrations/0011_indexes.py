@@ -0,0 +1,29 @@
+# Generated by Django 6.0 on 2026-10-18 18:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0010_deck_source_deck_cardprogress'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='topic',
+            index=models.Index(fields=['user', 'name'], name='topic_user_name_idx'),
+        ),
+        # The auto-created shared_with tables cannot declare Meta indexes. "What is
+        # shared with this user" reads them by user, so lead with user_id.
+        migrations.RunSQL(
+            'CREATE INDEX deck_shared_with_user_deck_idx ON flashcards_deck_shared_with (user_id, deck_id);',
+            reverse_sql='DROP INDEX deck_shared_with_user_deck_idx;',
+        ),
+        migrations.RunSQL(
+            'CREATE INDEX topic_shared_with_user_topic_idx ON flashcards_topic_shared_with (user_id, topic_id);',
+            reverse_sql='DROP INDEX topic_shared_with_user_topic_idx;',
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 6.0 on 2026-10-18 19:40
+
+from django.db import migrations
+
+# An external-content FTS5 index over the card text (and deck, so searches can be
+# restricted to a user's decks inside the index), kept in sync by triggers so that
+# bulk inserts and INSERT ... SELECT copies are indexed as well.
+CREATE_SQL = [
+    "CREATE VIRTUAL TABLE flashcards_card_fts USING fts5("
+    "front, back, deck_id, content='flashcards_card', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    """CREATE TRIGGER flashcards_card_fts_insert AFTER INSERT ON flashcards_card BEGIN
+        INSERT INTO flashcards_card_fts (rowid, front, back, deck_id) VALUES (new.id, new.front, new.back, new.deck_id);
+    END""",
+    """CREATE TRIGGER flashcards_card_fts_delete AFTER DELETE ON flashcards_card BEGIN
+        INSERT INTO flashcards_card_fts (flashcards_card_fts, rowid, front, back, deck_id)
+        VALUES ('delete', old.id, old.front, old.back, old.deck_id);
+    END""",
+    # Reviews only update scheduling columns and leave the index alone.
+    """CREATE TRIGGER flashcards_card_fts_update AFTER UPDATE OF front, back, deck_id ON flashcards_card BEGIN
+        INSERT INTO flashcards_card_fts (flashcards_card_fts, rowid, front, back, deck_id)
+        VALUES ('delete', old.id, old.front, old.back, old.deck_id);
+        INSERT INTO flashcards_card_fts (rowid, front, back, deck_id) VALUES (new.id, new.front, new.back, new.deck_id);
+    END""",
+    # ORDER BY rank: matches on the front count twice, the deck column not at all.
+    "INSERT INTO flashcards_card_fts (flashcards_card_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0, 0.0)')",
+    "INSERT INTO flashcards_card_fts (flashcards_card_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS flashcards_card_fts_insert",
+    "DROP TRIGGER IF EXISTS flashcards_card_fts_delete",
+    "DROP TRIGGER IF EXISTS flashcards_card_fts_update",
+    "DROP TABLE IF EXISTS flashcards_card_fts",
+]
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in CREATE_SQL:
+            schema_editor.execute(statement)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_SQL:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0011_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
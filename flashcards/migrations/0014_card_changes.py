@@ -0,0 +1,97 @@
+# Generated by Django 6.0 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# The change log behind delta sync (flashcards.sync), kept by triggers so that bulk
+# inserts, INSERT ... SELECT copies and bulk_update reviews are recorded as well.
+# Each card keeps one entry (plus one per linked learner's progress): a change
+# replaces the previous entry, so the log grows with the cards, not with the edits.
+CREATE_SQL = [
+    f"""CREATE TRIGGER flashcards_cardchange_card_insert AFTER INSERT ON flashcards_card BEGIN
+        INSERT INTO flashcards_cardchange (deck_id, card_id, user_id, deleted, changed_at)
+        VALUES (new.deck_id, new.id, NULL, 0, {NOW});
+    END""",
+    f"""CREATE TRIGGER flashcards_cardchange_card_update AFTER UPDATE OF front, back, deck_id, next_review_date
+    ON flashcards_card
+    WHEN old.front IS NOT new.front OR old.back IS NOT new.back OR old.deck_id IS NOT new.deck_id
+        OR old.next_review_date IS NOT new.next_review_date
+    BEGIN
+        DELETE FROM flashcards_cardchange WHERE card_id = new.id AND user_id IS NULL;
+        INSERT INTO flashcards_cardchange (deck_id, card_id, user_id, deleted, changed_at)
+        SELECT old.deck_id, old.id, NULL, 1, {NOW} WHERE old.deck_id IS NOT new.deck_id;
+        INSERT INTO flashcards_cardchange (deck_id, card_id, user_id, deleted, changed_at)
+        VALUES (new.deck_id, new.id, NULL, 0, {NOW});
+    END""",
+    f"""CREATE TRIGGER flashcards_cardchange_card_delete AFTER DELETE ON flashcards_card BEGIN
+        DELETE FROM flashcards_cardchange WHERE card_id = old.id;
+        INSERT INTO flashcards_cardchange (deck_id, card_id, user_id, deleted, changed_at)
+        VALUES (old.deck_id, old.id, NULL, 1, {NOW});
+    END""",
+    # A linked learner's schedule lives in CardProgress; only their own syncs read these entries.
+    f"""CREATE TRIGGER flashcards_cardchange_progress_insert AFTER INSERT ON flashcards_cardprogress BEGIN
+        DELETE FROM flashcards_cardchange WHERE card_id = new.card_id AND user_id = new.user_id;
+        INSERT INTO flashcards_cardchange (deck_id, card_id, user_id, deleted, changed_at)
+        SELECT deck_id, id, new.user_id, 0, {NOW} FROM flashcards_card WHERE id = new.card_id;
+    END""",
+    f"""CREATE TRIGGER flashcards_cardchange_progress_update AFTER UPDATE OF next_review_date
+    ON flashcards_cardprogress
+    WHEN old.next_review_date IS NOT new.next_review_date
+    BEGIN
+        DELETE FROM flashcards_cardchange WHERE card_id = new.card_id AND user_id = new.user_id;
+        INSERT INTO flashcards_cardchange (deck_id, card_id, user_id, deleted, changed_at)
+        SELECT deck_id, id, new.user_id, 0, {NOW} FROM flashcards_card WHERE id = new.card_id;
+    END""",
+    # Existing cards and progress start out as changes, so a first sync is a full one.
+    f"""INSERT INTO flashcards_cardchange (deck_id, card_id, user_id, deleted, changed_at)
+    SELECT deck_id, id, NULL, 0, {NOW} FROM flashcards_card ORDER BY id""",
+    f"""INSERT INTO flashcards_cardchange (deck_id, card_id, user_id, deleted, changed_at)
+    SELECT card.deck_id, card.id, progress.user_id, 0, {NOW}
+    FROM flashcards_cardprogress progress JOIN flashcards_card card ON card.id = progress.card_id""",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS flashcards_cardchange_card_insert",
+    "DROP TRIGGER IF EXISTS flashcards_cardchange_card_update",
+    "DROP TRIGGER IF EXISTS flashcards_cardchange_card_delete",
+    "DROP TRIGGER IF EXISTS flashcards_cardchange_progress_insert",
+    "DROP TRIGGER IF EXISTS flashcards_cardchange_progress_update",
+]
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in CREATE_SQL:
+            schema_editor.execute(statement, params=None)
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_SQL:
+            schema_editor.execute(statement, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0013_revisions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('deck_id', models.IntegerField()),
+                ('card_id', models.IntegerField()),
+                ('user_id', models.IntegerField(null=True)),
+                ('deleted', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['deck_id', 'id'], name='cardchange_deck_id_idx'), models.Index(fields=['card_id', 'user_id'], name='cardchange_card_user_idx')],
+            },
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,104 @@
+# Generated by Django 6.0 on 2026-10-18 21:40
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+NOW = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# The change log now records card content only: a review rewrites the card's
+# scheduling columns, and logging that put a DELETE and an INSERT on the hottest
+# write path. The syncing client gets the schedules of the cards it reviewed in
+# the response that applied the reviews (see views.sync_deck_for_learning).
+CREATE_SQL = [
+    f"""CREATE TRIGGER flashcards_cardchange_card_insert AFTER INSERT ON flashcards_card BEGIN
+        INSERT INTO flashcards_cardchange (deck_id, card_id, deleted, changed_at)
+        VALUES (new.deck_id, new.id, 0, {NOW});
+    END""",
+    f"""CREATE TRIGGER flashcards_cardchange_card_update AFTER UPDATE OF front, back, deck_id ON flashcards_card
+    WHEN old.front IS NOT new.front OR old.back IS NOT new.back OR old.deck_id IS NOT new.deck_id
+    BEGIN
+        DELETE FROM flashcards_cardchange WHERE card_id = new.id;
+        INSERT INTO flashcards_cardchange (deck_id, card_id, deleted, changed_at)
+        SELECT old.deck_id, old.id, 1, {NOW} WHERE old.deck_id IS NOT new.deck_id;
+        INSERT INTO flashcards_cardchange (deck_id, card_id, deleted, changed_at)
+        VALUES (new.deck_id, new.id, 0, {NOW});
+    END""",
+    f"""CREATE TRIGGER flashcards_cardchange_card_delete AFTER DELETE ON flashcards_card BEGIN
+        DELETE FROM flashcards_cardchange WHERE card_id = old.id;
+        INSERT INTO flashcards_cardchange (deck_id, card_id, deleted, changed_at)
+        VALUES (old.deck_id, old.id, 1, {NOW});
+    END""",
+]
+
+DROP_SQL = [
+    "DROP TRIGGER IF EXISTS flashcards_cardchange_card_insert",
+    "DROP TRIGGER IF EXISTS flashcards_cardchange_card_update",
+    "DROP TRIGGER IF EXISTS flashcards_cardchange_card_delete",
+]
+
+# The triggers of 0014, which also logged schedules and linked learners' progress.
+previous = import_module('flashcards.migrations.0014_card_changes')
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in CREATE_SQL:
+            schema_editor.execute(statement, params=None)
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_SQL:
+            schema_editor.execute(statement, params=None)
+
+
+def drop_previous_triggers(apps, schema_editor):
+    previous.drop_triggers(apps, schema_editor)
+
+
+def restore_previous_triggers(apps, schema_editor):
+    # Only the triggers: the log they keep is still there.
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in previous.CREATE_SQL[:len(previous.DROP_SQL)]:
+            schema_editor.execute(statement, params=None)
+
+
+def drop_progress_entries(apps, schema_editor):
+    CardChange = apps.get_model('flashcards', 'CardChange')
+    CardChange.objects.using(schema_editor.connection.alias).filter(user_id__isnull=False).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flashcards', '0015_user_shards'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_previous_triggers, restore_previous_triggers),
+        migrations.RunPython(drop_progress_entries, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='cardchange',
+            name='cardchange_card_user_idx',
+        ),
+        migrations.RemoveField(
+            model_name='cardchange',
+            name='user_id',
+        ),
+        migrations.AlterField(
+            model_name='cardchange',
+            name='card_id',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='cardchange',
+            name='deck_id',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='cardchange',
+            index=models.Index(fields=['card_id'], name='cardchange_card_idx'),
+        ),
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
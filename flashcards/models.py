@@ -6,6 +6,14 @@ class Topic(models.Model):
     name = models.CharField(max_length=100)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="topics")
     shared_with = models.ManyToManyField(User, related_name='shared_topics', blank=True)
+    # Bumped whenever the topic's export would change (see flashcards.revisions).
+    revision = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # The topic list: one user's topics ordered by name.
+            models.Index(fields=['user', 'name'], name='topic_user_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -14,6 +22,13 @@ class Deck(models.Model):
     name = models.CharField(max_length=100)
     topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name="decks")
     shared_with = models.ManyToManyField(User, related_name='shared_decks', blank=True)
+    # Copy-on-write link to the deck whose cards this one shows; scheduling is
+    # kept per user in CardProgress until the deck is materialized (flashcards.linked).
+    source_deck = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, null=True, blank=True, related_name='linked_decks'
+    )
+    # Bumped whenever the deck's name, cards or card text change (see flashcards.revisions).
+    revision = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.name
@@ -25,7 +40,187 @@ class Card(models.Model):
     last_learned = models.DateTimeField(null=True, blank=True)
     learned_count = models.IntegerField(default=0)
     learning_level = models.IntegerField(default=0)
+    ease_factor = models.FloatField(default=2.5)
+    next_review_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Serves "the N most overdue cards of a deck" as a range scan.
+            models.Index(fields=['deck', 'next_review_date'], name='card_deck_next_review_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.front[:20]}..."
+
+class CardProgress(models.Model):
+    """A user's scheduling state for a card of a deck they do not own (a linked or shared deck)."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='card_progress')
+    # Like ReviewEvent.card: no cascade, so the owner's card deletes stay fast deletes.
+    card = models.ForeignKey(Card, on_delete=models.DO_NOTHING, db_constraint=False, related_name='progress')
+    last_learned = models.DateTimeField(null=True, blank=True)
+    learned_count = models.IntegerField(default=0)
+    learning_level = models.IntegerField(default=0)
+    ease_factor = models.FloatField(default=2.5)
     next_review_date = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'card'], name='card_progress_user_card_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} on card {self.card_id}"
+
+# --- Statistics snapshot (maintained by flashcards.stats) ---
+
+class UserStats(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    topic_count = models.IntegerField(default=0)
+    deck_count = models.IntegerField(default=0)
+    card_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Stats for {self.user}"
+
+class DeckStats(models.Model):
+    deck = models.OneToOneField(Deck, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    # Denormalized owner, so the dashboard does not have to join through Topic.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='deck_stats')
+    card_count = models.IntegerField(default=0)
+    due_count = models.IntegerField(default=0)
+    # due_count is exact until this moment (the next card becomes due); NULL means
+    # no card is scheduled in the future. A past value marks the count as stale.
+    due_valid_until = models.DateTimeField(null=True, blank=True)
+    # Bumped by every review of the deck's cards; with the deck revision and
+    # due_valid_until it identifies the deck's due cards (see flashcards.revisions).
+    schedule_version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'due_valid_until'], name='deckstats_user_due_valid_idx'),
+            models.Index(fields=['user', '-due_count'], name='deckstats_user_due_count_idx'),
+        ]
+
+    def __str__(self):
+        return f"Stats for {self.deck}"
+
+
+# --- Review history ---
+
+class ReviewEvent(models.Model):
+    """Append-only log of reviews; pruned by the prune_review_events command."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='review_events')
+    # No constraint and no cascade: the history outlives deleted cards, and card
+    # deletes stay fast deletes instead of updating or collecting log rows.
+    card = models.ForeignKey(Card, on_delete=models.DO_NOTHING, db_constraint=False, related_name='review_events')
+    correct = models.BooleanField()
+    reviewed_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.user} reviewed {self.card_id} at {self.reviewed_at}"
+
+class DailyActivity(models.Model):
+    """Per-user daily rollup of ReviewEvent, kept up to date as events arrive."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_activity')
+    day = models.DateField()
+    reviews = models.IntegerField(default=0)
+    correct = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='daily_activity_user_day_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} on {self.day}: {self.reviews} reviews"
+
+
+# --- Delta sync (see flashcards.sync) ---
+
+class CardChange(models.Model):
+    """
+    The latest change to each card's content, ordered by id. Written by
+    database triggers (migration 0016), so bulk and raw SQL writes are
+    covered; reviews, which only reschedule a card, are not recorded.
+    Deleted cards leave a tombstone that prune_sync_tombstones removes after
+    SYNC_TOMBSTONE_DAYS.
+    """
+    # Plain columns rather than foreign keys: tombstones outlive their cards.
+    # 64-bit, since shards hand out ids from N * 2**40 (see flashcards.sharding).
+    deck_id = models.BigIntegerField()
+    card_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # A deck's changes since a sync token, as a range scan.
+            models.Index(fields=['deck_id', 'id'], name='cardchange_deck_id_idx'),
+            # The triggers replace a card's previous entry.
+            models.Index(fields=['card_id'], name='cardchange_card_idx'),
+        ]
+
+    def __str__(self):
+        return f"{'Deleted' if self.deleted else 'Changed'} card {self.card_id} (#{self.pk})"
+
+
+# --- Background jobs (see flashcards.jobs) ---
+
+class Job(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+    KIND_LABELS = {
+        'import': 'Import',
+        'export_topic': 'Topic export',
+        'accept_topic': 'Copying shared topic',
+        'accept_deck': 'Copying shared deck',
+        'delete_topic': 'Deleting topic',
+    }
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    # Relative to settings.JOB_RESULTS_DIR
+    result_file = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The worker's claim query: oldest runnable pending job.
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+
+    @property
+    def label(self):
+        return self.KIND_LABELS.get(self.kind, self.kind)
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+# --- Sharding (see flashcards.sharding) ---
+
+class UserShard(models.Model):
+    """The shard holding a user's data; users without a row live on shard 0."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='shard')
+    shard = models.PositiveSmallIntegerField()
+
     def __str__(self):
-        return f"{self.front[:20]}..."
\ No newline at end of file
+        return f"{self.user} on shard {self.shard}"
@@ -0,0 +1,49 @@
+"""
+Content versions for conditional GETs.
+
+Deck.revision changes whenever the deck's name, its cards or their text
+change, and Topic.revision whenever one of its decks does or the topic is
+renamed. Both are bumped with UPDATE ... SET revision = revision + 1 from
+the model signals and the cards_changed signal of the bulk paths.
+Reviews bump DeckStats.schedule_version instead, in the same UPDATE that
+marks the deck's due count stale.
+
+ETags are built from these counters, so the views can answer If-None-Match
+from the deck or topic row they load anyway, without reading any cards.
+"""
+from django.db.models import F, Q
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from .models import Deck, Topic
+
+
+def bump_decks(deck_ids):
+    """Bumps the decks, the decks linked to them and the topics of all of those."""
+    decks = Deck.objects.filter(Q(pk__in=deck_ids) | Q(source_deck_id__in=deck_ids))
+    Topic.objects.filter(pk__in=decks.values('topic_id')).update(revision=F('revision') + 1)
+    decks.update(revision=F('revision') + 1)
+
+
+def bump_topics(topic_ids):
+    Topic.objects.filter(pk__in=topic_ids).update(revision=F('revision') + 1)
+
+
+def deck_etag(deck, *variant):
+    return '"' + '-'.join(['deck', str(deck.pk), str(deck.revision), *map(str, variant)]) + '"'
+
+
+def topic_etag(topic, *variant):
+    return '"' + '-'.join(['topic', str(topic.pk), str(topic.revision), *map(str, variant)]) + '"'
+
+
+def not_modified(request, etag):
+    """Returns a 304 response if the request's If-None-Match matches `etag`, else None."""
+    response = get_conditional_response(request, etag=etag)
+    return None if response is None else add_etag(response, etag)
+
+
+def add_etag(response, etag):
+    """Sets the ETag and asks clients to revalidate before reusing their copy."""
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
@@ -0,0 +1,101 @@
+"""
+Database routers: read/write routing between the primary database
+('default') and a read replica ('replica', configured by
+settings.DB_REPLICA_NAME), and routing to shards (see flashcards.sharding).
+
+Reads go to the replica only inside `routing(use_replica=True)`, which
+ReplicaMiddleware enters for GET and HEAD requests of users who have not
+written recently. Everything else (unsafe requests, management commands,
+background jobs) reads from the primary, as do:
+
+- reads after the request wrote, so a view sees its own changes;
+- reads inside a transaction on the primary, which must see the
+  transaction's snapshot;
+- sessions, since a session created at login must be found by the very
+  next request.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from . import sharding
+
+REPLICA = 'replica'
+PRIMARY_APPS = {'sessions'}
+
+
+class _Routing:
+    __slots__ = ('use_replica', 'wrote')
+
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+
+
+# Like the query observers in flashcards.middleware, the routing of the current
+# request travels in a context variable so the worker threads of async views see it.
+_routing = contextvars.ContextVar('replica_routing', default=None)
+
+
+@contextmanager
+def routing(use_replica):
+    """Routes the reads run inside the block; yields the state, whose `wrote` tells whether anything was written."""
+    state = _Routing(use_replica)
+    token = _routing.set(state)
+    try:
+        yield state
+    finally:
+        _routing.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if (
+            state is None
+            or not state.use_replica
+            or model._meta.app_label in PRIMARY_APPS
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.use_replica = False
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica is a copy of the primary and is never migrated itself.
+        return db == DEFAULT_DB_ALIAS
+
+
+class ShardRouter:
+    """Used instead of ReplicaRouter when settings.DB_SHARDS is above 1."""
+
+    def _db(self, model, hints):
+        # Relations of an object loaded from a shard are on the same shard, users included.
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db and sharding.is_sharded(instance.__class__):
+            return instance._state.db
+        return sharding.current() if sharding.is_sharded(model) else DEFAULT_DB_ALIAS
+
+    def db_for_read(self, model, **hints):
+        return self._db(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Every shard has every table: the auth tables hold the copies of the users.
+        return True
@@ -0,0 +1,50 @@
+"""
+Spaced-repetition scheduling (SM-2, adapted to correct/incorrect feedback).
+
+`Card.learning_level` is the number of consecutive correct reviews and
+`Card.next_review_date` is when the card becomes due again. Because the learn
+page only reports correct/incorrect, a correct answer is graded as SM-2
+quality 4 (ease unchanged) and a lapse lowers the ease factor the way Anki
+does, instead of using the full 0-5 quality scale.
+"""
+from datetime import timedelta
+
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+LAPSE_EASE_PENALTY = 0.2
+
+FIRST_INTERVAL = timedelta(days=1)
+SECOND_INTERVAL = timedelta(days=6)
+# A failed card comes back shortly, so it can be relearned in the same sitting.
+RELEARN_INTERVAL = timedelta(minutes=10)
+
+# Fields written by review(), for use with save(update_fields=...) and bulk_update().
+SCHEDULE_FIELDS = ['last_learned', 'learned_count', 'learning_level', 'ease_factor', 'next_review_date']
+
+
+def next_interval(level, ease, previous_interval):
+    if level <= 1:
+        return FIRST_INTERVAL
+    if level == 2:
+        return SECOND_INTERVAL
+    return max(previous_interval, SECOND_INTERVAL) * ease
+
+
+def review(card, correct, reviewed_at):
+    """Applies one review to `card` in place; the caller saves it."""
+    previous_interval = None
+    if card.last_learned and card.next_review_date > card.last_learned:
+        previous_interval = card.next_review_date - card.last_learned
+
+    if correct:
+        card.learning_level += 1
+        interval = next_interval(card.learning_level, card.ease_factor, previous_interval or SECOND_INTERVAL)
+    else:
+        card.learning_level = 0
+        card.ease_factor = max(MIN_EASE, card.ease_factor - LAPSE_EASE_PENALTY)
+        interval = RELEARN_INTERVAL
+
+    card.learned_count += 1
+    card.last_learned = reviewed_at
+    card.next_review_date = reviewed_at + interval
+    return card
@@ -0,0 +1,138 @@
+"""
+Full-text card search backed by an SQLite FTS5 index.
+
+flashcards_card_fts is an external-content FTS5 table over the front, back
+and deck_id columns of flashcards_card. Triggers on the card table keep it
+in sync (see migration 0012_card_fts), so every write path is covered, including
+the INSERT ... SELECT copies and bulk inserts that bypass model signals.
+Indexing deck_id lets a search be restricted to the user's decks inside
+the FTS query itself, instead of ranking every match and filtering later.
+
+On other databases search falls back to case-insensitive LIKE matching.
+"""
+import re
+
+from django.db import connections, router
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from . import access
+from .models import Card
+
+FTS_TABLE = 'flashcards_card_fts'
+
+MAX_TERMS = 10
+# Highlight markers; replaced by <mark> after the text has been escaped.
+_START, _END = '\x02', '\x03'
+_TERM = re.compile(r'\w+')
+
+def _connection():
+    return connections[router.db_for_read(Card)]
+
+
+def is_available(connection=None):
+    return (connection or _connection()).vendor == 'sqlite'
+
+
+def terms(query):
+    return _TERM.findall(query.lower())[:MAX_TERMS]
+
+
+def match_expression(query):
+    """
+    Turns free text into an FTS5 query: every word must occur in the front
+    or back, the last one as a prefix so results appear while typing.
+    Returns '' when the text has no searchable words.
+    """
+    words = terms(query)
+    if not words:
+        return ''
+    quoted = [f'"{word}"' for word in words]
+    quoted[-1] += '*'
+    return '{front back} : (' + ' AND '.join(quoted) + ')'
+
+
+def _restrict_to_decks(expression, deck_ids):
+    return f"{expression} AND deck_id : ({' OR '.join(str(deck_id) for deck_id in deck_ids)})"
+
+
+def _highlight(text):
+    return mark_safe(escape(text).replace(_START, '<mark>').replace(_END, '</mark>'))
+
+
+def searchable_decks(user):
+    """
+    Returns {id of the deck holding the cards: deck shown to the user} for
+    the decks the user may view (see flashcards.access). A linked deck's cards live in its source
+    deck.
+    """
+    decks = {}
+    for deck in access.viewable_decks(user).select_related('topic'):
+        key = deck.source_deck_id or deck.pk
+        # The user's own (linked) deck wins over the shared original.
+        if key not in decks or deck.topic.user_id == user.pk:
+            decks[key] = deck
+    return decks
+
+
+def search_cards(user, query, offset=0, limit=20):
+    """
+    Returns up to `limit` matching cards of the user's decks, best first,
+    and whether more results follow. Each result is a dict with the card's
+    id, front and back, `front_html`/`back_html` with the matches wrapped
+    in <mark>, and the deck the user sees the card in.
+    """
+    decks = searchable_decks(user)
+    expression = match_expression(query)
+    if not decks or not expression:
+        return [], False
+
+    connection = _connection()
+    if is_available(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid, deck_id, highlight({FTS_TABLE}, 0, %s, %s), highlight({FTS_TABLE}, 1, %s, %s) "
+                f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                "ORDER BY rank LIMIT %s OFFSET %s",  # bm25 with the front weighted double
+                [_START, _END, _START, _END, _restrict_to_decks(expression, decks), limit + 1, offset],
+            )
+            rows = cursor.fetchall()
+    else:
+        cards = Card.objects.filter(deck_id__in=decks)
+        for word in terms(query):
+            cards = cards.filter(Q(front__icontains=word) | Q(back__icontains=word))
+        rows = list(cards.order_by('id').values_list('id', 'deck_id', 'front', 'back')[offset:offset + limit + 1])
+
+    results = [
+        {
+            'id': card_id,
+            'front': front.replace(_START, '').replace(_END, ''),
+            'back': back.replace(_START, '').replace(_END, ''),
+            'front_html': _highlight(front),
+            'back_html': _highlight(back),
+            'deck': decks[int(deck_id)],
+        }
+        for card_id, deck_id, front, back in rows[:limit]
+    ]
+    return results, len(rows) > limit
+
+
+def search_card_ids_sql(query):
+    """Returns (sql, params) selecting the ids of all cards matching `query`, for use in a subquery."""
+    return f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match_expression(query)]
+
+
+def rebuild(connection=None):
+    """Rebuilds the index from the card table, then merges its segments."""
+    connection = connection or _connection()
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+
+
+def check(connection=None):
+    """Raises DatabaseError if the index does not match the card table."""
+    connection = connection or _connection()
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('integrity-check', 1)")
@@ -0,0 +1,167 @@
+"""
+Per-user sharding across several database files (settings.DB_SHARDS).
+
+A user's topics, decks, cards, progress, statistics and review history
+live on one shard, their home shard. Users, sessions and jobs stay in the
+default database, which is also shard 0. UserShard records each home: new
+users are placed by a hash of their id, users without a row (created
+before sharding was enabled) are on shard 0, and `manage.py
+move_user_shard` moves a user.
+
+Ids name their shard: shard N hands out ids from N * SHARD_ID_SPAN on (see
+seed_id_ranges), so a URL naming a topic, deck or card is routed without a
+lookup. ShardMiddleware selects the shard of each request that way, or
+the user's home shard; routers.ShardRouter sends ORM access to the
+selected shard, and objects loaded from a shard keep using it for their
+relations. Code running outside a request selects a shard with
+using_shard() or each_shard(); sharding.atomic() opens its transaction.
+
+Every shard holds a copy of each user's row (without the password), so
+shares with users on other shards stay with the shared deck or topic.
+Across shards, accepting a share copies the cards even with
+SHARE_COPY_ON_WRITE (a link cannot span shards), the shared-with-me lists
+read every shard, and reviews update the card on its shard while the
+reviewer's history goes to their home shard. Search covers the home shard.
+"""
+import contextvars
+import zlib
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+SHARD_ID_SPAN = 2 ** 40
+# Models kept in the default database only.
+GLOBAL_MODELS = {'flashcards.Job', 'flashcards.UserShard'}
+MIRRORED_USER_FIELDS = ('username', 'first_name', 'last_name', 'email', 'is_active')
+
+_current = contextvars.ContextVar('shard', default=None)
+
+
+def enabled():
+    return settings.DB_SHARDS > 1
+
+
+def alias(index):
+    return DEFAULT_DB_ALIAS if index == 0 else f'shard{index}'
+
+
+def aliases():
+    return [alias(index) for index in range(max(settings.DB_SHARDS, 1))]
+
+
+def index_of(name):
+    return 0 if name == DEFAULT_DB_ALIAS else int(name.removeprefix('shard'))
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'flashcards' and model._meta.label not in GLOBAL_MODELS
+
+
+def shard_of_id(pk):
+    """The shard holding the object with this id; unknown ranges map to the default database."""
+    index = int(pk) // SHARD_ID_SPAN
+    return alias(index) if 0 <= index < settings.DB_SHARDS else DEFAULT_DB_ALIAS
+
+
+def hashed_shard(user_id):
+    """The shard a new user is placed on: stable across processes and restarts."""
+    return zlib.crc32(str(user_id).encode()) % settings.DB_SHARDS
+
+
+def home_shard(user_id):
+    if not enabled() or user_id is None:
+        return DEFAULT_DB_ALIAS
+    from .models import UserShard
+
+    return alias(UserShard.objects.filter(user_id=user_id).values_list('shard', flat=True).first() or 0)
+
+
+async def ahome_shard(user_id):
+    if not enabled() or user_id is None:
+        return DEFAULT_DB_ALIAS
+    from .models import UserShard
+
+    return alias(await UserShard.objects.filter(user_id=user_id).values_list('shard', flat=True).afirst() or 0)
+
+
+# --- Selecting a shard ---
+
+def current():
+    return _current.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def using_shard(name):
+    token = _current.set(name)
+    try:
+        yield name
+    finally:
+        _current.reset(token)
+
+
+def each_shard():
+    """Runs the loop body once per shard, with that shard selected: `for name in each_shard(): ...`."""
+    for name in aliases():
+        with using_shard(name):
+            yield name
+
+
+def atomic(**kwargs):
+    """transaction.atomic() on the selected shard."""
+    return transaction.atomic(using=current(), **kwargs)
+
+
+def gather(queryset):
+    """Evaluates `queryset` on every shard and concatenates the results."""
+    return [obj for name in aliases() for obj in queryset.using(name)]
+
+
+# --- Setting up shards ---
+
+def mirror_users(users, shards=None):
+    """Copies the users' rows, without their passwords, to `shards` (default: all but the default database)."""
+    users = list(users)
+    if not enabled() or not users:
+        return
+    password = make_password(None)
+    copies = [
+        User(pk=user.pk, password=password, **{field: getattr(user, field) for field in MIRRORED_USER_FIELDS})
+        for user in users
+    ]
+    for name in shards or aliases()[1:]:
+        User.objects.using(name).bulk_create(
+            copies, update_conflicts=True, unique_fields=['id'], update_fields=MIRRORED_USER_FIELDS,
+        )
+
+
+def seed_id_ranges(using):
+    """Makes shard `using` hand out ids from its range by raising each table's AUTOINCREMENT counter."""
+    index = index_of(using)
+    connection = connections[using]
+    if index == 0 or connection.vendor != 'sqlite':
+        return
+    start = index * SHARD_ID_SPAN
+    tables = [
+        model._meta.db_table
+        for model in apps.get_app_config('flashcards').get_models(include_auto_created=True)
+        if is_sharded(model) and model._meta.auto_field is not None
+    ]
+    with connection.cursor() as cursor:
+        for table in tables:
+            cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s', [start, table, start])
+            cursor.execute(
+                'INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s '
+                'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)',
+                [table, start, table],
+            )
+
+
+def shard_migrated(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """post_migrate receiver: prepares a shard for use."""
+    if enabled() and using != DEFAULT_DB_ALIAS:
+        seed_id_ranges(using)
+        mirror_users(User.objects.using(DEFAULT_DB_ALIAS).iterator(), shards=[using])
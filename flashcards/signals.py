@@ -0,0 +1,187 @@
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+from django.db.models.functions import Coalesce, Least
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from . import caching, linked, revisions, scheduling, sharding, stats
+from .models import Card, Deck, DeckStats, Topic, UserShard, UserStats
+
+# Sent by code paths that add or remove cards without per-row model signals
+# (bulk_create, queryset deletes). Arguments: deck_ids.
+cards_changed = Signal()
+
+
+@receiver(post_save, sender=Topic)
+def topic_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.filter(pk=instance.user_id).update(topic_count=F('topic_count') + 1)
+    elif not raw:
+        revisions.bump_topics([instance.pk])
+
+
+@receiver(pre_delete, sender=Topic)
+def topic_deleted(sender, instance, **kwargs):
+    # The topic's decks are cascaded and report themselves through deck_deleted.
+    UserStats.objects.filter(pk=instance.user_id).update(topic_count=F('topic_count') - 1)
+
+
+@receiver(post_save, sender=Deck)
+def deck_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        user_id = instance.topic.user_id
+        DeckStats.objects.create(deck=instance, user_id=user_id)
+        UserStats.objects.filter(pk=user_id).update(deck_count=F('deck_count') + 1)
+
+
+@receiver(pre_delete, sender=Deck)
+def deck_deleted(sender, instance, **kwargs):
+    deck_stats = DeckStats.objects.filter(pk=instance.pk).values('user_id', 'card_count').first()
+    if deck_stats:
+        UserStats.objects.filter(pk=deck_stats['user_id']).update(
+            deck_count=F('deck_count') - 1,
+            card_count=F('card_count') - deck_stats['card_count'],
+        )
+
+
+@receiver(post_save, sender=Deck)
+def deck_revised(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        revisions.bump_topics([instance.topic_id])
+    else:
+        revisions.bump_decks([instance.pk])
+
+
+@receiver(post_delete, sender=Deck)
+def deck_removed(sender, instance, **kwargs):
+    revisions.bump_topics([instance.topic_id])
+
+
+@receiver(pre_delete, sender=Deck)
+def deck_links_deleted(sender, instance, **kwargs):
+    if instance.source_deck_id is not None:
+        linked.forget_progress(instance)
+    # Recipients keep their linked copies: give them the cards before these go.
+    for linked_deck in instance.linked_decks.select_related('topic'):
+        linked.materialize(linked_deck)
+
+
+@receiver(post_save, sender=Card)
+def card_saved(sender, instance, created, raw=False, **kwargs):
+    # Card deletes are not hooked: a pre/post_delete receiver on Card would
+    # disable fast cascade deletes. Deleting views send cards_changed instead.
+    if not created or raw:
+        return
+    deck_stats = DeckStats.objects.filter(pk=instance.deck_id)
+    if instance.next_review_date <= timezone.now():
+        deck_stats.update(card_count=F('card_count') + 1, due_count=F('due_count') + 1)
+    else:
+        deck_stats.update(
+            card_count=F('card_count') + 1,
+            due_valid_until=Least(Coalesce(F('due_valid_until'), instance.next_review_date), instance.next_review_date),
+        )
+    UserStats.objects.filter(
+        pk__in=deck_stats.values('user_id')
+    ).update(card_count=F('card_count') + 1)
+    # Decks linked to this one show the card too, as new (and so due) to their owners.
+    linked_users = list(DeckStats.objects.filter(deck__source_deck_id=instance.deck_id).values_list('user_id', flat=True))
+    if linked_users:
+        DeckStats.objects.filter(deck__source_deck_id=instance.deck_id).update(
+            card_count=F('card_count') + 1, due_count=F('due_count') + 1
+        )
+        stats.refresh_user_card_counts(set(linked_users))
+
+
+@receiver(post_save, sender=Card)
+def card_revised(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    # Reviews save only scheduling fields and leave the deck's content as it was.
+    if raw or (update_fields and set(update_fields) <= {*scheduling.SCHEDULE_FIELDS}):
+        return
+    revisions.bump_decks([instance.deck_id])
+
+
+@receiver(cards_changed)
+def deck_cards_changed(sender, deck_ids, **kwargs):
+    deck_ids = list(deck_ids)
+    revisions.bump_decks(deck_ids)
+    deck_ids += Deck.objects.filter(source_deck_id__in=deck_ids).values_list('pk', flat=True)
+    deck_stats = stats.refresh_deck_stats(deck_ids)
+    stats.refresh_user_card_counts({row.user_id for row in deck_stats})
+
+
+# Cached fragments (see flashcards.caching). Topic lists show the owner's topics
+# with their deck counts; the shared-with-me lists show names of shared decks and
+# topics. Card changes reach the cache through Topic.revision instead.
+
+def _sharers(obj):
+    return list(obj.shared_with.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Topic)
+def topic_saved_uncache(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    users = [instance.user_id]
+    if not created:
+        # The recipients of the topic and of its decks see its name.
+        users += _sharers(instance)
+        users += Deck.shared_with.through.objects.filter(deck__topic=instance).values_list('user_id', flat=True)
+    caching.bump_users(users)
+
+
+@receiver(pre_delete, sender=Topic)
+def topic_deleted_uncache(sender, instance, **kwargs):
+    # The decks are cascaded and report their sharers through deck_deleted_uncache.
+    caching.bump_users([instance.user_id, *_sharers(instance)])
+
+
+@receiver(post_save, sender=Deck)
+def deck_saved_uncache(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        caching.bump_users([instance.topic.user_id])
+    else:
+        caching.bump_users(_sharers(instance))
+
+
+@receiver(pre_delete, sender=Deck)
+def deck_deleted_uncache(sender, instance, **kwargs):
+    owner = Topic.objects.filter(pk=instance.topic_id).values_list('user_id', flat=True).first()
+    caching.bump_users([owner, *_sharers(instance)])
+
+
+@receiver(m2m_changed, sender=Deck.shared_with.through)
+@receiver(m2m_changed, sender=Topic.shared_with.through)
+def shares_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        caching.bump_users([instance.pk] if reverse else _sharers(instance))
+    elif action in ('post_add', 'post_remove'):
+        # Reverse changes come from the user's side, e.g. user.shared_decks.remove(deck).
+        caching.bump_users([instance.pk] if reverse else pk_set)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, using=DEFAULT_DB_ALIAS, update_fields=None, **kwargs):
+    # The default database holds the users; the other shards hold copies (see flashcards.sharding).
+    if raw or using != DEFAULT_DB_ALIAS or not sharding.enabled():
+        return
+    if update_fields and set(update_fields) <= {'last_login', 'password'}:
+        return
+    if created:
+        UserShard.objects.create(user=instance, shard=sharding.hashed_shard(instance.pk))
+    sharding.mirror_users([instance])
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, using=DEFAULT_DB_ALIAS, **kwargs):
+    # Deleting the copies cascades to the user's data on the other shards.
+    if using != DEFAULT_DB_ALIAS or not sharding.enabled():
+        return
+    for name in sharding.aliases()[1:]:
+        with sharding.using_shard(name):
+            User.objects.using(name).filter(pk=instance.pk).delete()
@@ -0,0 +1,219 @@
+"""
+Precomputed dashboard statistics.
+
+`UserStats` holds per-user topic/deck/card counts and `DeckStats` per-deck card
+and due counts. Counts are adjusted incrementally by the receivers in
+`flashcards.signals`; code paths that bypass model signals (bulk_create, raw
+deletes) send `cards_changed` instead, which recomputes the affected decks.
+Due counts depend on the clock, so each DeckStats row records how long its
+due_count stays exact and is recomputed lazily once that moment has passed.
+Linked decks (see flashcards.linked) are counted from their source deck's
+cards and the owner's CardProgress.
+"""
+from collections import defaultdict
+
+from django.db.models import Count, F, FilteredRelation, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Card, Deck, DeckStats, Topic, UserStats
+
+
+def _card_aggregates(deck_ids, now):
+    rows = (
+        Card.objects.filter(deck_id__in=deck_ids)
+        .values('deck_id')
+        .annotate(
+            card_count=Count('id'),
+            due_count=Count('id', filter=Q(next_review_date__lte=now)),
+            due_valid_until=Min('next_review_date', filter=Q(next_review_date__gt=now)),
+        )
+    )
+    return {row['deck_id']: row for row in rows}
+
+
+def _linked_aggregates(links, now):
+    """Like _card_aggregates for linked decks; `links` holds (deck id, source deck id, owner id)."""
+    by_owner = defaultdict(list)
+    for deck_id, source_id, owner_id in links:
+        by_owner[owner_id].append((deck_id, source_id))
+    aggregates = {}
+    for owner_id, decks in by_owner.items():
+        rows = (
+            Card.objects.filter(deck_id__in={source_id for _, source_id in decks})
+            .alias(user_progress=FilteredRelation('progress', condition=Q(progress__user_id=owner_id)))
+            .values('deck_id')
+            .annotate(
+                card_count=Count('id'),
+                # Cards the owner has never reviewed are due.
+                due_count=Count('id', filter=Q(user_progress__id__isnull=True) | Q(user_progress__next_review_date__lte=now)),
+                due_valid_until=Min('user_progress__next_review_date', filter=Q(user_progress__next_review_date__gt=now)),
+            )
+        )
+        by_source = {row['deck_id']: row for row in rows}
+        for deck_id, source_id in decks:
+            if source_id in by_source:
+                aggregates[deck_id] = by_source[source_id]
+    return aggregates
+
+
+def _deck_aggregates(decks, now):
+    """Card aggregates for (deck id, source deck id, owner id) triples, linked or not."""
+    decks = list(decks)
+    aggregates = _card_aggregates([deck_id for deck_id, source_id, _ in decks if source_id is None], now)
+    links = [deck for deck in decks if deck[1] is not None]
+    if links:
+        aggregates.update(_linked_aggregates(links, now))
+    return aggregates
+
+
+def refresh_deck_stats(deck_ids, now=None, user_id=None, source_deck_ids=None):
+    """
+    Recomputes (or creates) the DeckStats rows of the given decks. Pass
+    `user_id` when all decks are known to belong to that user, and
+    `source_deck_ids` ({deck id: source deck id or None}) when already known.
+    """
+    now = now or timezone.now()
+    deck_ids = list(deck_ids)
+    if not deck_ids:
+        return []
+    decks = Deck.objects.filter(pk__in=deck_ids)
+    if user_id is None:
+        decks = list(decks.values_list('pk', 'source_deck_id', 'topic__user_id'))
+    else:
+        if source_deck_ids is None:
+            source_deck_ids = dict(decks.values_list('pk', 'source_deck_id'))
+        decks = [(deck_id, source_deck_ids[deck_id], user_id) for deck_id in deck_ids if deck_id in source_deck_ids]
+    aggregates = _deck_aggregates(decks, now)
+    empty = {'card_count': 0, 'due_count': 0, 'due_valid_until': None}
+    stats = []
+    for deck_id, _, owner_id in decks:
+        row = aggregates.get(deck_id, empty)
+        stats.append(DeckStats(
+            deck_id=deck_id,
+            user_id=owner_id,
+            card_count=row['card_count'],
+            due_count=row['due_count'],
+            due_valid_until=row['due_valid_until'],
+        ))
+    DeckStats.objects.bulk_create(
+        stats,
+        update_conflicts=True,
+        unique_fields=['deck'],
+        update_fields=['user', 'card_count', 'due_count', 'due_valid_until'],
+    )
+    return stats
+
+
+def refresh_user_card_counts(user_ids):
+    """Re-derives UserStats.card_count from the users' DeckStats rows."""
+    deck_totals = (
+        DeckStats.objects.filter(user=OuterRef('pk'))
+        .values('user')
+        .annotate(total=Sum('card_count'))
+        .values('total')
+    )
+    UserStats.objects.filter(pk__in=user_ids).update(card_count=Coalesce(Subquery(deck_totals), 0))
+
+
+def refresh_user_deck_counts(user_ids):
+    """Re-derives UserStats.deck_count, for decks created without model signals."""
+    deck_totals = (
+        Deck.objects.filter(topic__user=OuterRef('pk'))
+        .values('topic__user')
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    UserStats.objects.filter(pk__in=user_ids).update(deck_count=Coalesce(Subquery(deck_totals), 0))
+
+
+def mark_due_counts_stale(deck_ids):
+    """Called after reviews change next_review_date; the next read recomputes."""
+    DeckStats.objects.filter(deck_id__in=deck_ids).update(
+        due_valid_until=timezone.now(), schedule_version=F('schedule_version') + 1
+    )
+
+
+def rebuild_user_stats(user_id):
+    deck_ids = list(Deck.objects.filter(topic__user_id=user_id).values_list('pk', flat=True))
+    deck_stats = refresh_deck_stats(deck_ids, user_id=user_id)
+    user_stats, _ = UserStats.objects.update_or_create(
+        user_id=user_id,
+        defaults={
+            'topic_count': Topic.objects.filter(user_id=user_id).count(),
+            'deck_count': len(deck_ids),
+            'card_count': sum(stats.card_count for stats in deck_stats),
+        },
+    )
+    return user_stats
+
+
+def get_user_stats(user):
+    try:
+        return UserStats.objects.get(pk=user.pk)
+    except UserStats.DoesNotExist:
+        # First visit since the snapshot was introduced (or after a rebuild).
+        return rebuild_user_stats(user.pk)
+
+
+def decks_due_for_review(user, limit=5):
+    """Returns the user's decks with the most due cards, each with `due_cards_count` set."""
+    now = timezone.now()
+    stale = dict(
+        DeckStats.objects.filter(user=user, due_valid_until__lte=now).values_list('deck_id', 'deck__source_deck_id')
+    )
+    if stale:
+        refresh_deck_stats(stale, now, user_id=user.pk, source_deck_ids=stale)
+    deck_stats = (
+        DeckStats.objects.filter(user=user, due_count__gt=0)
+        .select_related('deck__topic')
+        .order_by('-due_count')[:limit]
+    )
+    decks = []
+    for stats in deck_stats:
+        stats.deck.due_cards_count = stats.due_count
+        decks.append(stats.deck)
+    return decks
+
+
+def find_drift(user_id):
+    """
+    Compares the snapshot of one user with the live tables. Returns a list of
+    human-readable differences (empty when the snapshot is accurate).
+    """
+    problems = []
+    now = timezone.now()
+    decks = [
+        (deck_id, source_id, user_id)
+        for deck_id, source_id in Deck.objects.filter(topic__user_id=user_id).values_list('pk', 'source_deck_id')
+    ]
+    deck_ids = [deck_id for deck_id, _, _ in decks]
+    aggregates = _deck_aggregates(decks, now)
+    expected = {
+        'topic_count': Topic.objects.filter(user_id=user_id).count(),
+        'deck_count': len(deck_ids),
+        'card_count': sum(row['card_count'] for row in aggregates.values()),
+    }
+    user_stats = UserStats.objects.filter(pk=user_id).first()
+    if user_stats is None:
+        return ['missing UserStats row']
+    for field, value in expected.items():
+        if getattr(user_stats, field) != value:
+            problems.append(f"{field}: snapshot {getattr(user_stats, field)}, actual {value}")
+
+    snapshot = DeckStats.objects.filter(user_id=user_id).in_bulk()
+    for deck_id in deck_ids:
+        row = aggregates.get(deck_id, {'card_count': 0, 'due_count': 0})
+        stats = snapshot.pop(deck_id, None)
+        if stats is None:
+            problems.append(f"deck {deck_id}: missing DeckStats row")
+            continue
+        if stats.card_count != row['card_count']:
+            problems.append(f"deck {deck_id}: card_count snapshot {stats.card_count}, actual {row['card_count']}")
+        # A stale due count is expected; it is only wrong if it claims to be current.
+        due_is_current = stats.due_valid_until is None or stats.due_valid_until > now
+        if due_is_current and stats.due_count != row['due_count']:
+            problems.append(f"deck {deck_id}: due_count snapshot {stats.due_count}, actual {row['due_count']}")
+    for deck_id in snapshot:
+        problems.append(f"deck {deck_id}: DeckStats row for a deck the user does not own")
+    return problems
@@ -0,0 +1,113 @@
+"""
+Delta sync for learning clients that keep a deck offline.
+
+A client sends back the token of its last sync and receives only what
+changed since: the cards created or edited (with the learner's due time)
+and the ids of deleted cards. Changes are read from CardChange, which
+database triggers keep with one entry per card, so a sync is a range scan
+over the deck's (deck_id, id) index whose cost follows the number of
+changes, not the size of the deck. A token is "<content deck>.<last change
+id>.<issued at>"; a client starts over with a full sync (`reset`) when it
+has no token, when the deck's cards moved (a linked deck was materialized)
+or when the token is older than the tombstones are kept.
+
+Only card content is logged: reviews rewrite the schedule of every card
+they touch, and logging them would add a log write to each. A client gets
+the new schedules of the cards it reviewed back from the sync that
+applied the reviews (`reviewed`); its other devices see them on their next
+full sync.
+
+The change log is maintained on SQLite only. Elsewhere every sync is a
+full one, paged by card id.
+"""
+import time
+
+from django.conf import settings
+from django.db import connections, router
+
+from . import linked
+from .models import CardChange
+
+PAGE_SIZE = 500
+
+
+def is_available(connection=None):
+    return (connection or connections[router.db_for_read(CardChange)]).vendor == 'sqlite'
+
+
+def make_token(content_deck_id, change_id):
+    return f"{content_deck_id}.{change_id}.{int(time.time())}"
+
+
+def parse_token(token):
+    """Returns (content deck id, change id, issued at) or None for a missing or malformed token."""
+    try:
+        content_deck_id, change_id, issued_at = (int(part) for part in token.split('.'))
+    except (AttributeError, ValueError):
+        return None
+    return content_deck_id, change_id, issued_at
+
+
+def _token_is_current(parsed, content_deck_id):
+    if parsed is None or parsed[0] != content_deck_id or parsed[1] <= 0:
+        return False
+    # Tombstones of older changes may already be pruned.
+    return parsed[2] > time.time() - settings.SYNC_TOMBSTONE_DAYS * 86400
+
+
+def changes(deck, token=None, user_id=None, reviewed=(), limit=PAGE_SIZE):
+    """
+    The changes to `deck` since `token`, at most `limit` of them, plus the
+    cards in `reviewed`, with the schedule of the learner `user_id` (by
+    default the deck's owner). Returns a
+    dict with the new `token`, `reset` (drop everything held for the deck
+    first), the changed `cards` (id, front, back, due_at), the `deleted` card
+    ids and `has_more` (sync again with the new token for the rest).
+    """
+    content_deck_id = linked.content_deck_id(deck)
+    user_id = deck.topic.user_id if user_id is None else user_id
+    parsed = parse_token(token)
+    reset = not _token_is_current(parsed, content_deck_id)
+    since = 0 if reset else parsed[1]
+
+    if is_available():
+        entries = CardChange.objects.filter(deck_id=content_deck_id, id__gt=since)
+        if reset:
+            entries = entries.filter(deleted=False)
+        rows = list(entries.order_by('id').values_list('id', 'card_id', 'deleted')[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        deleted = sorted({card_id for _, card_id, is_deleted in rows if is_deleted})
+        changed = {card_id for _, card_id, is_deleted in rows if not is_deleted}
+        last_id = rows[-1][0] if rows else since
+    else:
+        # Without a change log the token only pages through a full sync.
+        card_ids = list(
+            linked.deck_cards(deck, user_id).filter(pk__gt=since).order_by('pk').values_list('pk', flat=True)[:limit + 1]
+        )
+        has_more = len(card_ids) > limit
+        deleted = []
+        changed = set(card_ids[:limit])
+        last_id = card_ids[limit - 1] if has_more else 0
+
+    changed.update(set(reviewed) - set(deleted))
+    cards = []
+    if changed:
+        cards = list(linked.deck_cards(deck, user_id).filter(pk__in=changed).order_by('pk').values('id', 'front', 'back', 'due_at'))
+    return {
+        'token': make_token(content_deck_id, last_id),
+        'reset': reset,
+        'cards': cards,
+        'deleted': deleted,
+        'has_more': has_more,
+    }
+
+
+def prune_tombstones(before, batch_size=10000):
+    """Deletes tombstones recorded before `before` in batches; returns the number deleted."""
+    deleted = 0
+    while True:
+        ids = list(CardChange.objects.filter(deleted=True, changed_at__lt=before).values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += CardChange.objects.filter(pk__in=ids).delete()[0]
@@ -0,0 +1,38 @@
+from django import template
+
+from flashcards import caching
+
+register = template.Library()
+
+
+class CachedFragmentNode(template.Node):
+    def __init__(self, nodelist, name, user, parts):
+        self.nodelist = nodelist
+        self.name = name
+        self.user = user
+        self.parts = parts
+
+    def render(self, context):
+        parts = [part.resolve(context) for part in self.parts]
+        return caching.fetch(
+            self.name.resolve(context), self.user.resolve(context).pk, parts,
+            lambda: self.nodelist.render(context),
+        )
+
+
+@register.tag
+def cachedfragment(parser, token):
+    """
+    Caches the rendered block per user (see flashcards.caching):
+
+        {% cachedfragment 'topic_decks' user topic.pk topic.revision %} ... {% endcachedfragment %}
+
+    Querysets used only inside the block are not evaluated on a hit.
+    """
+    bits = token.split_contents()
+    if len(bits) < 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a fragment name, a user and the values it varies on.")
+    nodelist = parser.parse(('endcachedfragment',))
+    parser.delete_first_token()
+    name, user, *parts = (parser.compile_filter(bit) for bit in bits[1:])
+    return CachedFragmentNode(nodelist, name, user, parts)
@@ -1,3 +1,1457 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import re
+import tempfile
+import time
+import unittest
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection, connections
+from django.http import HttpResponse
+from django.template import Context, Engine
+from django.contrib.sessions.models import Session
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import access, activity, bulk, caching, copying, exports, imports, jobs, linked, metrics, routers, scheduling, search, sharding, stats, sync, views
+from .middleware import NPlusOneError, NPlusOneMiddleware
+from .models import Card, DailyActivity, Deck, DeckStats, Job, ReviewEvent, Topic, UserShard, UserStats
+from .signals import cards_changed
+
+# Test cases touching users' data use every shard (the default database alone
+# unless DB_SHARDS is set); not '__all__', which would include the replica.
+SHARD_DATABASES = set(sharding.aliases())
+
+
+def home_shard_of(user):
+    """
+    Selects the user's home shard, where requests read the user's own pages.
+    Fixtures created outside a request otherwise go to the default database.
+    """
+    return sharding.using_shard(sharding.home_shard(user.pk))
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN output is SQLite-specific")
+class QueryPlanTests(TestCase):
+    """
+    Runs the hot views against a seeded dataset and fails if SQLite plans a
+    full scan of a growing table for any of their queries. A missing or
+    unusable index shows up here instead of in production.
+    """
+
+    databases = SHARD_DATABASES
+
+    # Tables whose size grows with users or content; scanning them is a regression.
+    LARGE_TABLES = {
+        'flashcards_topic', 'flashcards_deck', 'flashcards_card', 'flashcards_cardprogress',
+        'flashcards_deckstats', 'flashcards_reviewevent', 'flashcards_dailyactivity',
+        'flashcards_deck_shared_with', 'flashcards_topic_shared_with', 'flashcards_job', 'auth_user',
+        'flashcards_cardchange',
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner', email='learner@example.com', password='password')
+        cls.others = [User.objects.create_user(f'user{i}', email=f'user{i}@example.com') for i in range(5)]
+        for owner in [cls.user, *cls.others]:
+            for t in range(4):
+                topic = Topic.objects.create(name=f"Topic {t}", user=owner)
+                for d in range(4):
+                    deck = Deck.objects.create(name=f"Deck {d}", topic=topic)
+                    bulk.insert_cards((deck.pk, f"front {i}", f"back {i}") for i in range(50))
+            stats.rebuild_user_stats(owner.pk)
+        cls.topic = Topic.objects.filter(user=cls.user).first()
+        cls.deck = cls.topic.decks.first()
+        cls.card = cls.deck.cards.first()
+        shared_topic = Topic.objects.filter(user=cls.others[0]).first()
+        shared_topic.shared_with.add(cls.user)
+        shared_topic.decks.first().shared_with.add(cls.user)
+        cls.linked_deck = Deck.objects.create(name="Linked", topic=cls.topic, source_deck=shared_topic.decks.last())
+        stats.rebuild_user_stats(cls.user.pk)
+
+    def setUp(self):
+        self.client.login(username='learner', password='password')
+
+    def _full_scans(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = [row[-1] for row in cursor.fetchall()]
+        # Subqueries refer to their tables by alias: "flashcards_card" U0.
+        aliases = {alias: table for table, alias in re.findall(r'"(\w+)" (?:AS )?"?(U\d+)\b', sql)}
+        scans = []
+        for step in plan:
+            match = re.match(r'SCAN (\w+)', step)
+            if match and aliases.get(match.group(1), match.group(1)) in self.LARGE_TABLES:
+                scans.append(step)
+        return scans
+
+    def assertNoFullScans(self, method, url, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, **kwargs)
+            if hasattr(response, 'streaming_content'):
+                b''.join(response.streaming_content)
+        self.assertLess(response.status_code, 400, url)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            with self.subTest(url=url, sql=sql):
+                self.assertEqual(self._full_scans(sql), [], sql)
+
+    def test_detects_full_scans(self):
+        self.assertEqual(self._full_scans("SELECT * FROM flashcards_card WHERE front = 'x'"), ['SCAN flashcards_card'])
+        self.assertTrue(self._full_scans('SELECT * FROM "flashcards_card" U0 WHERE U0."back" = \'x\''))
+
+    def test_dashboard(self):
+        self.assertNoFullScans('get', reverse('dashboard'))
+        self.assertNoFullScans('get', reverse('dashboard') + '?progress=365')
+
+    def test_topic_pages(self):
+        self.assertNoFullScans('get', reverse('topic-list'))
+        self.assertNoFullScans('get', reverse('topic-detail', args=[self.topic.pk]))
+
+    def test_deck_detail(self):
+        self.assertNoFullScans('get', reverse('deck-detail', args=[self.topic.pk, self.deck.pk]))
+        self.assertNoFullScans('get', reverse('deck-detail', args=[self.topic.pk, self.linked_deck.pk]))
+
+    def test_shared_lists(self):
+        self.assertNoFullScans('get', reverse('shared-with-me'))
+        self.assertNoFullScans('get', reverse('shared-topic-list'))
+
+    def test_learning(self):
+        for deck in (self.deck, self.linked_deck):
+            url = reverse('get-deck-for-learning', args=[self.topic.pk, deck.pk])
+            self.assertNoFullScans('get', url)
+            self.assertNoFullScans('get', url + '?mode=all&after=1')
+            self.assertNoFullScans('get', url + '?after=2000-01-01T00:00:00%2B00:00_1')
+            self.assertNoFullScans('get', url + '?format=ndjson')
+
+    def test_track_learning_events(self):
+        linked_card = Card.objects.filter(deck_id=self.linked_deck.source_deck_id).first()
+        now = int(time.time() * 1000)
+        events = [
+            {'card': self.card.pk, 'correct': True, 'ts': now},
+            {'card': linked_card.pk, 'correct': False, 'ts': now},
+        ]
+        self.assertNoFullScans(
+            'post', reverse('track-learning-batch'),
+            data=json.dumps({'events': events}), content_type='application/json',
+        )
+
+    def test_search(self):
+        self.assertNoFullScans('get', reverse('card-search') + '?q=front+1')
+
+    def test_sync(self):
+        for deck in (self.deck, self.linked_deck):
+            url = reverse('sync-deck-for-learning', args=[self.topic.pk, deck.pk])
+            token = self.client.get(url).json()['token']
+            self.assertNoFullScans('get', url, data={'token': token})
+            events = [{'card': self.card.pk, 'correct': True, 'ts': int(time.time() * 1000)}]
+            self.assertNoFullScans(
+                'post', url, data=json.dumps({'token': token, 'events': events}), content_type='application/json',
+            )
+
+    def test_exports(self):
+        self.assertNoFullScans('get', reverse('export-topic', args=[self.topic.pk]))
+        self.assertNoFullScans('get', reverse('export-deck', args=[self.topic.pk, self.deck.pk]))
+
+
+@override_settings(NPLUSONE_DETECTION='raise', NPLUSONE_THRESHOLD=3, FRAGMENT_CACHE_TIMEOUT=0)
+class QueryCountTests(TestCase):
+    """
+    List pages must run the same number of queries however many rows they
+    show. The N+1 detector runs in 'raise' mode, so a template walking a
+    relation per row fails the request as well. The fragment cache is off,
+    so every request renders the lists.
+    """
+
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner', password='password')
+        cls.owner = User.objects.create_user('owner')
+        cls.rows = 0
+
+    def setUp(self):
+        self.client.login(username='learner', password='password')
+
+    def add_rows(self, count):
+        """Adds `count` topics with decks and cards for the user, and `count` shared topics and decks."""
+        for _ in range(count):
+            self.rows += 1
+            topic = Topic.objects.create(name=f"Topic {self.rows}", user=self.user)
+            for d in range(2):
+                deck = Deck.objects.create(name=f"Deck {d}", topic=topic)
+                bulk.insert_cards((deck.pk, f"front {i}", f"back {i}") for i in range(3))
+            shared_topic = Topic.objects.create(name=f"Shared {self.rows}", user=self.owner)
+            shared_topic.shared_with.add(self.user)
+            Deck.objects.create(name="Shared deck", topic=shared_topic).shared_with.add(self.user)
+        stats.rebuild_user_stats(self.user.pk)
+        return topic
+
+    def count_queries(self, url):
+        self.client.get(url)  # first visits may refresh stale stats
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url_for):
+        topic = self.add_rows(2)
+        few = self.count_queries(url_for(topic))
+        topic = self.add_rows(6)
+        self.assertEqual(self.count_queries(url_for(topic)), few)
+
+    def test_detector_reports_template_line(self):
+        topics = [Topic.objects.create(name=f"Topic {i}", user=self.user) for i in range(3)]
+        for topic in topics:
+            Deck.objects.create(name="Deck", topic=topic)
+        template = Engine(debug=True).from_string("{% for topic in topics %}\n{{ topic.decks.count }}{% endfor %}")
+        middleware = NPlusOneMiddleware(lambda request: HttpResponse(template.render(Context({'topics': topics}))))
+        with self.assertRaisesRegex(NPlusOneError, r'3 x SELECT COUNT\(\*\).*\n    template: .*:2'):
+            middleware(RequestFactory().get('/'))
+
+    def test_dashboard(self):
+        self.assertConstantQueries(lambda topic: reverse('dashboard'))
+
+    def test_topic_list(self):
+        self.assertConstantQueries(lambda topic: reverse('topic-list'))
+
+    def test_topic_detail(self):
+        def url_for(topic):
+            for d in range(self.rows):
+                deck = Deck.objects.create(name=f"Extra {self.rows} {d}", topic=topic)
+                bulk.insert_cards((deck.pk, "front", "back") for _ in range(2))
+            return reverse('topic-detail', args=[topic.pk])
+        self.assertConstantQueries(url_for)
+
+    def test_shared_lists(self):
+        self.assertConstantQueries(lambda topic: reverse('shared-with-me'))
+        self.assertConstantQueries(lambda topic: reverse('shared-topic-list'))
+
+
+class AccessTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner')
+        cls.user = User.objects.create_user('learner', password='password')
+        cls.topic = Topic.objects.create(name="Topic", user=cls.owner)
+        cls.deck = Deck.objects.create(name="Deck", topic=cls.topic)
+        cls.card = Card.objects.create(deck=cls.deck, front="front", back="back")
+        User.objects.bulk_create([User(username=f"recipient{i}") for i in range(200)])
+        cls.deck.shared_with.add(*User.objects.filter(username__startswith='recipient'))
+
+    def role(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return access.deck_role(request, self.deck.pk)
+
+    def test_roles(self):
+        self.assertEqual(self.role(self.owner), access.OWNER)
+        self.assertIsNone(self.role(self.user))
+        self.topic.shared_with.add(self.user)
+        self.assertEqual(self.role(self.user), access.SHARED_TOPIC)
+        self.deck.shared_with.add(self.user)
+        self.assertEqual(self.role(self.user), access.SHARED_DECK)
+        self.deck.shared_with.remove(self.user)
+        self.topic.shared_with.remove(self.user)
+        Deck.objects.create(name="Linked", topic=Topic.objects.create(name="Mine", user=self.user), source_deck=self.deck)
+        self.assertEqual(self.role(self.user), access.LINKED)
+
+    def test_one_query_per_request(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(1):
+            access.deck_role(request, self.deck.pk)
+            access.deck_role(request, self.deck.pk)
+
+    def test_learning_views_deny_strangers(self):
+        self.client.login(username='learner', password='password')
+        self.assertEqual(self.client.get(reverse('learn-cards', args=[self.topic.pk, self.deck.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('get-deck-for-learning', args=[self.topic.pk, self.deck.pk])).status_code, 403)
+        events = [{'card': self.card.pk, 'correct': True, 'ts': int(time.time() * 1000)}]
+        response = self.client.post(reverse('track-learning-batch'), json.dumps({'events': events}), content_type='application/json')
+        self.assertEqual(response.json()['ignored'], 1)
+        self.assertEqual(self.client.post(reverse('track-learning', args=[self.card.pk])).status_code, 410)
+
+    def test_accepting_requires_a_share(self):
+        self.client.login(username='learner', password='password')
+        own_topic = Topic.objects.create(name="Mine", user=self.user)
+        for background_jobs in (False, True):
+            with self.settings(BACKGROUND_JOBS=background_jobs):
+                url = reverse('accept-shared-deck', args=[self.deck.pk])
+                self.assertEqual(self.client.get(url).status_code, 404)
+                self.assertEqual(self.client.post(url, {'topic': own_topic.pk}).status_code, 404)
+                self.assertEqual(self.client.post(reverse('accept-shared-topic', args=[self.topic.pk])).status_code, 404)
+        self.assertFalse(Job.objects.exists())
+        # A job queued while the deck was shared checks the share again when it runs.
+        job = jobs.enqueue(self.user, 'accept_deck', deck=self.deck.pk, topic=own_topic.pk)
+        with self.assertLogs('flashcards.jobs', 'ERROR'):
+            jobs.run(jobs.claim('worker'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 1))
+        self.assertFalse(own_topic.decks.exists())
+
+
+class DeckPagingTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner', password='password')
+        with home_shard_of(cls.user):
+            cls.topic = Topic.objects.create(name="Topic", user=cls.user)
+            cls.deck = Deck.objects.create(name="Deck", topic=cls.topic)
+            bulk.insert_cards((cls.deck.pk, f"front {i}", f"back {i}") for i in range(60))
+            cls.card_ids = list(cls.deck.cards.order_by('pk').values_list('pk', flat=True))
+
+    def setUp(self):
+        self.client.login(username='learner', password='password')
+        self.url = reverse('deck-cards', args=[self.topic.pk, self.deck.pk])
+
+    def walk(self, **params):
+        """Follows the cursor to the end; returns the pages' card ids."""
+        pages, cursor = [], None
+        while True:
+            response = self.client.get(self.url, {**params, **({'after': cursor} if cursor else {})})
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            pages.append([card['id'] for card in data['cards']])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return pages
+            self.assertEqual(cursor, pages[-1][-1])
+
+    def test_cursor_walks_the_deck_once(self):
+        pages = self.walk(page_size=25)
+        self.assertEqual([len(page) for page in pages], [25, 25, 10])
+        self.assertEqual(sum(pages, []), self.card_ids)
+        # A last page that is exactly full has no next cursor either.
+        self.assertEqual([len(page) for page in self.walk(page_size=200)], [60])
+        with home_shard_of(self.user):
+            Card.objects.filter(pk__in=self.card_ids[50:]).delete()
+        self.assertEqual([len(page) for page in self.walk(page_size=25)], [25, 25])
+
+    def test_detail_page_starts_the_walk(self):
+        response = self.client.get(reverse('deck-detail', args=[self.topic.pk, self.deck.pk]), {'page_size': 25})
+        self.assertEqual([card.pk for card in response.context['cards']], self.card_ids[:25])
+        self.assertEqual(response.context['next_cursor'], self.card_ids[24])
+        response = self.client.get(self.url, {'after': self.card_ids[54], 'page_size': 25, 'format': 'html'})
+        self.assertEqual(response.content.decode().count('list-group-item'), 5)
+        self.assertEqual(response['X-Next-Cursor'], '')
+
+    def test_invalid_cursor_and_page_sizes(self):
+        self.assertEqual(self.client.get(self.url, {'after': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'after': '1.5'}).status_code, 400)
+        # Sizes other than the offered ones fall back to the default.
+        for page_size in ('7', '0', '-25', '100000', 'many'):
+            cards = self.client.get(self.url, {'page_size': page_size}).json()['cards']
+            self.assertEqual(len(cards), views.DECK_PAGE_SIZE, page_size)
+
+
+@override_settings(BACKGROUND_JOBS=False)
+class ConditionalGetTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner', password='password')
+        cls.topic = Topic.objects.create(name="Topic", user=cls.user)
+        cls.deck = Deck.objects.create(name="Deck", topic=cls.topic)
+        cls.card = Card.objects.create(deck=cls.deck, front="front", back="back")
+
+    def setUp(self):
+        self.client.login(username='learner', password='password')
+
+    def etag(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertFalse([query for query in queries if 'FROM "flashcards_card"' in query['sql']])
+        return response['ETag']
+
+    def test_content_changes_invalidate(self):
+        urls = [
+            reverse('get-deck-for-learning', args=[self.topic.pk, self.deck.pk]) + '?mode=all',
+            reverse('export-deck', args=[self.topic.pk, self.deck.pk]),
+            reverse('export-topic', args=[self.topic.pk]),
+        ]
+        before = [self.etag(url) for url in urls]
+        self.card.front = "changed"
+        self.card.save()
+        after = [self.etag(url) for url in urls]
+        self.assertTrue(all(old != new for old, new in zip(before, after)))
+
+    def test_reviews_invalidate_due_cards_only(self):
+        due_url = reverse('get-deck-for-learning', args=[self.topic.pk, self.deck.pk])
+        all_url = due_url + '?mode=all'
+        due, everything = self.etag(due_url), self.etag(all_url)
+        events = [{'card': self.card.pk, 'correct': True, 'ts': int(time.time() * 1000)}]
+        self.client.post(reverse('track-learning-batch'), data=json.dumps({'events': events}), content_type='application/json')
+        self.assertNotEqual(self.etag(due_url), due)
+        self.assertEqual(self.etag(all_url), everything)
+
+    def test_linked_learners_get_their_own_due_cards(self):
+        due_url = reverse('get-deck-for-learning', args=[self.topic.pk, self.deck.pk])
+        owner_etag = self.etag(due_url)
+        learner = User.objects.create_user('linked')
+        Deck.objects.create(name="Linked", topic=Topic.objects.create(name="Mine", user=learner), source_deck=self.deck)
+        self.client.force_login(learner)
+        events = [{'card': self.card.pk, 'correct': True, 'ts': int(time.time() * 1000)}]
+        self.client.post(reverse('track-learning-batch'), data=json.dumps({'events': events}), content_type='application/json')
+        # The owner's stats do not follow the learner's reviews.
+        response = self.client.get(due_url, HTTP_IF_NONE_MATCH=owner_etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['cards'], [])
+
+
+class LearningPageTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner')
+        now = timezone.now()
+        with home_shard_of(cls.user):
+            cls.topic = Topic.objects.create(name="Topic", user=cls.user)
+            cls.deck = Deck.objects.create(name="Deck", topic=cls.topic)
+            bulk.insert_cards((cls.deck.pk, f"front {i}", f"back {i}") for i in range(7))
+            ids = list(cls.deck.cards.order_by('pk').values_list('pk', flat=True))
+            # Two groups due at the same instant, the later-created one due first, and one card not due yet.
+            Card.objects.filter(pk__in=ids[:3]).update(next_review_date=now - timedelta(hours=1))
+            Card.objects.filter(pk__in=ids[3:6]).update(next_review_date=now - timedelta(days=1))
+            Card.objects.filter(pk=ids[6]).update(next_review_date=now + timedelta(days=1))
+        cls.card_ids = ids
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.url = reverse('get-deck-for-learning', args=[self.topic.pk, self.deck.pk])
+
+    def walk(self, **params):
+        pages, cursor = [], None
+        while True:
+            data = self.client.get(self.url, {**params, **({'after': cursor} if cursor else {})}).json()
+            pages.append([card['id'] for card in data['cards']])
+            cursor = data['next_cursor']
+            if cursor is None:
+                return pages
+
+    def test_due_cursor_breaks_ties_by_id(self):
+        pages = self.walk(limit=2)
+        self.assertEqual(pages, [self.card_ids[3:5], [self.card_ids[5], self.card_ids[0]], self.card_ids[1:3]])
+        # A page ending inside a group of equal due times neither skips nor repeats the rest of the group.
+        self.assertEqual(self.walk(limit=1), [[card_id] for card_id in self.card_ids[3:6] + self.card_ids[:3]])
+
+    def test_all_mode_walks_by_id(self):
+        self.assertEqual(sum(self.walk(mode='all', limit=3), []), self.card_ids)
+
+    def test_invalid_cursors(self):
+        for mode, cursor in [
+            ('due', 'x'), ('due', '12'), ('due', 'not-a-date_12'), ('due', f'{timezone.now().isoformat()}_x'),
+            ('all', 'x'), ('all', '1.5'),
+        ]:
+            response = self.client.get(self.url, {'mode': mode, 'after': cursor})
+            self.assertEqual(response.status_code, 400, cursor)
+            self.assertEqual(response.json()['message'], 'Invalid cursor')
+
+    def test_limit_is_clamped(self):
+        def page_size(limit):
+            return len(self.client.get(self.url, {'mode': 'all', 'limit': limit}).json()['cards'])
+
+        self.assertEqual(page_size(0), 1)
+        self.assertEqual(page_size(-5), 1)
+        self.assertEqual(page_size(5), 5)
+        with mock.patch.object(views, 'LEARNING_PAGE_SIZE', 4):
+            self.assertEqual(page_size('many'), 4)
+            self.assertEqual(page_size(''), 4)
+        with mock.patch.object(views, 'MAX_LEARNING_PAGE_SIZE', 3):
+            self.assertEqual(page_size(1000), 3)
+            data = self.client.get(self.url, {'mode': 'all', 'limit': 1000}).json()
+            self.assertEqual(data['next_cursor'], str(self.card_ids[2]))
+
+
+class AsyncLearningTests(TestCase):
+    """The learning endpoints as served under ASGI, through the async middleware path."""
+
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner')
+        cls.topic = Topic.objects.create(name="Topic", user=cls.user)
+        cls.deck = Deck.objects.create(name="Deck", topic=cls.topic)
+        bulk.insert_cards((cls.deck.pk, f"front {i}", f"back {i}") for i in range(3))
+
+    @override_settings(METRICS_ENABLED=True, NPLUSONE_DETECTION='raise')
+    async def test_learning_flow(self):
+        await self.async_client.aforce_login(self.user)
+        url = reverse('get-deck-for-learning', args=[self.topic.pk, self.deck.pk])
+        cards = (await self.async_client.get(url)).json()['cards']
+        self.assertEqual(len(cards), 3)
+        response = await self.async_client.get(url, {'format': 'ndjson'})
+        self.assertEqual(len(b''.join([line async for line in response.streaming_content]).splitlines()), 3)
+
+        events = [{'card': cards[0]['id'], 'correct': True, 'ts': int(time.time() * 1000)}]
+        response = await self.async_client.post(
+            reverse('track-learning-batch'), json.dumps({'events': events}), content_type='application/json'
+        )
+        self.assertEqual(response.json()['applied'], 1)
+        # Queries run in the ORM's worker threads are still attributed to the view.
+        views, _, _ = metrics.collect()
+        self.assertGreater(views['get-deck-for-learning'][metrics.QUERIES], 0)
+        self.assertGreater(views['track-learning-batch'][metrics.QUERIES], 0)
+
+
+class MetricsTests(TestCase):
+    databases = SHARD_DATABASES
+
+    def test_render(self):
+        view = 'metrics-test "view"'
+        metrics.record(view, 0.02, 3, 0.004, 100, False)
+        metrics.record(view, 0.3, 1, 0.001, 50, True)
+        metrics.record_cache('metrics-test', 'hit')
+        metrics.record_cache('metrics-test', 'stale')
+        with self.settings(METRICS_DIR=''):
+            text = metrics.render()
+        lines = text.splitlines()
+        for line in lines:
+            self.assertRegex(line, r'^(# (HELP|TYPE) \w+ .+|\w+(\{.*\})? [0-9.e+-]+)$')
+        label = 'view="metrics-test \\"view\\""'
+        buckets = [line for line in lines if line.startswith(f'flashcards_request_duration_seconds_bucket{{{label},')]
+        self.assertEqual([line.rsplit(' ', 1)[1] for line in buckets], ['0', '0', '1', '1', '1', '1', '2', '2', '2', '2', '2', '2'])
+        self.assertTrue(buckets[-1].startswith(f'flashcards_request_duration_seconds_bucket{{{label},le="+Inf"}}'))
+        for expected in [
+            f'flashcards_request_duration_seconds_sum{{{label}}} 0.320000',
+            f'flashcards_request_duration_seconds_count{{{label}}} 2',
+            f'flashcards_db_queries_total{{{label}}} 4',
+            f'flashcards_db_duration_seconds_total{{{label}}} 0.005000',
+            f'flashcards_response_bytes_total{{{label}}} 150',
+            f'flashcards_request_errors_total{{{label}}} 1',
+            'flashcards_fragment_cache_reads_total{fragment="metrics-test",result="hit"} 1',
+            'flashcards_fragment_cache_reads_total{fragment="metrics-test",result="miss"} 0',
+            'flashcards_fragment_cache_reads_total{fragment="metrics-test",result="stale"} 1',
+        ]:
+            self.assertIn(expected, lines)
+        self.assertIn('# TYPE flashcards_request_duration_seconds histogram', lines)
+        self.assertTrue(text.endswith('\n'))
+
+    def test_access(self):
+        url = reverse('metrics')
+        with self.settings(METRICS_ENABLED=False):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        with self.settings(METRICS_ENABLED=True, METRICS_TOKEN=''):
+            self.assertEqual(self.client.get(url).status_code, 403)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer ').status_code, 403)
+            self.client.force_login(User.objects.create_user('learner'))
+            self.assertEqual(self.client.get(url).status_code, 403)
+            self.client.force_login(User.objects.create_user('admin', is_staff=True))
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+            self.client.logout()
+        with self.settings(METRICS_ENABLED=True, METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_processes_are_merged(self):
+        view = 'metrics-test-merge'
+        metrics.record(view, 0.02, 3, 0.004, 100, False)
+        metrics.record_cache('metrics-test-merge', 'miss')
+        directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        other = [2, 0.5, 7, 0.01, 300, 1] + [0] * (len(metrics.LATENCY_BUCKETS) + 1)
+        other[metrics.BUCKETS] = 2
+        (directory / 'other-worker.json').write_text(json.dumps({
+            'views': {view: other}, 'cache': {'metrics-test-merge': [1, 1, 0]}, 'max_rss_bytes': 1024,
+        }))
+        (directory / 'replaced.json').write_text('{"views": ')
+        with self.settings(METRICS_DIR=str(directory)):
+            views, rss, cache = metrics.collect()
+        self.assertEqual(views[view][metrics.COUNT], 3)
+        self.assertEqual(views[view][metrics.QUERIES], 10)
+        self.assertEqual(views[view][metrics.RESPONSE_BYTES], 400)
+        self.assertEqual(sum(views[view][metrics.BUCKETS:]), 3)
+        self.assertEqual(cache['metrics-test-merge'], [1, 2, 0])
+        # This process wrote its own file for the others to read.
+        self.assertEqual(rss['other-worker'], 1024)
+        self.assertEqual(set(rss), {'other-worker', metrics._process_id})
+
+
+class SchedulingTests(SimpleTestCase):
+    start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+
+    def reviews(self, *answers):
+        """Reviews a new card each time it becomes due; returns the card and the intervals given."""
+        card, intervals, now = Card(), [], self.start
+        for correct in answers:
+            scheduling.review(card, correct, now)
+            intervals.append(card.next_review_date - now)
+            now = card.next_review_date
+        return card, intervals
+
+    def test_correct_answers_grow_the_interval(self):
+        card, intervals = self.reviews(True, True, True, True)
+        self.assertEqual(intervals, [timedelta(days=1), timedelta(days=6), timedelta(days=15), timedelta(days=37.5)])
+        self.assertEqual((card.learning_level, card.learned_count, card.ease_factor), (4, 4, 2.5))
+
+    def test_lapse_relearns_soon_with_lower_ease(self):
+        card, intervals = self.reviews(True, True, False, True, True, True)
+        self.assertEqual(intervals[2], timedelta(minutes=10))
+        self.assertEqual(card.ease_factor, 2.3)
+        # Relearning starts over at one day, then six, then six times the new ease.
+        self.assertEqual(intervals[3:], [timedelta(days=1), timedelta(days=6), timedelta(days=6) * 2.3])
+
+    def test_ease_has_a_floor(self):
+        card, _ = self.reviews(*[False] * 10)
+        self.assertEqual(card.ease_factor, scheduling.MIN_EASE)
+        self.assertEqual(card.learning_level, 0)
+
+
+class ReviewTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner')
+        cls.viewer = User.objects.create_user('viewer')
+        cls.topic = Topic.objects.create(name="Topic", user=cls.owner)
+        cls.deck = Deck.objects.create(name="Deck", topic=cls.topic)
+        cls.card = Card.objects.create(deck=cls.deck, front="front", back="back")
+        cls.deck.shared_with.add(cls.viewer)
+
+    def post_events(self, user, events):
+        self.client.force_login(user)
+        response = self.client.post(reverse('track-learning-batch'), json.dumps({'events': events}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def review(self, user, correct=True):
+        return self.post_events(user, [{'card': self.card.pk, 'correct': correct, 'ts': int(time.time() * 1000)}])
+
+    def due_cards(self, user):
+        self.client.force_login(user)
+        return self.client.get(reverse('get-deck-for-learning', args=[self.topic.pk, self.deck.pk])).json()['cards']
+
+    def test_shared_deck_viewers_keep_their_own_progress(self):
+        self.assertEqual(self.review(self.viewer)['applied'], 1)
+        self.card.refresh_from_db()
+        self.assertEqual((self.card.learned_count, self.card.last_learned), (0, None))
+        progress = self.viewer.card_progress.get(card=self.card)
+        self.assertEqual(progress.learning_level, 1)
+        self.assertEqual(self.due_cards(self.viewer), [])
+        self.assertEqual(sync.changes(self.deck, user_id=self.viewer.pk)['cards'][0]['due_at'], progress.next_review_date)
+        self.assertEqual(len(self.due_cards(self.owner)), 1)
+
+        self.assertEqual(self.review(self.owner)['applied'], 1)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.learning_level, 1)
+        self.assertEqual(self.viewer.card_progress.get(card=self.card).learned_count, 1)
+
+    def test_events_apply_in_time_order_and_once(self):
+        ts = int(time.time() * 1000) - 60000
+        events = [
+            {'card': self.card.pk, 'correct': True, 'ts': ts + 2000},
+            {'card': self.card.pk, 'correct': False, 'ts': ts},
+        ]
+        self.assertEqual(self.post_events(self.owner, events)['applied'], 2)
+        self.card.refresh_from_db()
+        # The lapse came first, so the later correct answer decides the schedule.
+        self.assertEqual((self.card.learning_level, self.card.ease_factor), (1, 2.3))
+        self.assertEqual(self.card.last_learned.timestamp(), (ts + 2000) / 1000)
+        # A re-sent batch and an event older than the last review are ignored.
+        self.assertEqual(self.post_events(self.owner, events)['ignored'], 2)
+        self.assertEqual(self.post_events(self.owner, [{'card': self.card.pk, 'correct': True, 'ts': ts + 1000}])['ignored'], 1)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.learned_count, 2)
+
+
+class StatsTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner')
+        with home_shard_of(cls.user):
+            stats.rebuild_user_stats(cls.user.pk)
+            cls.topic = Topic.objects.create(name="Topic", user=cls.user)
+            cls.deck = Deck.objects.create(name="Deck", topic=cls.topic)
+
+    def setUp(self):
+        self.enterContext(home_shard_of(self.user))
+
+    def check(self):
+        out = io.StringIO()
+        call_command('rebuild_stats', '--check', stdout=out)
+        return out.getvalue()
+
+    def test_snapshot_follows_writes(self):
+        cards = [Card.objects.create(deck=self.deck, front=f"front {i}", back="back") for i in range(3)]
+        bulk.insert_cards((self.deck.pk, "bulk", "back") for _ in range(2))
+        cards_changed.send(sender=Card, deck_ids=[self.deck.pk])
+        self.client.force_login(self.user)
+        self.client.post(reverse('card-delete', args=[self.topic.pk, self.deck.pk, cards[0].pk]))
+        events = [{'card': cards[1].pk, 'correct': True, 'ts': int(time.time() * 1000)}]
+        self.client.post(reverse('track-learning-batch'), json.dumps({'events': events}), content_type='application/json')
+
+        self.assertEqual(stats.find_drift(self.user.pk), [])
+        user_stats = stats.get_user_stats(self.user)
+        self.assertEqual((user_stats.topic_count, user_stats.deck_count, user_stats.card_count), (1, 1, 4))
+        [deck] = stats.decks_due_for_review(self.user)
+        self.assertEqual(deck.due_cards_count, 3)
+        self.assertIn("up to date", self.check())
+
+    def test_check_reports_drift(self):
+        UserStats.objects.filter(pk=self.user.pk).update(card_count=99)
+        DeckStats.objects.filter(deck=self.deck).update(card_count=7)
+        out = io.StringIO()
+        with self.assertRaisesRegex(CommandError, "drifted for 1 user"):
+            call_command('rebuild_stats', '--check', stdout=out)
+        self.assertIn("learner: card_count: snapshot 99, actual 0", out.getvalue())
+        self.assertIn(f"learner: deck {self.deck.pk}: card_count snapshot 7, actual 0", out.getvalue())
+        call_command('rebuild_stats', stdout=io.StringIO())
+        self.assertIn("up to date", self.check())
+
+
+@override_settings(TIME_ZONE='Europe/Berlin')
+class ActivityTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner')
+
+    def setUp(self):
+        self.enterContext(home_shard_of(self.user))
+
+    def rollup(self):
+        return dict(DailyActivity.objects.filter(user=self.user).values_list('day', 'reviews'))
+
+    def test_reviews_roll_up_by_local_day(self):
+        activity.record_reviews(self.user, [
+            (1, True, datetime(2026, 3, 1, 22, 30, tzinfo=dt_timezone.utc)),  # 23:30 in Berlin
+            (2, False, datetime(2026, 3, 1, 23, 30, tzinfo=dt_timezone.utc)),  # already March 2nd
+            (3, True, datetime(2026, 3, 2, 8, 0, tzinfo=dt_timezone.utc)),
+        ])
+        self.assertEqual(self.rollup(), {date(2026, 3, 1): 1, date(2026, 3, 2): 2})
+        self.assertEqual(DailyActivity.objects.get(user=self.user, day=date(2026, 3, 2)).correct, 1)
+        self.assertEqual(ReviewEvent.objects.filter(user=self.user).count(), 3)
+
+    def test_concurrent_first_review_of_the_day(self):
+        atomic = sharding.atomic
+
+        def atomic_after_another_request(**kwargs):
+            # Another request creates the day's row between our UPDATE and INSERT.
+            DailyActivity.objects.create(user=self.user, day=date(2026, 3, 1), reviews=5, correct=5)
+            return atomic(**kwargs)
+
+        with mock.patch.object(sharding, 'atomic', side_effect=atomic_after_another_request):
+            activity.record_reviews(self.user, [(1, True, datetime(2026, 3, 1, 12, tzinfo=dt_timezone.utc))])
+        self.assertEqual(self.rollup(), {date(2026, 3, 1): 6})
+
+    def test_yearly_series_is_grouped_by_month(self):
+        DailyActivity.objects.bulk_create([
+            DailyActivity(user=self.user, day=day, reviews=reviews, correct=0)
+            for day, reviews in [
+                (date(2025, 3, 31), 100),  # before the first month shown
+                (date(2025, 4, 1), 4),
+                (date(2026, 1, 31), 1),
+                (date(2026, 3, 1), 2),
+                (date(2026, 3, 15), 3),
+            ]
+        ])
+        with mock.patch('flashcards.activity.timezone.localdate', return_value=date(2026, 3, 15)):
+            labels, reviews, _ = activity.progress_series(self.user, 365)
+        self.assertEqual((labels[0], labels[-1], len(labels)), ('Apr 2025', 'Mar 2026', 12))
+        self.assertEqual(reviews, [4, 0, 0, 0, 0, 0, 0, 0, 0, 1, 0, 5])
+
+    def test_pruning_keeps_the_rollup(self):
+        now = timezone.now()
+        activity.record_reviews(self.user, [(1, True, now - timedelta(days=400)), (1, True, now)])
+        rollup = self.rollup()
+        out = io.StringIO()
+        call_command('prune_review_events', '--days', '365', stdout=out)
+        self.assertIn("Deleted 1 review event", out.getvalue())
+        self.assertEqual(list(ReviewEvent.objects.values_list('reviewed_at', flat=True)), [now])
+        self.assertEqual(self.rollup(), rollup)
+
+
+@override_settings(BACKGROUND_JOBS=False)
+class ExportTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner', password='password')
+        with home_shard_of(cls.user):
+            cls.topic = Topic.objects.create(name="Wörter", user=cls.user)
+            deck = Deck.objects.create(name="Verbs", topic=cls.topic)
+            Deck.objects.create(name="Empty", topic=cls.topic)
+            bulk.insert_cards([(deck.pk, 'gehen', 'to go'), (deck.pk, '"sein"', 'to be\n(irregular)'), (deck.pk, '🙂', '')])
+
+    def setUp(self):
+        self.client.login(username='learner', password='password')
+        self.enterContext(home_shard_of(self.user))
+
+    def export(self, **headers):
+        response = self.client.get(reverse('export-topic', args=[self.topic.pk]), headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def content(self, topic):
+        return [
+            (deck.name, list(deck.cards.order_by('pk').values_list('front', 'back')))
+            for deck in topic.decks.order_by('pk')
+        ]
+
+    def test_round_trip(self):
+        _, body = self.export()
+        response = self.client.post(reverse('import-data'), {'file': SimpleUploadedFile('topic.json', body)})
+        self.assertContains(response, "Import Complete")
+        imported = Topic.objects.get(user=self.user, name="Wörter (imported)")
+        self.assertEqual(self.content(imported), self.content(self.topic))
+
+    def test_import_reads_across_chunk_boundaries(self):
+        _, body = self.export()
+        upload = mock.Mock(chunks=lambda: (body[i:i + 5] for i in range(0, len(body), 5)))
+        report = imports.import_file(self.user, upload)
+        self.assertEqual((report.deck_count, report.card_count), (2, 3))
+        self.assertEqual(self.content(report.topic), self.content(self.topic))
+
+    def test_bad_uploads_are_rejected_whole(self):
+        _, body = self.export()
+        for content in [body[:len(body) // 2], b'[1, 2]', b'{"type": "topic", "decks": [}', b'{"type": "album"}', b'\xff\xfe']:
+            response = self.client.post(reverse('import-data'), {'file': SimpleUploadedFile('topic.json', content)})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.context['form'].errors['file'], content)
+        self.assertEqual(list(Topic.objects.filter(user=self.user)), [self.topic])
+        with self.assertRaises(imports.ImportFormatError):
+            imports.import_file(self.user, SimpleUploadedFile('topic.json', b'{"type": "deck", "cards": [] } trailing'))
+
+    def test_gzip_export(self):
+        plain, body = self.export()
+        response, compressed = self.export(accept_encoding='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed), body)
+        self.assertNotEqual(response['ETag'], plain['ETag'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_gzip_negotiation(self):
+        for accept_encoding, expected in [
+            ('gzip, deflate, br', 'gzip'),
+            ('br;q=1.0, gzip;q=0.5', 'gzip'),
+            ('gzip;q=0', 'identity'),
+            ('gzip; q=0.000, *', 'identity'),
+            ('*;q=0.1', 'gzip'),
+            ('identity', 'identity'),
+            ('', 'identity'),
+        ]:
+            request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept_encoding)
+            self.assertEqual(exports.response_encoding(request), expected, accept_encoding)
+
+
+class JobTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner')
+
+    def setUp(self):
+        self.enterContext(override_settings(JOB_RESULTS_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+
+    def failing_job(self, error, **payload):
+        def fail(job):
+            job.result_file = 'partial.json'
+            jobs.result_path(job).write_text('{"half": ')
+            raise error
+        self.enterContext(mock.patch.dict(jobs.HANDLERS, {'failing': fail}))
+        self.enterContext(self.assertLogs('flashcards.jobs', 'ERROR'))
+        return jobs.enqueue(self.user, 'failing', **payload)
+
+    def test_claim_takes_each_runnable_job_once(self):
+        later = Job.objects.create(user=self.user, kind='import', run_after=timezone.now() + timedelta(minutes=1))
+        first, second = (Job.objects.create(user=self.user, kind='import') for _ in range(2))
+        claimed = jobs.claim('worker-1')
+        self.assertEqual((claimed.pk, claimed.status, claimed.attempts, claimed.worker), (first.pk, Job.RUNNING, 1, 'worker-1'))
+        self.assertEqual(jobs.claim('worker-2').pk, second.pk)
+        self.assertIsNone(jobs.claim('worker-1'))
+        self.assertEqual(Job.objects.get(pk=later.pk).status, Job.PENDING)
+
+    def test_transient_failures_back_off_then_fail(self):
+        job = self.failing_job(RuntimeError("database is locked"))
+        for attempt, delay in [(1, 30), (2, 60)]:
+            started = timezone.now()
+            jobs.run(jobs.claim('worker'))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.result_file), (Job.PENDING, attempt, ''))
+            self.assertFalse((Path(settings.JOB_RESULTS_DIR) / 'partial.json').exists())
+            self.assertAlmostEqual((job.run_after - started).total_seconds(), delay, delta=5)
+            self.assertIsNone(jobs.claim('worker'))  # not before the delay
+            Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        jobs.run(jobs.claim('worker'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 3))
+        self.assertEqual(jobs.status(job)['error'], "RuntimeError: database is locked")
+
+    def test_export_names_the_file_by_id(self):
+        with home_shard_of(self.user):
+            topic = Topic.objects.create(name="../A/B " + "x" * 300, user=self.user)
+            Card.objects.create(deck=Deck.objects.create(name="Deck", topic=topic), front="front", back="back")
+        job = jobs.enqueue(self.user, 'export_topic', topic=topic.pk)
+        jobs.run(jobs.claim('worker'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(jobs.result_path(job).parent.parent, Path(settings.JOB_RESULTS_DIR) / 'jobs')
+        self.assertEqual(jobs.result_path(job).name, f"topic_{topic.pk}.json")
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('job-download', args=[job.pk]))
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['name'], topic.name)
+        self.assertIn(f"topic_{topic.pk}_", response['Content-Disposition'])
+
+    def test_bad_upload_fails_at_once(self):
+        job = jobs.enqueue_import(self.user, SimpleUploadedFile('topic.json', b'{"type": "topic", "decks": [}'))
+        upload = jobs.upload_path(job)
+        self.assertTrue(upload.exists())
+        with self.assertLogs('flashcards.jobs', 'ERROR'):
+            jobs.run(jobs.claim('worker'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 1))
+        self.assertIn("ImportFormatError", job.error)
+        self.assertFalse(upload.exists())
+
+
+class CopyingTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner')
+        cls.recipient = User.objects.create_user('recipient', password='password')
+        with home_shard_of(cls.owner):
+            cls.topic = Topic.objects.create(name="Languages", user=cls.owner)
+            decks = [Deck.objects.create(name=name, topic=cls.topic) for name in ("Spanish", "Empty", "German")]
+            # Interleaved, so card ids do not follow deck order.
+            for i in range(3):
+                Card.objects.create(deck=decks[2], front=f"de {i}", back=f"german {i}")
+                Card.objects.create(deck=decks[0], front=f"es {i}", back=f"spanish {i}", learned_count=5)
+            Deck.objects.create(name="Unrelated", topic=Topic.objects.create(name="Other", user=cls.owner))
+        cls.spanish, cls.empty, cls.german = decks
+
+    def setUp(self):
+        self.enterContext(home_shard_of(self.owner))
+
+    def assertCopied(self, deck_ids, target_topic):
+        self.assertEqual(len(set(deck_ids.values())), len(deck_ids))
+        for old_id, new_id in deck_ids.items():
+            old, new = Deck.objects.get(pk=old_id), Deck.objects.get(pk=new_id)
+            self.assertEqual((new.name, new.topic_id, new.source_deck_id), (old.name, target_topic.pk, None))
+            self.assertEqual(
+                list(new.cards.order_by('pk').values_list('front', 'back', 'learned_count')),
+                [(front, back, 0) for front, back in old.cards.order_by('pk').values_list('front', 'back')],
+            )
+
+    def test_copy_topic_maps_every_deck(self):
+        ids = copying.copy_topic(self.topic, self.recipient)
+        [(old_topic_id, new_topic_id)] = ids['topic'].items()
+        new_topic = Topic.objects.get(pk=new_topic_id)
+        self.assertEqual((old_topic_id, new_topic.name, new_topic.user), (self.topic.pk, "Languages", self.recipient))
+        self.assertEqual(set(ids['decks']), {self.spanish.pk, self.empty.pk, self.german.pk})
+        self.assertCopied(ids['decks'], new_topic)
+        self.assertEqual(Card.objects.filter(deck__topic=new_topic).count(), 6)
+
+    def test_copy_deck_into_existing_topic(self):
+        target = Topic.objects.create(name="Mine", user=self.recipient)
+        Deck.objects.create(name="Already there", topic=target)
+        ids = copying.copy_deck(self.german, target)
+        self.assertEqual(list(ids['decks']), [self.german.pk])
+        self.assertCopied(ids['decks'], target)
+
+    def test_copy_of_a_linked_deck_copies_its_source(self):
+        target = Topic.objects.create(name="Mine", user=self.recipient)
+        linked_deck = Deck.objects.get(pk=copying.link_deck(self.spanish, target)['decks'][self.spanish.pk])
+        copied = Deck.objects.get(pk=copying.copy_deck(linked_deck, target)['decks'][linked_deck.pk])
+        self.assertEqual(list(copied.cards.values_list('front', flat=True)), ["es 0", "es 1", "es 2"])
+
+    def accept_topic_then_deck(self):
+        """Accepts the shared topic, then the German deck into the new topic; returns both."""
+        self.client.login(username='recipient', password='password')
+        self.topic.shared_with.add(self.recipient)
+        response = self.client.post(reverse('accept-shared-topic', args=[self.topic.pk]))
+        new_topic = Topic.objects.using(sharding.home_shard(self.recipient.pk)).get(user=self.recipient)
+        self.assertRedirects(response, reverse('topic-detail', args=[new_topic.pk]))
+        self.assertEqual(new_topic.decks.count(), 3)
+
+        self.german.shared_with.add(self.recipient)
+        response = self.client.post(reverse('accept-shared-deck', args=[self.german.pk]), {'topic': new_topic.pk})
+        new_deck = new_topic.decks.order_by('pk').last()
+        self.assertRedirects(response, reverse('deck-detail', args=[new_topic.pk, new_deck.pk]))
+        return new_topic, new_deck
+
+    @override_settings(SHARE_COPY_ON_WRITE=False, BACKGROUND_JOBS=False)
+    def test_accept_views_redirect_to_the_copies(self):
+        new_topic, new_deck = self.accept_topic_then_deck()
+        self.assertFalse(new_topic.decks.filter(source_deck__isnull=False).exists())
+        self.assertEqual(new_deck.cards.count(), 3)
+
+    @override_settings(SHARE_COPY_ON_WRITE=True, BACKGROUND_JOBS=False)
+    def test_accept_views_redirect_to_linked_decks(self):
+        new_topic, new_deck = self.accept_topic_then_deck()
+        if sharding.home_shard(self.recipient.pk) != sharding.home_shard(self.owner.pk):
+            # Links do not cross shards: a recipient elsewhere gets copies.
+            self.assertFalse(new_topic.decks.filter(source_deck__isnull=False).exists())
+            self.assertEqual(new_deck.cards.count(), 3)
+            return
+        self.assertEqual(
+            dict(new_topic.decks.values_list('name', 'source_deck_id')),
+            {"Spanish": self.spanish.pk, "Empty": self.empty.pk, "German": self.german.pk},
+        )
+        self.assertEqual(new_deck.source_deck_id, self.german.pk)
+        self.assertFalse(new_deck.cards.exists())
+        self.assertEqual(linked.deck_cards(new_deck).count(), 3)
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "The search index is SQLite FTS5")
+class SearchTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner', password='password')
+        cls.other = User.objects.create_user('other')
+        # Search covers the user's home shard.
+        with home_shard_of(cls.user):
+            cls.topic = Topic.objects.create(name="Languages", user=cls.user)
+            cls.deck = Deck.objects.create(name="Spanish", topic=cls.topic)
+            Card.objects.create(deck=cls.deck, front="el perro", back="the dog")
+            bulk.insert_cards([(cls.deck.pk, "el gato", "the cat"), (cls.deck.pk, "<b>la casa</b>", "the house")])
+            cls.other_topic = Topic.objects.create(name="Other", user=cls.other)
+            cls.other_deck = Deck.objects.create(name="Private", topic=cls.other_topic)
+            Card.objects.create(deck=cls.other_deck, front="der Hund", back="the dog")
+
+    def setUp(self):
+        self.enterContext(home_shard_of(self.user))
+
+    def fronts(self, user, query):
+        return [result['front'] for result in search.search_cards(user, query)[0]]
+
+    def test_ranks_and_scopes_to_own_decks(self):
+        self.assertEqual(self.fronts(self.user, "dog"), ["el perro"])
+        self.assertEqual(self.fronts(self.user, "the"), ["el perro", "el gato", "<b>la casa</b>"])
+        self.assertEqual(self.fronts(self.user, "ho"), ["<b>la casa</b>"])  # prefix of the last word
+        self.assertEqual(self.fronts(self.user, '" OR *'), [])
+
+    def test_index_follows_writes(self):
+        card = Card.objects.get(front="el gato")
+        card.back = "the kitten"
+        card.save()
+        self.assertEqual(self.fronts(self.user, "kitten"), ["el gato"])
+        self.assertEqual(self.fronts(self.user, "cat"), [])
+        card.delete()
+        self.assertEqual(self.fronts(self.user, "kitten"), [])
+
+    def test_shared_and_copied_decks(self):
+        self.other_deck.shared_with.add(self.user)
+        self.assertEqual(self.fronts(self.user, "dog"), ["el perro", "der Hund"])
+        self.other_deck.shared_with.remove(self.user)
+        copying.copy_deck(self.other_deck, self.topic)  # INSERT ... SELECT, no signals
+        results, _ = search.search_cards(self.user, "hund")
+        self.assertEqual(results[0]['deck'].topic, self.topic)
+        search.check()
+
+    def test_view_escapes_and_highlights(self):
+        self.client.login(username='learner', password='password')
+        response = self.client.get(reverse('card-search'), {'q': 'casa'})
+        self.assertContains(response, "&lt;b&gt;la <mark>casa</mark>&lt;/b&gt;", html=False)
+        data = self.client.get(reverse('card-search'), {'q': 'the', 'format': 'json'}).json()
+        self.assertEqual(len(data['results']), 3)
+        self.assertFalse(data['has_next'])
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', "The change log is kept by SQLite triggers")
+class SyncTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner', password='password')
+        cls.topic = Topic.objects.create(name="Topic", user=cls.user)
+        cls.deck = Deck.objects.create(name="Deck", topic=cls.topic)
+        bulk.insert_cards((cls.deck.pk, f"front {i}", f"back {i}") for i in range(5))
+
+    def setUp(self):
+        self.client.login(username='learner', password='password')
+        self.url = reverse('sync-deck-for-learning', args=[self.topic.pk, self.deck.pk])
+
+    def sync(self, token=None, **kwargs):
+        return self.client.get(self.url, {'token': token} if token else {}, **kwargs).json()
+
+    def test_returns_only_changes(self):
+        full = self.sync()
+        self.assertTrue(full['reset'])
+        self.assertEqual(len(full['cards']), 5)
+        self.assertEqual(self.sync(full['token'])['cards'], [])
+
+        edited, removed = self.deck.cards.order_by('pk')[:2]
+        edited.front = "edited"
+        edited.save()
+        removed_id = removed.pk
+        removed.delete()
+        bulk.insert_cards([(self.deck.pk, "new", "card")])
+        delta = self.sync(full['token'])
+        self.assertFalse(delta['reset'])
+        self.assertEqual(sorted(card['front'] for card in delta['cards']), ["edited", "new"])
+        self.assertEqual(delta['deleted'], [removed_id])
+        self.assertEqual(self.sync(delta['token'])['cards'], [])
+
+    def test_pages_and_expired_tokens(self):
+        first = sync.changes(self.deck, limit=3)
+        rest = sync.changes(self.deck, first['token'], limit=3)
+        self.assertTrue(first['has_more'])
+        self.assertFalse(rest['has_more'])
+        self.assertEqual(len(first['cards']) + len(rest['cards']), 5)
+        content_deck_id, change_id, issued_at = sync.parse_token(rest['token'])
+        with override_settings(SYNC_TOMBSTONE_DAYS=1):
+            stale = f"{content_deck_id}.{change_id}.{issued_at - 2 * 86400}"
+            self.assertTrue(sync.changes(self.deck, stale)['reset'])
+
+    def test_offline_reviews_upload_once(self):
+        token = self.sync()['token']
+        card = self.deck.cards.first()
+        events = [{'card': card.pk, 'correct': True, 'ts': int(time.time() * 1000)}]
+        body = json.dumps({'token': token, 'events': events})
+        data = self.client.post(self.url, body, content_type='application/json').json()
+        self.assertEqual((data['applied'], data['ignored']), (1, 0))
+        card.refresh_from_db()
+        self.assertEqual([c['id'] for c in data['cards']], [card.pk])
+        self.assertEqual(parse_datetime(data['cards'][0]['due_at']), card.next_review_date)
+        # Reviews are not logged: other syncs see no change.
+        self.assertEqual(self.sync(data['token'])['cards'], [])
+        data = self.client.post(self.url, body, content_type='application/json').json()
+        self.assertEqual((data['applied'], data['ignored']), (0, 1))
+
+    def test_linked_deck(self):
+        other = User.objects.create_user('other')
+        linked_deck = Deck.objects.create(
+            name="Linked", topic=Topic.objects.create(name="Linked", user=other), source_deck=self.deck
+        )
+        full = sync.changes(linked_deck)
+        card = self.deck.cards.first()
+        self.assertEqual(full['cards'][0]['due_at'], linked.NEW_CARD_DUE)
+        owner_token = self.sync()['token']
+        progress = linked.load_progress(other, [card])[card.pk]
+        progress.next_review_date = timezone.now()
+        linked.save_progress(other, [progress])
+        # A linked learner gets their own schedule of the cards they reviewed; nothing is logged.
+        delta = sync.changes(linked_deck, full['token'], other.pk, reviewed=[card.pk])
+        self.assertEqual([(c['id'], c['due_at']) for c in delta['cards']], [(card.pk, progress.next_review_date)])
+        self.assertEqual(sync.changes(linked_deck, full['token'])['cards'], [])
+        self.assertEqual(sync.changes(self.deck, owner_token)['cards'], [])
+        linked.materialize(linked_deck)
+        self.assertTrue(sync.changes(linked_deck, full['token'])['reset'])
+
+
+class CachingTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('learner', password='password')
+        cls.owner = User.objects.create_user('owner')
+        with home_shard_of(cls.user):
+            cls.topic = Topic.objects.create(name='Mine', user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        self.client.login(username='learner', password='password')
+        self.enterContext(home_shard_of(self.user))
+
+    def get(self, url):
+        with CaptureQueriesContext(connections[sharding.current()]) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_topic_pages_are_cached_until_they_change(self):
+        topic_list, topic_detail = reverse('topic-list'), reverse('topic-detail', args=[self.topic.pk])
+        _, uncached = self.get(topic_list)
+        response, cached = self.get(topic_list)
+        self.assertLess(cached, uncached)
+        self.assertContains(response, '0 Decks')
+
+        deck = Deck.objects.create(name='Verbs', topic=self.topic)
+        self.assertContains(self.get(topic_list)[0], '1 Decks')
+        self.assertContains(self.get(topic_detail)[0], '0 Cards')
+        bulk.insert_cards((deck.pk, 'front', 'back') for _ in range(2))
+        cards_changed.send(sender=Card, deck_ids=[deck.pk])
+        self.assertContains(self.get(topic_detail)[0], '2 Cards')
+        Topic.objects.create(name='Second', user=self.user)
+        self.assertContains(self.get(reverse('dashboard'))[0], 'Second')
+
+    def test_shared_lists_follow_shares(self):
+        url = reverse('shared-with-me')
+        deck = Deck.objects.create(name='Nouns', topic=Topic.objects.create(name='Theirs', user=self.owner))
+        self.assertNotContains(self.get(url)[0], 'Nouns')
+        deck.shared_with.add(self.user)
+        self.assertContains(self.get(url)[0], 'Nouns')
+        deck.name = 'Adjectives'
+        deck.save()
+        self.assertContains(self.get(url)[0], 'Adjectives')
+        deck.topic.name = 'Renamed'
+        deck.topic.save()
+        self.assertContains(self.get(url)[0], 'Renamed')
+        self.user.shared_decks.remove(deck)
+        self.assertNotContains(self.get(url)[0], 'Adjectives')
+
+    @override_settings(FRAGMENT_CACHE_TIMEOUT=60, FRAGMENT_CACHE_STALE=60)
+    def test_stale_entries_are_served_while_one_request_rebuilds(self):
+        builds = []
+
+        def build():
+            builds.append(len(builds) + 1)
+            if len(builds) == 2:
+                # A request arriving during the rebuild gets the stale copy.
+                self.assertEqual(caching.fetch('test', self.user.pk, [], build), 1)
+            return builds[-1]
+
+        self.assertEqual(caching.fetch('test', self.user.pk, [], build), 1)
+        with mock.patch('flashcards.caching.time.time', return_value=time.time() + 90):
+            self.assertEqual(caching.fetch('test', self.user.pk, [], build), 2)
+        self.assertEqual(caching.fetch('test', self.user.pk, [], build), 2)
+        self.assertEqual(builds, [1, 2])
+        _, _, counters = metrics.collect()
+        self.assertEqual(counters['test'], [1, 2, 1])  # hit, miss, stale
+
+
+class BulkCardEditTests(TestCase):
+    databases = SHARD_DATABASES
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('author', password='password')
+        cls.topic = Topic.objects.create(name='Topic', user=cls.user)
+        cls.deck = Deck.objects.create(name='Deck', topic=cls.topic)
+        cls.cards = [Card.objects.create(deck=cls.deck, front=f'front {i}', back=f'back {i}') for i in range(3)]
+
+    def setUp(self):
+        self.client.login(username='author', password='password')
+
+    def post(self, payload, deck=None):
+        deck = deck or self.deck
+        url = reverse('card-bulk-edit', args=[deck.topic_id, deck.pk])
+        return self.client.post(url, json.dumps(payload), content_type='application/json')
+
+    def test_creates_updates_and_deletes_in_one_request(self):
+        first, second, third = self.cards
+        revision = self.deck.revision
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post({
+                'create': [{'front': f'new {i}', 'back': 'answer'} for i in range(1000)],
+                'update': [{'id': first.pk, 'front': 'changed', 'back': 'changed back'}],
+                'delete': [second.pk],
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(queries), 50)  # written in batches, not card by card
+        result = response.json()
+        self.assertEqual((len(result['created']), result['updated'], result['deleted']), (1000, 1, 1))
+        self.assertEqual(Card.objects.get(pk=result['created'][-1]).front, 'new 999')
+        self.assertEqual(Card.objects.get(pk=first.pk).front, 'changed')
+        self.assertFalse(Card.objects.filter(pk=second.pk).exists())
+        self.deck.refresh_from_db()
+        self.assertGreater(self.deck.revision, revision)
+        self.assertEqual(self.deck.stats.card_count, 1002)
+
+    def test_invalid_rows_save_nothing(self):
+        response = self.post({
+            'create': [{'front': 'ok', 'back': 'ok'}, {'front': '', 'back': 'no front'}],
+            'update': [{'id': 0, 'front': 'x', 'back': 'y'}],
+            'delete': [self.cards[0].pk, self.cards[0].pk],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [
+            {'op': 'create', 'index': 1, 'errors': {'front': ['This field is required.']}},
+            {'op': 'update', 'index': 0, 'errors': {'id': ['No such card in this deck.']}},
+            {'op': 'delete', 'index': 1, 'errors': {'id': ['The card appears more than once.']}},
+        ])
+        self.assertEqual(Card.objects.filter(deck=self.deck).count(), 3)
+        self.assertEqual(self.post({'create': {}}).status_code, 400)
+
+    def test_linked_deck_gets_its_own_cards(self):
+        owner = User.objects.create_user('owner')
+        source = Deck.objects.create(name='Source', topic=Topic.objects.create(name='Theirs', user=owner))
+        card = Card.objects.create(deck=source, front='front', back='back')
+        linked_deck = Deck.objects.get(pk=copying.link_deck(source, self.topic)['decks'][source.pk])
+        response = self.post({'update': [{'id': card.pk, 'front': 'mine', 'back': 'back'}]}, deck=linked_deck)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(Card.objects.filter(deck=linked_deck).values_list('front', flat=True)), ['mine'])
+        self.assertEqual(Card.objects.get(pk=card.pk).front, 'front')
+
+    def test_only_the_owner_may_edit(self):
+        User.objects.create_user('other', password='password')
+        self.client.login(username='other', password='password')
+        self.assertEqual(self.post({'delete': [self.cards[0].pk]}).status_code, 404)
+
+
+class BenchmarkCommandTests(TestCase):
+    databases = SHARD_DATABASES
+
+    def setUp(self):
+        self.directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(JOB_RESULTS_DIR=str(self.directory / 'results')))
+
+    def test_seed_benchmark_and_compare(self):
+        out = io.StringIO()
+        call_command(
+            'seed_dataset', users=3, topics=1, decks=2, cards=3, share_fanout=1, reviews=5, history_days=3, stdout=out,
+        )
+        self.assertIn("Seeded 3 user(s), 3 topic(s), 6 deck(s) and 18 card(s).", out.getvalue())
+        self.assertEqual(Card.objects.filter(deck__topic__user__username__startswith='bench').count(), 18)
+        with self.assertRaises(CommandError):
+            call_command('seed_dataset', users=3, stdout=out)
+
+        report_path = self.directory / 'base.json'
+        call_command('benchmark_views', iterations=1, warmup=0, output=str(report_path), stdout=out)
+        report = json.loads(report_path.read_text())
+        self.assertEqual(report['routes']['GET deck-detail']['status'], 200)
+        self.assertEqual(report['routes']['POST card-bulk-edit']['status'], 200)
+        self.assertEqual([key for key, route in report['routes'].items() if route['status'] >= 500], [])
+        # The benchmark's requests are rolled back.
+        self.assertEqual(Card.objects.count(), 18)
+        self.assertFalse(Job.objects.exists())
+
+        call_command('benchmark_views', compare=[str(report_path), str(report_path)], stdout=out)
+        self.assertIn("No regressions.", out.getvalue())
+        report['routes']['GET deck-detail']['queries'] += 1
+        new_path = self.directory / 'new.json'
+        new_path.write_text(json.dumps(report))
+        with self.assertRaisesMessage(CommandError, "1 route(s) regressed: GET deck-detail"):
+            call_command('benchmark_views', compare=[str(report_path), str(new_path)], stdout=out)
+
+
+@unittest.skipUnless(
+    connection.vendor == 'sqlite' and connection.settings_dict['OPTIONS'].get('init_command'),
+    "The SQLite production profile is not in use",
+)
+class SqliteProfileTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_connection_is_tuned(self):
+        self.assertEqual(self.pragma('busy_timeout'), settings.SQLITE_BUSY_TIMEOUT)
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('cache_size'), -settings.SQLITE_CACHE_SIZE_KB)
+        self.assertEqual(connection.transaction_mode, 'IMMEDIATE')
+
+
+class ReplicaRoutingTests(SimpleTestCase):
+    router = routers.ReplicaRouter()
+
+    def test_reads_go_to_the_replica_until_a_write(self):
+        self.assertEqual(self.router.db_for_read(Card), 'default')
+        with routers.routing(use_replica=True) as state:
+            self.assertEqual(self.router.db_for_read(Card), 'replica')
+            self.assertEqual(self.router.db_for_read(Session), 'default')
+            self.assertEqual(self.router.db_for_write(Card), 'default')
+            self.assertTrue(state.wrote)
+            self.assertEqual(self.router.db_for_read(Card), 'default')
+        with routers.routing(use_replica=False) as state:
+            self.assertEqual(self.router.db_for_read(Card), 'default')
+            self.assertFalse(state.wrote)
+
+    def test_only_the_primary_is_migrated(self):
+        self.assertTrue(self.router.allow_migrate('default', 'flashcards'))
+        self.assertFalse(self.router.allow_migrate('replica', 'flashcards'))
+
+
+@override_settings(DB_SHARDS=3)
+class ShardRoutingTests(SimpleTestCase):
+    router = routers.ShardRouter()
+
+    def test_ids_name_their_shard(self):
+        self.assertEqual(sharding.shard_of_id(7), 'default')
+        self.assertEqual(sharding.shard_of_id(sharding.SHARD_ID_SPAN + 7), 'shard1')
+        self.assertEqual(sharding.shard_of_id(2 * sharding.SHARD_ID_SPAN), 'shard2')
+        self.assertEqual(sharding.shard_of_id(3 * sharding.SHARD_ID_SPAN), 'default')
+
+    def test_sharded_models_follow_the_selected_shard(self):
+        self.assertEqual(self.router.db_for_read(Card), 'default')
+        with sharding.using_shard('shard2'):
+            self.assertEqual(self.router.db_for_read(Card), 'shard2')
+            self.assertEqual(self.router.db_for_write(Topic), 'shard2')
+            self.assertEqual(self.router.db_for_write(User), 'default')
+            self.assertEqual(self.router.db_for_write(Job), 'default')
+            # Relations of an object loaded from another shard stay on its shard.
+            card = Card()
+            card._state.db = 'shard1'
+            self.assertEqual(self.router.db_for_read(Deck, instance=card), 'shard1')
+            self.assertEqual(self.router.db_for_read(User, instance=card), 'shard1')
+
+
+@unittest.skipUnless(sharding.enabled(), "Sharding is off; set DB_SHARDS")
+class ShardingTests(TestCase):
+    databases = '__all__'
+
+    def users_on_two_shards(self):
+        users = {}
+        for i in range(50):
+            user = User.objects.create_user(f'user{i}', email=f'user{i}@example.com', password='password')
+            users.setdefault(sharding.home_shard(user.pk), user)
+            if len(users) == 2:
+                return list(users.values())
+        self.fail("The users all landed on one shard.")
+
+    def test_new_users_are_placed_and_copied(self):
+        owner, learner = self.users_on_two_shards()
+        for user in (owner, learner):
+            self.assertTrue(UserShard.objects.filter(user=user).exists())
+            for name in sharding.aliases():
+                self.assertTrue(User.objects.using(name).filter(pk=user.pk).exists())
+
+    def test_share_across_shards(self):
+        owner, learner = self.users_on_two_shards()
+        owner_shard, learner_shard = sharding.home_shard(owner.pk), sharding.home_shard(learner.pk)
+        with sharding.using_shard(owner_shard):
+            deck = Deck.objects.create(name='Shared', topic=Topic.objects.create(name='Owner', user=owner))
+            Card.objects.create(deck=deck, front='f', back='b')
+            deck.shared_with.add(learner)
+        self.assertEqual(sharding.shard_of_id(deck.pk), owner_shard)
+        with sharding.using_shard(learner_shard):
+            topic = Topic.objects.create(name='Learner', user=learner)
+
+        self.client.force_login(learner)
+        response = self.client.get(reverse('shared-with-me'))
+        self.assertContains(response, 'Shared')
+        response = self.client.post(reverse('accept-shared-deck', args=[deck.pk]), {'topic': topic.pk})
+        copy = Deck.objects.using(learner_shard).get(topic=topic)
+        self.assertRedirects(response, reverse('deck-detail', args=[topic.pk, copy.pk]))
+        self.assertEqual(list(copy.cards.values_list('front', flat=True)), ['f'])
+        self.assertFalse(deck.shared_with.exists())
+
+    def test_move_user_shard(self):
+        owner, other = self.users_on_two_shards()
+        source, target = sharding.home_shard(owner.pk), sharding.home_shard(other.pk)
+        with sharding.using_shard(source):
+            topic = Topic.objects.create(name='T', user=owner)
+            Card.objects.create(deck=Deck.objects.create(name='D', topic=topic), front='f')
+        call_command('move_user_shard', owner.username, sharding.index_of(target), stdout=io.StringIO())
+        self.assertEqual(sharding.home_shard(owner.pk), target)
+        self.assertEqual(Card.objects.using(target).filter(deck__topic__user=owner).count(), 1)
+        self.assertFalse(Topic.objects.using(source).filter(user=owner).exists())
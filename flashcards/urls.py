@@ -6,6 +6,8 @@ urlpatterns = [
     path('dashboard/', views.DashboardView.as_view(), name='dashboard'),
     path('register/', views.register, name='register'),
     path('import/', views.ImportView.as_view(), name='import-data'),
+    path('search/', views.card_search, name='card-search'),
+    path('learn-sw.js', views.learn_service_worker, name='learn-service-worker'),
     
     # Topic URLs
     path('topics/', views.TopicListView.as_view(), name='topic-list'),
@@ -19,6 +21,7 @@ urlpatterns = [
     # Deck URLs
     path('topics/<int:topic_pk>/decks/create/', views.DeckCreateView.as_view(), name='deck-create'),
     path('topics/<int:topic_pk>/decks/<int:pk>/', views.DeckDetailView.as_view(), name='deck-detail'),
+    path('topics/<int:topic_pk>/decks/<int:pk>/cards/', views.deck_cards, name='deck-cards'),
     path('topics/<int:topic_pk>/decks/<int:pk>/update/', views.DeckUpdateView.as_view(), name='deck-update'),
     path('topics/<int:topic_pk>/decks/<int:pk>/delete/', views.DeckDeleteView.as_view(), name='deck-delete'),
     path('topics/<int:topic_pk>/decks/<int:pk>/share/', views.ShareDeckView.as_view(), name='share-deck'),
@@ -36,13 +39,24 @@ urlpatterns = [
 
     # Card URLs
     path('topics/<int:topic_pk>/decks/<int:deck_pk>/cards/create/', views.CardCreateView.as_view(), name='card-create'),
+    path('topics/<int:topic_pk>/decks/<int:deck_pk>/cards/bulk/', views.bulk_edit_cards, name='card-bulk-edit'),
     path('topics/<int:topic_pk>/decks/<int:deck_pk>/cards/<int:pk>/update/', views.CardUpdateView.as_view(), name='card-update'),
     path('topics/<int:topic_pk>/decks/<int:deck_pk>/cards/<int:pk>/delete/', views.CardDeleteView.as_view(), name='card-delete'),
     path('cards/<int:card_pk>/track/', views.track_learning_event, name='track-learning'),
+    path('cards/track/', views.track_learning_events, name='track-learning-batch'),
 
     # Learn Mode URLs
     path('topics/<int:topic_pk>/decks/<int:deck_pk>/learn/', views.LearnView.as_view(), name='learn-cards'),
     path('topics/<int:topic_pk>/decks/<int:deck_pk>/learn/get-deck/', views.get_deck_for_learning, name='get-deck-for-learning'),
+    path('topics/<int:topic_pk>/decks/<int:deck_pk>/learn/sync/', views.sync_deck_for_learning, name='sync-deck-for-learning'),
     path('topics/<int:topic_pk>/decks/<int:deck_pk>/learn/get-card/', views.get_card_for_learning, name='get-card'),
     path('topics/<int:topic_pk>/decks/<int:deck_pk>/learn/update-progress/<int:card_pk>/', views.update_card_progress, name='update-progress'),
+
+    # Background jobs
+    path('jobs/<int:pk>/', views.JobDetailView.as_view(), name='job-detail'),
+    path('jobs/<int:pk>/status/', views.job_status, name='job-status'),
+    path('jobs/<int:pk>/download/', views.job_download, name='job-download'),
+
+    # Metrics
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
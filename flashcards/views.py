@@ -1,17 +1,26 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse_lazy, reverse
 from django.contrib.auth import login
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_http_methods, require_POST
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView, TemplateView
 from django.views.generic.edit import FormView
-from django.http import JsonResponse
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
 from django.utils import timezone
-from django.db.models import Q
-from .forms import RegistrationForm, ShareDeckForm, AcceptDeckForm, ShareTopicForm
-from .models import Topic, Deck, Card, User
-from datetime import timedelta
+from django.db.models import Count, Q
+from .forms import RegistrationForm, ShareDeckForm, AcceptDeckForm, ShareTopicForm, CardForm, ImportForm
+from .models import Topic, Deck, Card, DeckStats, Job, User
+from . import access, activity, bulk, caching, copying, exports, imports, jobs, linked, metrics, revisions, scheduling, search, sharding, stats, sync
+from .signals import cards_changed
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+import json
+from operator import attrgetter
 
 # --- Main Views ---
 
@@ -31,8 +40,6 @@ def register(request):
         form = RegistrationForm()
     return render(request, 'registration/register.html', {'form': form})
 
-from django.db.models import Count, Q
-
 class DashboardView(LoginRequiredMixin, TemplateView):
     template_name = "flashcards/dashboard.html"
 
@@ -40,48 +47,31 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         context = super().get_context_data(**kwargs)
         user = self.request.user
 
-        # Basic counts
-        user_topics = Topic.objects.filter(user=user)
-        user_decks = Deck.objects.filter(topic__user=user)
-        user_cards = Card.objects.filter(deck__topic__user=user)
-
-        context['topic_count'] = user_topics.count()
-        context['deck_count'] = user_decks.count()
-        context['card_count'] = user_cards.count()
+        # Counts and due decks come from the precomputed snapshot (see flashcards.stats)
+        user_stats = stats.get_user_stats(user)
+        context['topic_count'] = user_stats.topic_count
+        context['deck_count'] = user_stats.deck_count
+        context['card_count'] = user_stats.card_count
 
         # Decks to learn (practice suggestions)
-        decks_to_learn = user_decks.annotate(
-            card_count_in_deck=Count('cards')
-        ).filter(card_count_in_deck__gt=0).order_by('-card_count_in_deck')[:5]
-        
-        for deck in decks_to_learn:
-            deck.due_cards_count = deck.card_count_in_deck
-
-        context['decks_to_learn'] = decks_to_learn
+        context['decks_to_learn'] = stats.decks_due_for_review(user)
 
         # Recent topics
-        context['recent_topics'] = user_topics.order_by('-id')[:5]
+        context['recent_topics'] = Topic.objects.filter(user=user).annotate(deck_count=Count('decks')).order_by('-id')[:5]
         
-        # Weekly Progress
-        today = timezone.now().date()
-        week_start = today - timedelta(days=today.weekday())
-        
-        # Query for all cards learned by the user in the last 7 days
-        all_learned_cards = Card.objects.filter(
-            deck__topic__user=user, 
-            last_learned__date__gte=week_start
-        ).values('last_learned__date').annotate(count=Count('id'))
-        
-        learned_map = {item['last_learned__date']: item['count'] for item in all_learned_cards}
-        
-        learned_per_day = []
-        for i in range(7):
-            day = week_start + timedelta(days=i)
-            count = learned_map.get(day, 0)
-            learned_per_day.append(count)
-            
-        context['weekly_progress_labels'] = [(week_start + timedelta(days=i)).strftime("%a") for i in range(7)]
-        context['weekly_progress_data'] = learned_per_day
+        # Learning progress, read from the daily rollup (see flashcards.activity)
+        try:
+            progress_range = int(self.request.GET.get('progress', 7))
+        except ValueError:
+            progress_range = 7
+        if progress_range not in activity.PROGRESS_RANGES:
+            progress_range = 7
+        labels, reviews, correct = activity.progress_series(user, progress_range)
+        context['progress_range'] = progress_range
+        context['progress_ranges'] = activity.PROGRESS_RANGES
+        context['progress_labels'] = labels
+        context['progress_reviews'] = reviews
+        context['progress_correct'] = correct
 
         return context
 
@@ -93,7 +83,7 @@ class TopicListView(LoginRequiredMixin, ListView):
     template_name = 'flashcards/topic_list.html'
 
     def get_queryset(self):
-        return Topic.objects.filter(user=self.request.user).order_by('name')
+        return Topic.objects.filter(user=self.request.user).annotate(deck_count=Count('decks')).order_by('name')
 
 class TopicDetailView(LoginRequiredMixin, DetailView):
     model = Topic
@@ -105,7 +95,10 @@ class TopicDetailView(LoginRequiredMixin, DetailView):
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['decks'] = self.object.decks.all().order_by('name')
+        # A linked deck's cards belong to its source deck; only one of the counts is non-zero.
+        context['decks'] = self.object.decks.annotate(
+            card_count=Count('cards', distinct=True) + Count('source_deck__cards', distinct=True)
+        ).order_by('name')
         return context
 
 class TopicCreateView(LoginRequiredMixin, CreateView):
@@ -135,22 +128,75 @@ class TopicDeleteView(LoginRequiredMixin, DeleteView):
     def get_queryset(self):
         return Topic.objects.filter(user=self.request.user)
 
+    def form_valid(self, form):
+        if settings.BACKGROUND_JOBS:
+            # Cascading a large topic can take longer than a proxy timeout.
+            job = jobs.enqueue(self.request.user, 'delete_topic', topic=self.object.pk)
+            return redirect('job-detail', pk=job.pk)
+        return super().form_valid(form)
+
 # --- Deck CRUD ---
 
+DECK_PAGE_SIZE = 50
+DECK_PAGE_SIZES = (25, 50, 100, 200)
+
+def _deck_page_size(request):
+    try:
+        size = int(request.GET.get('page_size', DECK_PAGE_SIZE))
+    except ValueError:
+        return DECK_PAGE_SIZE
+    return size if size in DECK_PAGE_SIZES else DECK_PAGE_SIZE
+
+def _deck_card_page(deck, after, size):
+    """Returns up to `size` cards with ids above `after` and the cursor of the next page (or None)."""
+    cards = Card.objects.filter(deck_id=linked.content_deck_id(deck)).order_by('id')
+    if after:
+        cards = cards.filter(id__gt=after)
+    # One extra row tells us whether another page exists without a COUNT.
+    page = list(cards.only('id', 'front', 'back')[:size + 1])
+    next_cursor = page[size - 1].pk if len(page) > size else None
+    return page[:size], next_cursor
+
 class DeckDetailView(LoginRequiredMixin, DetailView):
     model = Deck
     template_name = 'flashcards/deck_detail.html'
     context_object_name = 'deck'
 
     def get_queryset(self):
-        return Deck.objects.filter(Q(topic__user=self.request.user) | Q(pk__in=self.request.user.shared_decks.all()))
+        return access.viewable_decks(self.request.user).select_related('topic', 'stats')
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['cards'] = self.object.cards.all().order_by('id')
+        page_size = _deck_page_size(self.request)
+        context['cards'], context['next_cursor'] = _deck_card_page(self.object, None, page_size)
+        context['page_size'] = page_size
+        context['page_sizes'] = DECK_PAGE_SIZES
+        # The count comes from the stats snapshot instead of a COUNT over the deck.
+        try:
+            context['card_count'] = self.object.stats.card_count
+        except DeckStats.DoesNotExist:
+            context['card_count'] = Card.objects.filter(deck_id=linked.content_deck_id(self.object)).count()
         context['topic'] = self.object.topic
         return context
 
+@login_required
+def deck_cards(request, topic_pk, pk):
+    """The next page of a deck's cards, as JSON or (with ?format=html) as rendered list items."""
+    deck = get_object_or_404(access.viewable_decks(request.user).select_related('topic'), pk=pk)
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+    cards, next_cursor = _deck_card_page(deck, after, _deck_page_size(request))
+    if request.GET.get('format') == 'html':
+        response = render(request, 'flashcards/deck_card_rows.html', {'deck': deck, 'cards': cards})
+        response['X-Next-Cursor'] = next_cursor or ''
+        return response
+    return JsonResponse({
+        'cards': [{'id': card.pk, 'front': card.front, 'back': card.back} for card in cards],
+        'next_cursor': next_cursor,
+    })
+
 class DeckCreateView(LoginRequiredMixin, CreateView):
     model = Deck
     fields = ['name']
@@ -208,6 +254,7 @@ class CardCreateView(LoginRequiredMixin, CreateView):
         deck = get_object_or_404(Deck, pk=self.kwargs['deck_pk'])
         if deck.topic.user != self.request.user:
             return redirect('home')
+        linked.materialize(deck)
         form.instance.deck = deck
         return super().form_valid(form)
 
@@ -221,83 +268,164 @@ class CardCreateView(LoginRequiredMixin, CreateView):
         context['topic'] = deck.topic
         return context
 
-class CardUpdateView(LoginRequiredMixin, UpdateView):
-    model = Card
-    fields = ['front', 'back']
-    template_name = 'flashcards/card_form.html'
-    context_object_name = 'card'
-
-    def get_queryset(self):
-        return Card.objects.filter(deck__topic__user=self.request.user)
+class DeckCardMixin:
+    """
+    Looks a card up through the deck in the URL. A linked deck shows its source
+    deck's cards; changing one (any POST) first gives the deck its own copies.
+    """
+    def get_object(self, queryset=None):
+        deck = get_object_or_404(Deck.objects.select_related('topic'), pk=self.kwargs['deck_pk'], topic__user=self.request.user)
+        card_pk = self.kwargs['pk']
+        if deck.source_deck_id is not None and self.request.method == 'POST':
+            card_pk = linked.materialize(deck).get(card_pk)
+        card = get_object_or_404(Card, pk=card_pk, deck_id=linked.content_deck_id(deck))
+        self.deck = deck
+        return card
 
     def get_success_url(self):
         return reverse('deck-detail', kwargs={'topic_pk': self.kwargs['topic_pk'], 'pk': self.kwargs['deck_pk']})
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        card = self.get_object()
-        context['deck'] = card.deck
-        context['topic'] = card.deck.topic
+        context['deck'] = self.deck
+        context['topic'] = self.deck.topic
         return context
 
-class CardDeleteView(LoginRequiredMixin, DeleteView):
+class CardUpdateView(LoginRequiredMixin, DeckCardMixin, UpdateView):
     model = Card
-    template_name = 'flashcards/card_confirm_delete.html'
+    fields = ['front', 'back']
+    template_name = 'flashcards/card_form.html'
     context_object_name = 'card'
 
-    def get_queryset(self):
-        return Card.objects.filter(deck__topic__user=self.request.user)
-
-    def get_success_url(self):
-        return reverse('deck-detail', kwargs={'topic_pk': self.kwargs['topic_pk'], 'pk': self.kwargs['deck_pk']})
+class CardDeleteView(LoginRequiredMixin, DeckCardMixin, DeleteView):
+    model = Card
+    template_name = 'flashcards/card_confirm_delete.html'
+    context_object_name = 'card'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        card = self.get_object()
-        context['deck'] = card.deck
-        context['topic'] = card.deck.topic
-        return context
+    def form_valid(self, form):
+        response = super().form_valid(form)
+        cards_changed.send(sender=Card, deck_ids=[self.object.deck_id])
+        return response
+
+# Upper bound on the rows of one bulk edit; keeps its transaction short.
+MAX_CARDS_PER_BULK_EDIT = 5000
+BULK_EDIT_BATCH_SIZE = 500
+
+def _validate_bulk_card_edit(deck, payload):
+    """
+    Validates a bulk edit of the deck's cards:
+    {"create": [{"front", "back"}], "update": [{"id", "front", "back"}], "delete": [id]},
+    every list optional. Returns (creates, updates, deletes, errors): (front, back)
+    and (id, front, back) tuples, card ids, and one {"op", "index", "errors":
+    {field: [messages]}} dict per invalid row. Raises ValueError for a malformed payload.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError('Expected an object with "create", "update" and "delete" lists.')
+    rows = {op: payload.get(op, []) for op in ('create', 'update', 'delete')}
+    if not all(isinstance(op_rows, list) for op_rows in rows.values()):
+        raise ValueError('"create", "update" and "delete" must be lists.')
+    if sum(map(len, rows.values())) > MAX_CARDS_PER_BULK_EDIT:
+        raise ValueError(f'At most {MAX_CARDS_PER_BULK_EDIT} cards per request.')
+    if not all(isinstance(row, dict) for row in rows['create'] + rows['update']):
+        raise ValueError('Each "create" and "update" row must be an object.')
+
+    # A linked deck shows its source deck's cards, so those are the ids the client knows.
+    requested_ids = [row.get('id') for row in rows['update']] + rows['delete']
+    known_ids = set(Card.objects.filter(
+        deck_id=linked.content_deck_id(deck), pk__in=[card_id for card_id in requested_ids if type(card_id) is int]
+    ).values_list('pk', flat=True))
+
+    errors = []
+    seen_ids = set()
+
+    def card_id_error(card_id):
+        if type(card_id) is not int or card_id not in known_ids:
+            return 'No such card in this deck.'
+        if card_id in seen_ids:
+            return 'The card appears more than once.'
+        seen_ids.add(card_id)
+
+    def content(op, index, row):
+        form = CardForm(row)
+        if form.is_valid():
+            return form.cleaned_data['front'], form.cleaned_data['back']
+        errors.append({'op': op, 'index': index, 'errors': {field: list(messages) for field, messages in form.errors.items()}})
+
+    creates = [content('create', index, row) for index, row in enumerate(rows['create'])]
+    updates = []
+    for index, row in enumerate(rows['update']):
+        id_error = card_id_error(row.get('id'))
+        if id_error:
+            errors.append({'op': 'update', 'index': index, 'errors': {'id': [id_error]}})
+        updates.append((row.get('id'), *(content('update', index, row) or (None, None))))
+    for index, card_id in enumerate(rows['delete']):
+        id_error = card_id_error(card_id)
+        if id_error:
+            errors.append({'op': 'delete', 'index': index, 'errors': {'id': [id_error]}})
+    return creates, updates, rows['delete'], errors
+
+def _apply_bulk_card_edit(deck, creates, updates, deletes):
+    """Writes a validated bulk edit in one transaction; returns the new cards' ids in request order."""
+    with sharding.atomic():
+        # Editing a linked deck first gives it its own copies of the cards.
+        card_ids = linked.materialize(deck)
+        if card_ids:
+            updates = [(card_ids[card_id], front, back) for card_id, front, back in updates]
+            deletes = [card_ids[card_id] for card_id in deletes]
+        Card.objects.filter(deck=deck, pk__in=deletes).delete()
+        bulk.update_cards(updates)
+        # bulk_create() returns the new ids, which bulk.insert_cards() does not.
+        created = Card.objects.bulk_create(
+            [Card(deck=deck, front=front, back=back) for front, back in creates], batch_size=BULK_EDIT_BATCH_SIZE
+        )
+        # None of the writes sent post_save; this refreshes the deck's stats and revision.
+        cards_changed.send(sender=Card, deck_ids=[deck.pk])
+    return [card.pk for card in created]
 
-import json
+@login_required
+@require_POST
+def bulk_edit_cards(request, topic_pk, deck_pk):
+    """
+    Creates, updates and deletes any number of the deck's cards in one request
+    (see _validate_bulk_card_edit for the JSON body). Nothing is saved unless
+    every row is valid; otherwise the response lists each invalid row's errors.
+    """
+    deck = get_object_or_404(Deck.objects.select_related('topic'), pk=deck_pk, topic_id=topic_pk, topic__user=request.user)
+    try:
+        creates, updates, deletes, errors = _validate_bulk_card_edit(deck, json.loads(request.body))
+    except (ValueError, UnicodeDecodeError) as e:
+        # json.JSONDecodeError is a subclass of ValueError
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    if errors:
+        return JsonResponse(
+            {'status': 'error', 'message': 'Some rows are invalid; nothing was saved.', 'errors': errors}, status=400
+        )
+    created = _apply_bulk_card_edit(deck, creates, updates, deletes)
+    return JsonResponse({'status': 'success', 'created': created, 'updated': len(updates), 'deleted': len(deletes)})
 
 # --- Export Views ---
 @login_required
 def export_topic(request, pk):
     topic = get_object_or_404(Topic, pk=pk, user=request.user)
-    
-    decks_data = []
-    for deck in topic.decks.all():
-        cards_data = [{'front': card.front, 'back': card.back} for card in deck.cards.all()]
-        decks_data.append({'name': deck.name, 'cards': cards_data})
-        
-    data = {
-        'type': 'topic',
-        'name': topic.name,
-        'decks': decks_data,
-    }
-    
-    response = JsonResponse(data)
-    response['Content-Disposition'] = f'attachment; filename="topic_{topic.id}_{topic.name}.json"'
-    return response
+    etag = revisions.topic_etag(topic, 'export', exports.response_encoding(request))
+    # A client holding the current export needs neither a job nor a download.
+    not_modified = revisions.not_modified(request, etag)
+    if not_modified:
+        return not_modified
+    if settings.BACKGROUND_JOBS:
+        job = jobs.enqueue(request.user, 'export_topic', topic=topic.pk)
+        return redirect('job-detail', pk=job.pk)
+    response = exports.export_response(request, exports.iter_topic_json(topic), f"topic_{topic.id}_{topic.name}.json")
+    return revisions.add_etag(response, etag)
 
 @login_required
 def export_deck(request, topic_pk, pk):
     deck = get_object_or_404(Deck, pk=pk, topic__user=request.user)
-    
-    cards_data = [{'front': card.front, 'back': card.back} for card in deck.cards.all()]
-    
-    data = {
-        'type': 'deck',
-        'name': deck.name,
-        'cards': cards_data,
-    }
-    
-    response = JsonResponse(data)
-    response['Content-Disposition'] = f'attachment; filename="deck_{deck.id}_{deck.name}.json"'
-    return response
-
-from .forms import RegistrationForm, ShareDeckForm, AcceptDeckForm, ShareTopicForm, ImportForm
-import json
+    etag = revisions.deck_etag(deck, 'export', exports.response_encoding(request))
+    response = revisions.not_modified(request, etag)
+    if response is None:
+        response = exports.export_response(request, exports.iter_deck_json(deck), f"deck_{deck.id}_{deck.name}.json")
+    return revisions.add_etag(response, etag)
 
 class ImportView(LoginRequiredMixin, FormView):
     form_class = ImportForm
@@ -305,55 +433,19 @@ class ImportView(LoginRequiredMixin, FormView):
     success_url = reverse_lazy('topic-list')
 
     def form_valid(self, form):
-        json_file = form.cleaned_data['file']
+        if settings.BACKGROUND_JOBS:
+            job = jobs.enqueue_import(self.request.user, form.cleaned_data['file'])
+            return redirect('job-detail', pk=job.pk)
         try:
-            data = json.load(json_file)
-        except json.JSONDecodeError:
-            form.add_error('file', 'Invalid JSON file.')
+            report = imports.import_file(self.request.user, form.cleaned_data['file'])
+        except imports.ImportFormatError as e:
+            form.add_error('file', str(e))
             return self.form_invalid(form)
-
-        if data.get('type') == 'topic':
-            self._import_topic(data)
-        elif data.get('type') == 'deck':
-            self._import_deck(data)
-        else:
-            form.add_error('file', 'Invalid file format: missing "type" key.')
+        except (ValueError, UnicodeDecodeError):
+            # json.JSONDecodeError is a subclass of ValueError
+            form.add_error('file', 'Invalid JSON file.')
             return self.form_invalid(form)
-
-        return super().form_valid(form)
-
-    def _import_topic(self, data):
-        # Create a new topic, adding a suffix to avoid name conflicts
-        new_topic = Topic.objects.create(
-            name=f"{data.get('name', 'Imported Topic')} (imported)",
-            user=self.request.user
-        )
-        for deck_data in data.get('decks', []):
-            new_deck = Deck.objects.create(
-                name=deck_data.get('name', 'Imported Deck'),
-                topic=new_topic
-            )
-            cards_to_create = [
-                Card(deck=new_deck, front=card.get('front'), back=card.get('back'))
-                for card in deck_data.get('cards', [])
-            ]
-            Card.objects.bulk_create(cards_to_create)
-
-    def _import_deck(self, data):
-        # Get or create a default topic for imported decks
-        import_topic, _ = Topic.objects.get_or_create(
-            name="[Imported Decks]",
-            user=self.request.user
-        )
-        new_deck = Deck.objects.create(
-            name=f"{data.get('name', 'Imported Deck')} (imported)",
-            topic=import_topic
-        )
-        cards_to_create = [
-            Card(deck=new_deck, front=card.get('front'), back=card.get('back'))
-            for card in data.get('cards', [])
-        ]
-        Card.objects.bulk_create(cards_to_create)
+        return render(self.request, 'flashcards/import_report.html', {'report': report})
 
 # --- Learning Mode Views ---
 
@@ -363,7 +455,11 @@ class SharedWithMeListView(LoginRequiredMixin, ListView):
     template_name = 'flashcards/shared_with_me.html'
 
     def get_queryset(self):
-        return self.request.user.shared_decks.all().order_by('name')
+        user = self.request.user
+        # Shares are kept with the shared deck, on its owner's shard.
+        return caching.fetch('shared_decks', user.pk, [], lambda: sorted(
+            sharding.gather(user.shared_decks.select_related('topic__user')), key=attrgetter('name')
+        ))
 
 class SharedTopicListView(LoginRequiredMixin, ListView):
     model = Topic
@@ -371,7 +467,10 @@ class SharedTopicListView(LoginRequiredMixin, ListView):
     template_name = 'flashcards/shared_topics.html'
 
     def get_queryset(self):
-        return self.request.user.shared_topics.all().order_by('name')
+        user = self.request.user
+        return caching.fetch('shared_topics', user.pk, [], lambda: sorted(
+            sharding.gather(user.shared_topics.select_related('user')), key=attrgetter('name')
+        ))
 
 class ShareDeckView(LoginRequiredMixin, FormView):
     form_class = ShareDeckForm
@@ -408,17 +507,17 @@ class AcceptSharedDeckView(LoginRequiredMixin, FormView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['shared_deck'] = get_object_or_404(Deck, pk=self.kwargs['pk'])
+        context['shared_deck'] = get_object_or_404(Deck, pk=self.kwargs['pk'], shared_with=self.request.user)
         return context
 
     def form_valid(self, form):
-        original_deck = get_object_or_404(Deck, pk=self.kwargs['pk'])
+        original_deck = get_object_or_404(Deck, pk=self.kwargs['pk'], shared_with=self.request.user)
         target_topic = form.cleaned_data['topic']
-        new_deck = Deck.objects.create(name=original_deck.name, topic=target_topic)
-        cards_to_create = [Card(deck=new_deck, front=card.front, back=card.back) for card in original_deck.cards.all()]
-        Card.objects.bulk_create(cards_to_create)
-        original_deck.shared_with.remove(self.request.user)
-        self.success_url = reverse('deck-detail', kwargs={'topic_pk': new_deck.topic.pk, 'pk': new_deck.pk})
+        if settings.BACKGROUND_JOBS:
+            job = jobs.enqueue(self.request.user, 'accept_deck', deck=original_deck.pk, topic=target_topic.pk)
+            return redirect('job-detail', pk=job.pk)
+        new_deck_id = copying.accept_deck(original_deck, target_topic, self.request.user)['decks'][original_deck.pk]
+        self.success_url = reverse('deck-detail', kwargs={'topic_pk': target_topic.pk, 'pk': new_deck_id})
         return super().form_valid(form)
 
 @login_required
@@ -455,14 +554,12 @@ class ShareTopicView(LoginRequiredMixin, FormView):
 @login_required
 @require_POST
 def accept_shared_topic(request, pk):
-    original_topic = get_object_or_404(Topic, pk=pk)
-    new_topic = Topic.objects.create(name=original_topic.name, user=request.user)
-    for original_deck in original_topic.decks.all():
-        new_deck = Deck.objects.create(name=original_deck.name, topic=new_topic)
-        cards_to_create = [Card(deck=new_deck, front=card.front, back=card.back) for card in original_deck.cards.all()]
-        Card.objects.bulk_create(cards_to_create)
-    original_topic.shared_with.remove(request.user)
-    return redirect('topic-detail', pk=new_topic.pk)
+    original_topic = get_object_or_404(Topic, pk=pk, shared_with=request.user)
+    if settings.BACKGROUND_JOBS:
+        job = jobs.enqueue(request.user, 'accept_topic', topic=original_topic.pk)
+        return redirect('job-detail', pk=job.pk)
+    new_topic_id = copying.accept_topic(original_topic, request.user)['topic'][original_topic.pk]
+    return redirect('topic-detail', pk=new_topic_id)
 
 @login_required
 @require_POST
@@ -478,20 +575,125 @@ class LearnView(LoginRequiredMixin, TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        deck = get_object_or_404(Deck, pk=self.kwargs['deck_pk'])
-        if deck.topic.user != self.request.user and self.request.user not in deck.shared_with.all():
-            return redirect('home')
+        deck = access.get_viewable_deck_or_404(self.request, self.kwargs['deck_pk'])
         context['deck'] = deck
         context['topic'] = deck.topic
         return context
 
+LEARNING_PAGE_SIZE = 50
+MAX_LEARNING_PAGE_SIZE = 500
+# Rows fetched per database round trip when streaming NDJSON.
+LEARNING_STREAM_CHUNK_SIZE = 2000
+
+def _learning_cards(deck, user_id, mode, cursor):
+    """
+    Returns the ordered card queryset for the user's learning session,
+    positioned after `cursor`. 'due' mode is keyset-paginated on (next_review_date, id), most
+    overdue first; 'all' mode walks the whole deck by id. Raises ValueError
+    for a malformed cursor.
+    """
+    cards = linked.deck_cards(deck, user_id)
+    if mode == 'all':
+        cards = cards.order_by('id')
+        if cursor:
+            cards = cards.filter(id__gt=int(cursor))
+        return cards
+
+    cards = cards.filter(due_at__lte=timezone.now()).order_by('due_at', 'id')
+    if cursor:
+        review_date, _, card_id = cursor.rpartition('_')
+        review_date, card_id = datetime.fromisoformat(review_date), int(card_id)
+        cards = cards.filter(Q(due_at__gt=review_date) | Q(due_at=review_date, id__gt=card_id))
+    return cards
+
+def _learning_cursor(mode, card):
+    if mode == 'all':
+        return str(card['id'])
+    return f"{card['due_at'].isoformat()}_{card['id']}"
+
+def _stream_learning_cards(cards):
+    for card in cards.values('id', 'front', 'back').iterator(chunk_size=LEARNING_STREAM_CHUNK_SIZE):
+        yield json.dumps(card) + '\n'
+
+async def _astream_learning_cards(cards):
+    async for card in cards.values('id', 'front', 'back').aiterator(chunk_size=LEARNING_STREAM_CHUNK_SIZE):
+        yield json.dumps(card) + '\n'
+
+async def _learning_etag(deck, mode):
+    """
+    The ETag of a learning payload, or None. 'all' mode depends on the
+    deck's content only; 'due' mode also on its reviews and on which cards
+    have become due, which changes exactly at DeckStats.due_valid_until.
+    The deck's stats follow its owner's schedule, so 'due' mode has no ETag
+    for the users it is shared with or who learn it through a linked deck.
+    """
+    if mode == 'all':
+        return revisions.deck_etag(deck, 'all')
+    if deck.role != access.OWNER:
+        return None
+    try:
+        deck_stats = deck.stats
+    except DeckStats.DoesNotExist:
+        return None
+    due_valid_until = deck_stats.due_valid_until
+    now = timezone.now()
+    if due_valid_until is not None and due_valid_until <= now:
+        [refreshed] = await sync_to_async(stats.refresh_deck_stats)(
+            [deck.pk], now, user_id=deck.topic.user_id, source_deck_ids={deck.pk: deck.source_deck_id}
+        )
+        due_valid_until = refreshed.due_valid_until
+    window = due_valid_until.timestamp() if due_valid_until else 'never'
+    return revisions.deck_etag(deck, 'due', deck_stats.schedule_version, window)
+
+async def _learning_response(request, deck, mode):
+    cursor = request.GET.get('after')
+    user_id = (await request.auser()).pk
+    try:
+        cards = _learning_cards(deck, user_id, mode, cursor)
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid cursor'}, status=400)
+
+    if request.GET.get('format') == 'ndjson':
+        # Streams the remaining cards in constant memory, one JSON object per line. The
+        # iterator must match the server: either kind is buffered whole by the other.
+        stream = _astream_learning_cards if isinstance(request, ASGIRequest) else _stream_learning_cards
+        return StreamingHttpResponse(stream(cards), content_type='application/x-ndjson')
+
+    try:
+        limit = min(max(int(request.GET.get('limit', LEARNING_PAGE_SIZE)), 1), MAX_LEARNING_PAGE_SIZE)
+    except ValueError:
+        limit = LEARNING_PAGE_SIZE
+    # One extra row tells us whether another page exists without a COUNT.
+    page = [card async for card in cards.values('id', 'front', 'back', 'due_at')[:limit + 1]]
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    data = {
+        'cards': [{'id': card['id'], 'front': card['front'], 'back': card['back']} for card in page],
+        'next_cursor': _learning_cursor(mode, page[-1]) if has_more else None,
+    }
+    if not page and mode == 'due' and not cursor:
+        data['next_review'] = await linked.deck_cards(deck, user_id).order_by('due_at').values_list('due_at', flat=True).afirst()
+    return JsonResponse(data)
+
+# The learning endpoints are async views: under ASGI a learner waiting on the
+# database does not hold a worker thread. Writes that need a transaction run
+# through sync_to_async, since the async ORM has no transactions.
+
 @login_required
-def get_deck_for_learning(request, topic_pk, deck_pk):
-    deck = get_object_or_404(Deck, pk=deck_pk)
-    if deck.topic.user != request.user and request.user not in deck.shared_with.all():
+async def get_deck_for_learning(request, topic_pk, deck_pk):
+    deck = await access.aget_deck_or_404(request, deck_pk, Deck.objects.select_related('topic', 'stats'))
+    if deck.role not in access.VIEW_ROLES:
         return JsonResponse({'status': 'error', 'message': 'Permission denied'}, status=403)
-    cards = list(deck.cards.values('id', 'front', 'back'))
-    return JsonResponse({'cards': cards})
+
+    mode = 'all' if request.GET.get('mode') == 'all' else 'due'
+    etag = await _learning_etag(deck, mode)
+    if etag:
+        not_modified = revisions.not_modified(request, etag)
+        if not_modified:
+            return not_modified
+    response = await _learning_response(request, deck, mode)
+    return revisions.add_etag(response, etag) if etag and response.status_code == 200 else response
 
 # DEPRECATED - The following views are no longer used by the new learning mode
 @login_required
@@ -503,15 +705,204 @@ def update_card_progress(request, topic_pk, deck_pk, card_pk):
     return JsonResponse({'status': 'error', 'message': 'This view is deprecated.'}, status=410)
 
 @login_required
-@require_POST
 def track_learning_event(request, card_pk):
-    card = get_object_or_404(Card, pk=card_pk)
-    # Basic permission check
-    if card.deck.topic.user != request.user and request.user not in card.deck.shared_with.all():
+    # Replaced by track_learning_events, which schedules reviews by the client's clock.
+    return JsonResponse({'status': 'error', 'message': 'This view is deprecated.'}, status=410)
+
+# Upper bound on events accepted in one batch; keeps the request (and the
+# keepalive body sent on pagehide, limited to 64 KB by browsers) small.
+MAX_EVENTS_PER_BATCH = 500
+
+def _parse_learning_events(payload):
+    """Returns a list of (card_id, correct, reviewed_at) tuples or raises ValueError."""
+    events = payload.get('events') if isinstance(payload, dict) else None
+    if not isinstance(events, list):
+        raise ValueError('Expected an "events" list.')
+    if len(events) > MAX_EVENTS_PER_BATCH:
+        raise ValueError(f'At most {MAX_EVENTS_PER_BATCH} events per batch.')
+
+    now = timezone.now()
+    parsed = []
+    for event in events:
+        if not isinstance(event, dict):
+            raise ValueError('Each event must be an object.')
+        card_id, correct, ts = event.get('card'), event.get('correct'), event.get('ts')
+        if type(card_id) is not int or not isinstance(correct, bool) or type(ts) not in (int, float):
+            raise ValueError('Each event needs an integer "card", a boolean "correct" and a numeric "ts".')
+        try:
+            reviewed_at = datetime.fromtimestamp(ts / 1000, tz=dt_timezone.utc)
+        except (OverflowError, OSError, ValueError):
+            raise ValueError('Invalid timestamp.')
+        # Never trust a client clock that runs ahead of ours.
+        parsed.append((card_id, correct, min(reviewed_at, now)))
+    # Stable sort: events recorded in the same millisecond keep their order.
+    parsed.sort(key=lambda event: event[2])
+    return parsed
+
+def _apply_learning_events(user, events):
+    """Applies parsed learning events to the cards' schedules; returns (applied, ignored)."""
+    # Each card is reviewed on its own shard (see flashcards.sharding).
+    by_shard = defaultdict(list)
+    for event in events:
+        by_shard[sharding.shard_of_id(event[0])].append(event)
+    applied = ignored = 0
+    for shard, shard_events in by_shard.items():
+        with sharding.using_shard(shard):
+            shard_applied, shard_ignored = _apply_shard_learning_events(user, shard_events)
+        applied += shard_applied
+        ignored += shard_ignored
+    return applied, ignored
+
+def _apply_shard_learning_events(user, events):
+    card_ids = {card_id for card_id, _, _ in events}
+    applied_events = []
+    ignored = 0
+    with sharding.atomic():
+        # One query resolves both the cards and the permission check.
+        cards = linked.learnable_cards(user, card_ids)
+        # Only the owner's reviews schedule the cards themselves; everyone else's progress is kept per user.
+        progress = linked.load_progress(user, [card for card in cards.values() if not card.owned])
+        changed = {}
+        for card_id, correct, reviewed_at in events:
+            card = progress.get(card_id) or cards.get(card_id)
+            # Events at or before the last recorded review were already applied,
+            # which makes re-sending a batch (e.g. after a lost response) harmless.
+            if card is None or (card.last_learned and reviewed_at <= card.last_learned):
+                ignored += 1
+                continue
+            scheduling.review(card, correct, reviewed_at)
+            changed[card_id] = card
+            applied_events.append((card_id, correct, reviewed_at))
+        changed_cards = [card for card_id, card in changed.items() if card_id not in progress]
+        Card.objects.bulk_update(changed_cards, scheduling.SCHEDULE_FIELDS)
+        stats.mark_due_counts_stale({card.deck_id for card in changed_cards})
+        linked.save_progress(user, [card for card_id, card in changed.items() if card_id in progress])
+        # The review history belongs on the reviewer's home shard.
+        with sharding.using_shard(sharding.home_shard(user.pk)):
+            activity.record_reviews(user, applied_events)
+    return len(applied_events), ignored
+
+@login_required
+@require_POST
+async def track_learning_events(request):
+    try:
+        events = _parse_learning_events(json.loads(request.body))
+    except (ValueError, UnicodeDecodeError) as e:
+        # json.JSONDecodeError is a subclass of ValueError
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    applied, ignored = await sync_to_async(_apply_learning_events)(await request.auser(), events)
+    return JsonResponse({'status': 'success', 'applied': applied, 'ignored': ignored})
+
+# --- Offline learning ---
+
+@login_required
+@require_http_methods(['GET', 'POST'])
+async def sync_deck_for_learning(request, topic_pk, deck_pk):
+    """
+    Delta sync of a deck for offline learning (see flashcards.sync). GET
+    ?token=... returns the changes since that token; a POST of
+    {"token": ..., "events": [...]} first applies reviews recorded offline.
+    """
+    deck = await access.aget_deck_or_404(request, deck_pk)
+    if deck.role not in access.VIEW_ROLES:
         return JsonResponse({'status': 'error', 'message': 'Permission denied'}, status=403)
-    
-    card.last_learned = timezone.now()
-    card.learned_count += 1
-    card.save(update_fields=['last_learned', 'learned_count'])
-    
-    return JsonResponse({'status': 'success'})
+
+    user_id = (await request.auser()).pk
+    if request.method == 'GET':
+        return JsonResponse(await sync_to_async(sync.changes)(deck, request.GET.get('token'), user_id))
+
+    try:
+        payload = json.loads(request.body)
+        events = _parse_learning_events(payload)
+    except (ValueError, UnicodeDecodeError) as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    applied, ignored = await sync_to_async(_apply_learning_events)(await request.auser(), events)
+    # Read after the reviews, so the response carries their new schedules.
+    reviewed = {card_id for card_id, _, _ in events}
+    data = await sync_to_async(sync.changes)(deck, payload.get('token'), user_id, reviewed)
+    data.update(applied=applied, ignored=ignored)
+    return JsonResponse(data)
+
+def learn_service_worker(request):
+    """
+    The service worker that keeps learning pages usable offline. Served from
+    the site root (rather than STATIC_URL) so it may control the deck pages.
+    """
+    response = render(request, 'flashcards/learn_sw.js', content_type='application/javascript')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+# --- Search ---
+
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE = 50
+
+@login_required
+def card_search(request):
+    """Ranked full-text search over the cards of the user's own and shared decks."""
+    query = request.GET.get('q', '').strip()
+    try:
+        page = min(max(int(request.GET.get('page', 1)), 1), MAX_SEARCH_PAGE)
+    except ValueError:
+        page = 1
+    results, has_next = search.search_cards(
+        request.user, query, offset=(page - 1) * SEARCH_PAGE_SIZE, limit=SEARCH_PAGE_SIZE
+    )
+    has_next = has_next and page < MAX_SEARCH_PAGE
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'results': [
+                {
+                    'id': result['id'], 'front': result['front'], 'back': result['back'],
+                    'front_html': result['front_html'], 'back_html': result['back_html'],
+                    'deck': result['deck'].pk, 'topic': result['deck'].topic_id,
+                    'url': reverse('deck-detail', args=[result['deck'].topic_id, result['deck'].pk]),
+                }
+                for result in results
+            ],
+            'page': page,
+            'has_next': has_next,
+        })
+    return render(request, 'flashcards/search_results.html', {
+        'query': query, 'results': results, 'page': page, 'has_next': has_next,
+    })
+
+# --- Background Jobs ---
+
+class JobDetailView(LoginRequiredMixin, DetailView):
+    model = Job
+    template_name = 'flashcards/job_detail.html'
+    context_object_name = 'job'
+
+    def get_queryset(self):
+        return Job.objects.filter(user=self.request.user)
+
+@login_required
+def job_status(request, pk):
+    job = get_object_or_404(Job, pk=pk, user=request.user)
+    return JsonResponse(jobs.status(job))
+
+@login_required
+def job_download(request, pk):
+    job = get_object_or_404(Job, pk=pk, user=request.user, status=Job.SUCCEEDED)
+    path = jobs.result_path(job)
+    if path is None or not path.exists():
+        raise Http404("This job has no downloadable result.")
+    filename = (job.result or {}).get('filename', path.name)
+    return FileResponse(path.open('rb'), as_attachment=True, filename=filename)
+
+# --- Metrics ---
+
+def metrics_view(request):
+    """Prometheus metrics; for staff users, or scrapers sending `Authorization: Bearer <METRICS_TOKEN>`."""
+    if not settings.METRICS_ENABLED:
+        raise Http404("Metrics are disabled.")
+    token = settings.METRICS_TOKEN
+    authorized = request.user.is_active and request.user.is_staff
+    if not authorized and token:
+        authorized = constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,68 @@
+// Keeps learning pages usable offline. The deck's cards and unsent reviews
+// live in IndexedDB (see learn_cards.html); this worker only caches the page
+// itself and the stylesheets, scripts and fonts it loads.
+const CACHE = 'learn-v1';
+const DATABASE = 'learn-decks';
+const LEARN_PAGE = /^\/topics\/\d+\/decks\/\d+\/learn\/$/;
+const LOGOUT_URL = "{% url 'logout' %}";
+
+self.addEventListener('install', () => self.skipWaiting());
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(names.filter(name => name !== CACHE).map(name => caches.delete(name))))
+            .then(() => self.clients.claim())
+    );
+});
+
+// Network first, so an online learner always gets the current page.
+async function networkFirst(request) {
+    const cache = await caches.open(CACHE);
+    try {
+        const response = await fetch(request);
+        // A redirect (e.g. to the login page) must not be cached as the learning page.
+        if (response.ok && !response.redirected) cache.put(request, response.clone());
+        return response;
+    } catch (error) {
+        const cached = await cache.match(request);
+        if (cached) return cached;
+        throw error;
+    }
+}
+
+// Cached assets are served at once and refreshed in the background.
+async function staleWhileRevalidate(event) {
+    const cache = await caches.open(CACHE);
+    const cached = await cache.match(event.request);
+    const refresh = fetch(event.request).then(response => {
+        if (response.ok || response.type === 'opaque') cache.put(event.request, response.clone());
+        return response;
+    });
+    if (cached) {
+        event.waitUntil(refresh.catch(() => {}));
+        return cached;
+    }
+    return refresh;
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+
+    if (request.method === 'POST' && url.origin === self.location.origin && url.pathname === LOGOUT_URL) {
+        // Nothing studied offline should outlive the session on a shared device.
+        event.waitUntil(Promise.all([caches.delete(CACHE), new Promise(resolve => {
+            const deletion = indexedDB.deleteDatabase(DATABASE);
+            deletion.onsuccess = deletion.onerror = deletion.onblocked = resolve;
+        })]));
+        return;
+    }
+    if (request.method !== 'GET') return;
+
+    if (request.mode === 'navigate' && url.origin === self.location.origin && LEARN_PAGE.test(url.pathname)) {
+        event.respondWith(networkFirst(request));
+    } else if (['style', 'script', 'font'].includes(request.destination)) {
+        event.respondWith(staleWhileRevalidate(event));
+    }
+});